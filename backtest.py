@@ -0,0 +1,79 @@
+# Basic libraries
+import multiprocessing
+import numpy as np
+from detectors import create_anomaly_detector
+from symbol_arrays import FeatureMatrix
+import warnings
+warnings.filterwarnings("ignore")
+
+# Backtest used inside each worker process of the window pool
+worker_backtest = None
+
+def initialize_backtest_worker(backtest):
+	global worker_backtest
+	worker_backtest = backtest
+
+def score_window_in_worker(bars_back):
+	return worker_backtest.score_window(bars_back)
+
+class WalkForwardBacktest:
+	"""
+	Walk-forward test of the anomaly detector on prices that were gathered once. A window is defined by a cut point bars_back bars before the end of every symbol.
+	The technical indicators are computed only from the bars right before the cut point, and every window fits its own detector on all symbols.
+	"""
+	def __init__(self, ta_engine, historical_price_info, future_bars, detector = "isolation_forest", detector_parameters = None, workers = 1):
+		self.taEngine = ta_engine
+		self.prices = historical_price_info.prices
+		self.offsets = historical_price_info.offsets
+		self.bar_counts = np.diff(self.offsets)
+		self.FUTURE_BARS = future_bars
+		self.DETECTOR = detector
+		self.DETECTOR_PARAMETERS = detector_parameters if detector_parameters is not None else {}
+		self.WORKERS = workers
+
+		# Bars that a symbol needs before the cut point so its indicators can be computed
+		self.MINIMUM_BARS = self.taEngine.HISTORY_TO_USE + 2
+
+	def get_cut_points(self, number_of_windows, step_bars):
+		"""
+		Number of bars after every cut point, latest cut point first. The latest one leaves exactly future_bars bars after it.
+		Cut points that leave no symbol with enough history are skipped.
+		"""
+		longest_history = self.bar_counts.max() if len(self.bar_counts) > 0 else 0
+		cut_points = [self.FUTURE_BARS + i * step_bars for i in range(0, number_of_windows)]
+		return [bars_back for bars_back in cut_points if longest_history - bars_back >= self.MINIMUM_BARS]
+
+	def score_window(self, bars_back):
+		"""
+		Fit a detector on the features at one cut point. Returns the indices of the scored symbols and their anomaly scores.
+		"""
+		symbol_indices = np.flatnonzero(self.bar_counts - bars_back >= self.MINIMUM_BARS)
+		ends = self.offsets[symbol_indices + 1] - bars_back
+		window_prices = [self.taEngine.get_feature_window(self.prices.iloc[start:end]) for start, end in zip(self.offsets[symbol_indices], ends)]
+
+		features = FeatureMatrix(len(window_prices))
+		computed_positions = []
+		for i, (features_dictionary, error) in enumerate(self.taEngine.get_technical_indicators_for_all(window_prices)):
+			if error is None:
+				features.append(self.taEngine.get_features(features_dictionary))
+				computed_positions.append(i)
+
+		valid_rows = np.flatnonzero(features.get_valid_rows())
+		symbol_indices = symbol_indices[np.asarray(computed_positions, dtype = np.int64)[valid_rows]]
+		if len(symbol_indices) < 2:
+			return symbol_indices, np.zeros(len(symbol_indices))
+
+		window_features = features.get_rows(valid_rows)
+		detector = create_anomaly_detector(self.DETECTOR, **self.DETECTOR_PARAMETERS)
+		detector.fit(window_features)
+		return symbol_indices, detector.decision_function(window_features)
+
+	def score_windows(self, cut_points):
+		"""
+		Score every window, in parallel if there is more than one worker. Results come back in the order of cut_points.
+		"""
+		if self.WORKERS > 1 and len(cut_points) > 1:
+			# Workers are forked, so they get the prices without pickling them
+			with multiprocessing.Pool(min(self.WORKERS, len(cut_points)), initializer = initialize_backtest_worker, initargs = (self,)) as pool:
+				return list(pool.imap(score_window_in_worker, cut_points))
+		return [self.score_window(bars_back) for bars_back in cut_points]
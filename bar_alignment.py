@@ -0,0 +1,85 @@
+# Basic libraries
+import numpy as np
+import pandas as pd
+
+PRICE_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+class BarCalendar:
+	"""
+	Shared timestamp index of a run. The first warmup_symbols symbols with data vote on it: a timestamp is on the index if at least half of them
+	have a bar at that time. Every symbol is then reindexed onto the index, so all symbols have the same bars at the same times. Bars that a symbol
+	is missing are filled with its last close and no volume and marked in a gap mask, bars that are not on the index are left out.
+	"""
+	def __init__(self, warmup_symbols = 20):
+		self.WARMUP_SYMBOLS = warmup_symbols
+		self.samples = []
+		self.timestamps = None
+
+	def is_ready(self):
+		return self.timestamps is not None
+
+	def add_sample(self, stock_prices):
+		if stock_prices is not None and len(stock_prices) > 0:
+			self.samples.append(stock_prices["Datetime"])
+
+	def build(self):
+		"""
+		Vote on the timestamp index with the collected samples. Without samples there is no index and prices are used as they are.
+		"""
+		if len(self.samples) == 0:
+			return
+		counts = pd.concat(self.samples, ignore_index = True).value_counts()
+		self.timestamps = pd.Index(counts.index[counts.values * 2 >= len(self.samples)]).sort_values()
+		self.samples = []
+
+	def warm_up(self, prices_stream, skipped_symbols = ()):
+		"""
+		Pass (symbol, prices) through, holding back the first symbols until enough of them are collected to build the index.
+		Prices of skipped_symbols, e.g. only the newest bars of an incremental update, do not vote.
+		"""
+		held_back = []
+		for symbol, stock_prices in prices_stream:
+			if self.is_ready():
+				yield symbol, stock_prices
+				continue
+
+			if symbol not in skipped_symbols:
+				self.add_sample(stock_prices)
+			held_back.append((symbol, stock_prices))
+			if len(self.samples) >= self.WARMUP_SYMBOLS:
+				self.build()
+				for item in held_back:
+					yield item
+				held_back = []
+
+		# Fewer symbols than the warmup
+		self.build()
+		for item in held_back:
+			yield item
+
+	def align(self, stock_prices):
+		"""
+		Reindex raw prices onto the timestamp index. Returns the aligned prices and the gap mask of the bars that were filled.
+		Prices that already have exactly the bars of the index are returned as they are.
+		"""
+		positions = self.timestamps.get_indexer(stock_prices["Datetime"])
+		if len(positions) == len(self.timestamps) and (positions == np.arange(len(positions))).all():
+			return stock_prices, np.zeros(len(positions), dtype = bool)
+
+		# Row of the symbol for every bar of the index. Missing bars take the previous row, missing bars before the first one take the first row.
+		on_index = positions >= 0
+		source_rows = np.full(len(self.timestamps), -1)
+		source_rows[positions[on_index]] = np.flatnonzero(on_index)
+		gap_mask = source_rows < 0
+		if gap_mask.all():
+			return None, gap_mask
+		source_rows = np.maximum.accumulate(source_rows)
+		source_rows[source_rows < 0] = source_rows[~gap_mask][0]
+
+		# Filled bars did not trade, they open, close, and stay at the last close
+		price_values = np.asarray(stock_prices[PRICE_COLUMNS].values, dtype = np.float64)[source_rows]
+		price_values[gap_mask, 0:4] = price_values[gap_mask, 3:4]
+		price_values[gap_mask, 4] = 0
+		aligned_prices = pd.DataFrame(price_values, columns = PRICE_COLUMNS, copy = False)
+		aligned_prices.insert(0, 'Datetime', self.timestamps.array)
+		return aligned_prices, gap_mask
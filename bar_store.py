@@ -0,0 +1,272 @@
+# Basic libraries
+import os
+import json
+import struct
+import itertools
+import collections.abc
+import numpy as np
+import pandas as pd
+
+# File layout: magic | header length (uint64) | json header | symbol index | times | bars | future times | future bars | indicators
+# Bars are stored column by column (Open, High, Low, Close, Volume), so each column of a symbol is a contiguous float64 run.
+# Every section starts on a 64 byte boundary so the whole file can be memory mapped and sliced without copies.
+MAGIC = b"SURPBARS"
+VERSION = 1
+ALIGNMENT = 64
+PRICE_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+# Columns of the symbol index
+BAR_OFFSET, BAR_COUNT, FUTURE_OFFSET, FUTURE_COUNT, INDICATOR_OFFSET, LAYOUT_ID = range(6)
+INDEX_COLUMNS = 6
+
+def is_bar_store_path(path):
+	return str(path).endswith(".bars")
+
+def align(position):
+	return (position + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+# Arrays of one symbol, ready to be written. source holds the objects they were made from, so unchanged symbols are not encoded again.
+EncodedRecord = collections.namedtuple("EncodedRecord", ["source", "times", "bars", "future_times", "future_bars", "layout", "indicators"])
+
+class BarStore:
+	"""
+	Columnar on-disk store for the data dictionary. Bars of every symbol are kept as contiguous float64 OHLCV columns next to an int64 time column,
+	and the technical indicators are flattened into one float64 array. A small index holds the offsets of every symbol.
+	"""
+	def __init__(self):
+		# Encoded arrays of every symbol saved so far. The data dictionary is saved again and again while it grows, and only new symbols need to be encoded.
+		self.encoded_records = {}
+		self.time_kind, self.time_zone = "int", None
+
+	def save(self, path, data_dictionary):
+		"""
+		Save a data dictionary (symbol -> {"features", "current_prices", "future_prices"}). The file is written next to the target and renamed, so a crash never leaves a half written store behind.
+		"""
+		symbols = list(data_dictionary.keys())
+		self.encode_records([symbol for symbol in symbols if not self.is_encoded(symbol, data_dictionary[symbol])], data_dictionary)
+		self.encoded_records = {symbol: self.encoded_records[symbol] for symbol in symbols}
+		encoded_records = list(self.encoded_records.values())
+
+		# Indicator lists of one symbol are stored back to back, their keys and lengths are shared by all symbols with the same layout
+		index, layouts, layout_ids = [], [], {}
+		bar_position, future_position, indicator_position = 0, 0, 0
+		for record in encoded_records:
+			if record.layout not in layout_ids:
+				layout_ids[record.layout] = len(layouts)
+				layouts.append(record.layout)
+			index.append((bar_position, len(record.times), future_position, len(record.future_times), indicator_position, layout_ids[record.layout]))
+			bar_position += len(record.times)
+			future_position += len(record.future_times)
+			indicator_position += len(record.indicators)
+
+		index = np.array(index, dtype = np.int64).reshape(-1, INDEX_COLUMNS)
+		current_times = np.concatenate([record.times for record in encoded_records] + [np.zeros(0, dtype = np.int64)])
+		current_bars = np.concatenate([record.bars for record in encoded_records] + [np.zeros((len(PRICE_COLUMNS), 0))], axis = 1)
+		future_times = np.concatenate([record.future_times for record in encoded_records] + [np.zeros(0, dtype = np.int64)])
+		future_bars = np.concatenate([record.future_bars for record in encoded_records] + [np.zeros((len(PRICE_COLUMNS), 0))], axis = 1)
+		indicators = np.concatenate([record.indicators for record in encoded_records] + [np.zeros(0)])
+
+		header = {"version": VERSION, "symbols": symbols, "layouts": [list(zip(*layout)) for layout in layouts], "time_kind": self.time_kind, "time_zone": self.time_zone,
+					"number_of_bars": int(bar_position), "number_of_future_bars": int(future_position), "number_of_indicators": int(indicator_position)}
+		header_bytes = json.dumps(header).encode("utf-8")
+
+		temporary_path = str(path) + ".tmp"
+		with open(temporary_path, "wb") as store_file:
+			store_file.write(MAGIC + struct.pack("<Q", len(header_bytes)) + header_bytes)
+			for array in [index, current_times, current_bars, future_times, future_bars, indicators]:
+				store_file.write(b"\0" * (align(store_file.tell()) - store_file.tell()))
+				store_file.write(memoryview(np.ascontiguousarray(array).reshape(-1)).cast("B"))
+		os.replace(temporary_path, path)
+
+	def is_encoded(self, symbol, record):
+		if symbol not in self.encoded_records:
+			return False
+		source = self.encoded_records[symbol].source
+		return source[0] is record["current_prices"] and source[1] is record["features"] and source[2] is record["future_prices"]
+
+	def encode_records(self, symbols, data_dictionary):
+		"""
+		Convert the records of the given symbols into arrays
+		"""
+		if len(symbols) == 0:
+			return
+
+		# Current prices are concatenated in one go, which is much cheaper than pulling columns out of every data frame. Every symbol keeps a view of the result.
+		all_current_prices = [data_dictionary[symbol]["current_prices"] for symbol in symbols]
+		all_times, all_bars = self.split_prices(pd.concat(all_current_prices, ignore_index = True, copy = False))
+		if len(all_times) > 0:
+			self.time_kind, self.time_zone = self.get_time_kind(all_times)
+		all_times = self.times_to_int(all_times)
+		all_bars = np.ascontiguousarray(all_bars.T)
+
+		position = 0
+		for symbol, current_prices in zip(symbols, all_current_prices):
+			record = data_dictionary[symbol]
+			count = len(current_prices)
+			future_times, future_bars = np.zeros(0, dtype = np.int64), np.zeros((len(PRICE_COLUMNS), 0))
+			if len(record["future_prices"]) > 0:
+				future_times, future_bars = self.split_prices(record["future_prices"])
+				future_times, future_bars = self.times_to_int(future_times), np.ascontiguousarray(future_bars.T)
+
+			features = record["features"]
+			layout = (tuple(features), tuple(map(len, features.values())))
+			indicators = np.array(list(itertools.chain.from_iterable(features.values())), dtype = np.float64)
+
+			source = (current_prices, features, record["future_prices"])
+			self.encoded_records[symbol] = EncodedRecord(source, all_times[position:position + count], all_bars[:, position:position + count], future_times, future_bars, layout, indicators)
+			position += count
+
+	def load(self, path):
+		"""
+		Memory map a bar store. Nothing besides the header is read until a symbol is accessed.
+		"""
+		return BarStoreReader(path)
+
+	def split_prices(self, prices):
+		"""
+		Split current prices (data frame) or future prices (list of rows) into a time series and an OHLCV array
+		"""
+		if isinstance(prices, pd.DataFrame):
+			return prices["Datetime"], np.asarray(prices[PRICE_COLUMNS].values, dtype = np.float64).reshape(-1, len(PRICE_COLUMNS))
+		times = pd.Series([row[0] for row in prices])
+		bars = np.asarray([row[1:] for row in prices], dtype = np.float64)
+		return times, bars
+
+	def get_time_kind(self, times):
+		"""
+		Yahoo finance gives time zone aware timestamps while binance gives epoch milliseconds as floats. Remember which one it was so it can be restored on load.
+		"""
+		if pd.api.types.is_datetime64_any_dtype(times):
+			return "datetime", str(times.dt.tz) if times.dt.tz is not None else None
+		if pd.api.types.is_float_dtype(times):
+			return "float", None
+		return "int", None
+
+	def times_to_int(self, times):
+		"""
+		Convert times to int64. Time zone aware columns give their UTC values as datetime64[ns] through .values
+		"""
+		times = np.asarray(times.values if isinstance(times, pd.Series) else times)
+		if len(times) == 0:
+			return np.zeros(0, dtype = np.int64)
+		if np.issubdtype(times.dtype, np.datetime64):
+			return times.astype("datetime64[ns]").view(np.int64)
+		return times.astype(np.int64)
+
+class BarStoreReader(collections.abc.MutableMapping):
+	"""
+	Read only view of a bar store that behaves like the data dictionary. Records are built on first access and cached,
+	updates and deletions only change this in-memory view.
+	"""
+
+	def __init__(self, path):
+		with open(path, "rb") as store_file:
+			if store_file.read(len(MAGIC)) != MAGIC:
+				raise ValueError("%s is not a bar store" % path)
+			header_length = struct.unpack("<Q", store_file.read(8))[0]
+			self.header = json.loads(store_file.read(header_length).decode("utf-8"))
+
+		self.symbols = self.header["symbols"]
+		self.symbol_positions = {symbol: i for i, symbol in enumerate(self.symbols)}
+		self.layouts = self.header["layouts"]
+
+		# np.asarray keeps the memory mapped buffer but avoids the overhead of memmap slicing
+		position = align(len(MAGIC) + 8 + header_length)
+		self.index = self.map_array(path, np.int64, position, (len(self.symbols), INDEX_COLUMNS))
+		position = align(position + self.index.nbytes)
+		self.times = self.map_array(path, np.int64, position, (self.header["number_of_bars"],))
+		position = align(position + self.times.nbytes)
+		self.bars = self.map_array(path, np.float64, position, (len(PRICE_COLUMNS), self.header["number_of_bars"])).T
+		position = align(position + self.bars.nbytes)
+		self.future_times = self.map_array(path, np.int64, position, (self.header["number_of_future_bars"],))
+		position = align(position + self.future_times.nbytes)
+		self.future_bars = self.map_array(path, np.float64, position, (len(PRICE_COLUMNS), self.header["number_of_future_bars"])).T
+		position = align(position + self.future_bars.nbytes)
+		self.indicators = self.map_array(path, np.float64, position, (self.header["number_of_indicators"],))
+
+		self.records = {}
+		self.deleted_symbols = set()
+
+		# Data frame with the bars of all symbols. It is built on first use and every symbol gets a slice of it.
+		self.all_prices = None
+
+	def map_array(self, path, dtype, offset, shape):
+		if np.prod(shape) == 0:
+			return np.zeros(shape, dtype = dtype)
+		return np.asarray(np.memmap(path, dtype = dtype, mode = "r", offset = offset, shape = shape))
+
+	def convert_times(self, times):
+		if self.header["time_kind"] == "datetime":
+			converted = pd.DatetimeIndex(np.asarray(times).view("datetime64[ns]"))
+			if self.header["time_zone"] is not None:
+				converted = converted.tz_localize("UTC").tz_convert(self.header["time_zone"])
+			return converted
+		if self.header["time_kind"] == "float":
+			return np.asarray(times, dtype = np.float64)
+		return np.asarray(times)
+
+	def get_bars(self, symbol, future = False):
+		"""
+		Returns (times, OHLCV array) for a symbol. Both are views on the memory mapped file.
+		"""
+		row = self.index[self.symbol_positions[symbol]]
+		if future:
+			return self.future_times[row[FUTURE_OFFSET]:row[FUTURE_OFFSET] + row[FUTURE_COUNT]], self.future_bars[row[FUTURE_OFFSET]:row[FUTURE_OFFSET] + row[FUTURE_COUNT]]
+		return self.times[row[BAR_OFFSET]:row[BAR_OFFSET] + row[BAR_COUNT]], self.bars[row[BAR_OFFSET]:row[BAR_OFFSET] + row[BAR_COUNT]]
+
+	def get_features(self, symbol):
+		row = self.index[self.symbol_positions[symbol]]
+		layout = self.layouts[row[LAYOUT_ID]]
+		position = int(row[INDICATOR_OFFSET])
+		values = self.indicators[position:position + sum(length for _, length in layout)].tolist()
+
+		features, position = {}, 0
+		for key, length in layout:
+			features[key] = values[position:position + length]
+			position += length
+		return features
+
+	def get_current_prices(self, symbol):
+		if self.all_prices is None:
+			self.all_prices = pd.DataFrame(self.bars, columns = PRICE_COLUMNS)
+			self.all_prices.insert(0, "Datetime", self.convert_times(self.times))
+
+		row = self.index[self.symbol_positions[symbol]]
+		return self.all_prices.iloc[row[BAR_OFFSET]:row[BAR_OFFSET] + row[BAR_COUNT]]
+
+	def get_future_prices(self, symbol):
+		times, bars = self.get_bars(symbol, future = True)
+		if len(times) == 0:
+			return []
+		return [[time] + row for time, row in zip(list(self.convert_times(times)), bars.tolist())]
+
+	def __getitem__(self, symbol):
+		if symbol in self.deleted_symbols or symbol not in self.symbol_positions and symbol not in self.records:
+			raise KeyError(symbol)
+		if symbol not in self.records:
+			self.records[symbol] = {"features": self.get_features(symbol), "current_prices": self.get_current_prices(symbol), "future_prices": self.get_future_prices(symbol)}
+		return self.records[symbol]
+
+	def __setitem__(self, symbol, record):
+		self.deleted_symbols.discard(symbol)
+		self.records[symbol] = record
+
+	def __delitem__(self, symbol):
+		if symbol not in self:
+			raise KeyError(symbol)
+		self.records.pop(symbol, None)
+		self.deleted_symbols.add(symbol)
+
+	def __contains__(self, symbol):
+		return symbol not in self.deleted_symbols and (symbol in self.symbol_positions or symbol in self.records)
+
+	def __iter__(self):
+		for symbol in self.symbols:
+			if symbol not in self.deleted_symbols:
+				yield symbol
+		for symbol in self.records:
+			if symbol not in self.symbol_positions and symbol not in self.deleted_symbols:
+				yield symbol
+
+	def __len__(self):
+		return sum(1 for _ in self)
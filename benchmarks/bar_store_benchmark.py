@@ -0,0 +1,93 @@
+# Basic libraries
+import os
+import sys
+import time
+import tempfile
+import numpy as np
+import warnings
+warnings.filterwarnings("ignore")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bar_store import BarStore
+from vectorized_feature_generator import VectorizedTAEngine
+from synthetic_data import generate_prices
+
+# Argument parsing
+import argparse
+argParser = argparse.ArgumentParser()
+argParser.add_argument("--symbols", type=int, default = 2000, help="Number of synthetic symbols in the data dictionary.")
+argParser.add_argument("--bars", type=int, default = 500, help="Number of bars per symbol.")
+argParser.add_argument("--history_to_use", type=int, default = 7, help="History used for the technical indicators.")
+args = argParser.parse_args()
+
+"""
+Compares saving and loading the data dictionary as a pickled .npy file and as a columnar .bars store.
+Sample run:
+python benchmarks/bar_store_benchmark.py --symbols 2000 --bars 500
+"""
+
+def generate_data_dictionary(number_of_symbols, number_of_bars, history_to_use):
+	all_prices = generate_prices(number_of_symbols, number_of_bars)
+	engine = VectorizedTAEngine(history_to_use = history_to_use, verbose = False)
+	all_indicators = engine.get_technical_indicators_for_all(list(all_prices.values()))
+	return {symbol: {"features": indicators, "current_prices": all_prices[symbol], "future_prices": []} for symbol, (indicators, _) in zip(all_prices, all_indicators)}
+
+def read_everything(data_dictionary, engine):
+	"""
+	Touch what load_data_from_dictionary needs for every symbol
+	"""
+	for symbol in data_dictionary:
+		engine.get_features(data_dictionary[symbol]["features"])
+		_ = data_dictionary[symbol]["current_prices"]
+
+def main():
+	print("Generating %d symbols with %d bars each..." % (args.symbols, args.bars))
+	data_dictionary = generate_data_dictionary(args.symbols, args.bars, args.history_to_use)
+	engine = VectorizedTAEngine(history_to_use = args.history_to_use, verbose = False)
+
+	with tempfile.TemporaryDirectory() as directory:
+		numpy_path = os.path.join(directory, "data_dictionary.npy")
+		bar_store_path = os.path.join(directory, "data_dictionary.bars")
+
+		start = time.perf_counter()
+		np.save(numpy_path, data_dictionary)
+		numpy_save_time = time.perf_counter() - start
+
+		start = time.perf_counter()
+		BarStore().save(bar_store_path, data_dictionary)
+		bar_store_save_time = time.perf_counter() - start
+
+		start = time.perf_counter()
+		loaded_dictionary = np.load(numpy_path, allow_pickle = True).item()
+		numpy_open_time = time.perf_counter() - start
+		read_everything(loaded_dictionary, engine)
+		numpy_load_time = time.perf_counter() - start
+
+		start = time.perf_counter()
+		loaded_store = BarStore().load(bar_store_path)
+		bar_store_open_time = time.perf_counter() - start
+		read_everything(loaded_store, engine)
+		bar_store_load_time = time.perf_counter() - start
+
+		print("File size: npy %.1f MB, bars %.1f MB" % (os.path.getsize(numpy_path) / 1e6, os.path.getsize(bar_store_path) / 1e6))
+
+		# collect_data_for_all_tickers saves the growing dictionary after every 100 symbols
+		symbols = list(data_dictionary.keys())
+		start = time.perf_counter()
+		for end in range(100, len(symbols) + 1, 100):
+			np.save(numpy_path, {symbol: data_dictionary[symbol] for symbol in symbols[:end]})
+		numpy_checkpoint_time = time.perf_counter() - start
+
+		bar_store = BarStore()
+		start = time.perf_counter()
+		for end in range(100, len(symbols) + 1, 100):
+			bar_store.save(bar_store_path, {symbol: data_dictionary[symbol] for symbol in symbols[:end]})
+		bar_store_checkpoint_time = time.perf_counter() - start
+
+	print("%-28s %10s %10s" % ("", "npy", "bars"))
+	print("%-28s %9.3fs %9.3fs" % ("Save", numpy_save_time, bar_store_save_time))
+	print("%-28s %9.3fs %9.3fs" % ("Save every 100 symbols", numpy_checkpoint_time, bar_store_checkpoint_time))
+	print("%-28s %9.3fs %9.3fs" % ("Open", numpy_open_time, bar_store_open_time))
+	print("%-28s %9.3fs %9.3fs" % ("Open and read every symbol", numpy_load_time, bar_store_load_time))
+
+main()
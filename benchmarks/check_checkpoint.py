@@ -0,0 +1,135 @@
+# Basic libraries
+import os
+import sys
+import glob
+import time
+import tempfile
+import contextlib
+import numpy as np
+import warnings
+warnings.filterwarnings("ignore")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from detection_engine import create_config, Surpriver
+from synthetic_data import write_price_files
+
+# Argument parsing
+import argparse
+argParser = argparse.ArgumentParser()
+argParser.add_argument("--symbols", type=int, default = 450, help="Number of synthetic symbols to scan.")
+argParser.add_argument("--bars", type=int, default = 500, help="Number of bars per symbol.")
+argParser.add_argument("--seed", type=int, default = 0, help="Seed of the synthetic data.")
+args = argParser.parse_args()
+
+"""
+Checks that interrupted scans resume from the checkpoint log and end with the same features as a scan that was never interrupted:
+- A scan that crashes hours after it started, with segments committed over those hours, resumes all of them, also after a second crash.
+- Segments older than checkpoint_max_age_minutes are scanned again, the newer segments are still resumed.
+Sample run:
+python benchmarks/check_checkpoint.py --symbols 1000
+"""
+
+class Crash(BaseException):
+	pass
+
+def create_surpriver(data_directory, data_dictionary_path, crash_after = None):
+	"""
+	Surpriver that scans the synthetic symbols and crashes after crash_after downloads
+	"""
+	config = create_config(data_source = "local", data_directory = data_directory, data_dictionary_path = data_dictionary_path, top_n = 0, fetch_workers = 1)
+	with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+		surpriver = Surpriver(config)
+	surpriver.dataEngine.stocks_list = sorted(os.path.basename(path)[:-len(".csv")] for path in glob.glob(os.path.join(data_directory, "*.csv")))
+	if crash_after is not None:
+		download_prices = surpriver.dataEngine.price_fetcher
+		downloads = []
+		def crashing_fetcher(symbol, start = None):
+			downloads.append(symbol)
+			if len(downloads) > crash_after:
+				raise Crash()
+			return download_prices(symbol, start = start)
+		surpriver.dataEngine.price_fetcher = crashing_fetcher
+	return surpriver
+
+def run_scan(surpriver):
+	"""
+	Features and symbols of a scan, and how many symbols were resumed. Both are None if the scan crashed.
+	"""
+	try:
+		with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+			features, _, _, symbol_names = surpriver.dataEngine.collect_data_for_all_tickers()
+	except Crash:
+		return None, None, surpriver.metrics.get_summary()["counters"].get("symbols_resumed", 0)
+	return np.array(features), list(symbol_names), surpriver.metrics.get_summary()["counters"].get("symbols_resumed", 0)
+
+def get_segment_paths(data_dictionary_path):
+	return sorted(glob.glob(data_dictionary_path + ".checkpoint/segment_*.npy"))
+
+def backdate_segments(data_dictionary_path, oldest_age_minutes):
+	"""
+	Pretend the segments were committed over the last oldest_age_minutes, the newest one a minute ago, as if the scan had been running that long
+	"""
+	segment_paths = get_segment_paths(data_dictionary_path)
+	for segment_path, age in zip(segment_paths, np.linspace(oldest_age_minutes, 1, len(segment_paths))):
+		segment = np.load(segment_path, allow_pickle = True).item()
+		segment["commit_time"] = time.time() - age * 60
+		np.save(segment_path, segment)
+
+def count_segment_symbols(data_dictionary_path, max_age_minutes = 720):
+	"""
+	Number of symbols in the segments that are young enough to be resumed, and in the older ones
+	"""
+	fresh_symbols, stale_symbols = 0, 0
+	for segment_path in get_segment_paths(data_dictionary_path):
+		segment = np.load(segment_path, allow_pickle = True).item()
+		symbols = len(segment["records"]) + len(segment["dropped_symbols"])
+		if time.time() - segment["commit_time"] > max_age_minutes * 60:
+			stale_symbols += symbols
+		else:
+			fresh_symbols += symbols
+	return fresh_symbols, stale_symbols
+
+def check_resume(data_directory, data_dictionary_path, reference, oldest_age_minutes, crashes):
+	"""
+	Crash a scan once for every number of downloads in crashes, backdate the segments of the first crash, and check that every later run resumes
+	exactly the symbols of the segments that are young enough. Returns the number of symbols the last run resumed and of the stale symbols.
+	"""
+	features, _, _ = run_scan(create_surpriver(data_directory, data_dictionary_path, crashes[0]))
+	assert features is None, "The scan did not crash after %d downloads" % crashes[0]
+	backdate_segments(data_dictionary_path, oldest_age_minutes)
+	fresh_symbols, stale_symbols = count_segment_symbols(data_dictionary_path)
+	assert fresh_symbols > 0, "Nothing was committed before the crash"
+
+	for crash_after in crashes[1:] + [None]:
+		fresh_symbols, _ = count_segment_symbols(data_dictionary_path)
+		features, symbol_names, resumed = run_scan(create_surpriver(data_directory, data_dictionary_path, crash_after))
+		assert resumed == fresh_symbols, "Resumed %d symbols instead of %d" % (resumed, fresh_symbols)
+		assert (features is None) == (crash_after is not None), "The scan did not crash after %s downloads" % crash_after
+
+	# Symbols of stale segments are scanned after the resumed ones, so the features are compared by symbol
+	order, reference_order = np.argsort(symbol_names), np.argsort(reference[1])
+	assert sorted(symbol_names) == sorted(reference[1]) and np.array_equal(features[order], reference[0][reference_order]), "The resumed scan has other features than the scan without crashes"
+	assert not os.path.exists(data_dictionary_path + ".checkpoint"), "The checkpoint was not removed after the scan"
+	return resumed, stale_symbols
+
+def main():
+	with tempfile.TemporaryDirectory() as work_directory:
+		data_directory = os.path.join(work_directory, "prices")
+		os.makedirs(data_directory)
+		write_price_files(data_directory, args.symbols, args.bars, seed = args.seed)
+		reference = run_scan(create_surpriver(data_directory, os.path.join(work_directory, "reference.npy")))
+		print("Scan without crashes: %d symbols" % len(reference[1]))
+
+		# Segments committed over the last 5 hours, the scan crashed a minute after the last one, and the resumed scan crashed again
+		resumed, stale_symbols = check_resume(data_directory, os.path.join(work_directory, "long_scan.npy"), reference, 300, [300, 60])
+		assert stale_symbols == 0, "Segments of the last 5 hours were too old to resume"
+		print("Crash 5 hours into the scan and a second crash: %d symbols resumed" % resumed)
+
+		# The first segments are older than the default checkpoint_max_age_minutes of 720, their symbols are scanned again
+		resumed, stale_symbols = check_resume(data_directory, os.path.join(work_directory, "stale_scan.npy"), reference, 1000, [420])
+		assert stale_symbols > 0, "No segment was older than the maximum age"
+		print("Crash with segments older than the maximum age: %d symbols resumed, %d scanned again" % (resumed, stale_symbols))
+
+	print("All checkpoint checks passed")
+
+main()
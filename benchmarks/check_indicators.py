@@ -0,0 +1,81 @@
+# Basic libraries
+import os
+import sys
+import numpy as np
+import warnings
+warnings.filterwarnings("ignore")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from feature_generator import TAEngine, INDICATOR_KEYS
+from vectorized_feature_generator import VectorizedTAEngine
+from synthetic_data import generate_symbol_prices
+
+# Argument parsing
+import argparse
+argParser = argparse.ArgumentParser()
+argParser.add_argument("--symbols", type=int, default = 20, help="Number of synthetic symbols to check.")
+argParser.add_argument("--bars", type=int, default = 300, help="Number of bars per symbol.")
+argParser.add_argument("--history_to_use", type=int, default = 7, help="History length of the features.")
+argParser.add_argument("--seed", type=int, default = 0, help="Seed of the synthetic data.")
+args = argParser.parse_args()
+
+"""
+Checks the indicator engines on synthetic prices and fails with an assertion if anything is off:
+- For every indicator, features computed on the bars of get_feature_window are the same as features computed on the whole history.
+- Every technical indicator of the vectorized engine is the same as the one of TAEngine.
+Sample run:
+python benchmarks/check_indicators.py --symbols 50 --history_to_use 14
+"""
+
+def get_indicator_names():
+	names = []
+	for key in INDICATOR_KEYS:
+		name = key.partition("-")[0]
+		if name not in names:
+			names.append(name)
+	return names
+
+def check_feature_windows(all_prices):
+	"""
+	Largest difference between the features of the feature window and of the whole history, for every engine and indicator
+	"""
+	differences = {}
+	for engine_class in [TAEngine, VectorizedTAEngine]:
+		for name in get_indicator_names():
+			engine = engine_class(history_to_use = args.history_to_use, verbose = False, feature_keys = [name])
+			largest_difference = 0.0
+			for prices in all_prices:
+				full_features = np.array(engine.get_features(engine.get_technical_indicators(prices)), dtype = np.float64)
+				window_features = np.array(engine.get_features(engine.get_technical_indicators(engine.get_feature_window(prices))), dtype = np.float64)
+				if full_features.shape != window_features.shape:
+					largest_difference = np.inf
+					break
+				largest_difference = max(largest_difference, float(np.nanmax(np.abs(full_features - window_features), initial = 0)))
+			differences[(engine_class.__name__, name)] = largest_difference
+	return differences
+
+def check_vectorized_engine(all_prices):
+	"""
+	Mismatches of the vectorized engine against TAEngine, for every indicator the engines can compute and not only the default features
+	"""
+	engine = VectorizedTAEngine(history_to_use = args.history_to_use, verbose = False, feature_keys = get_indicator_names())
+	assert sorted(engine.INDICATOR_KEYS) == sorted(INDICATOR_KEYS), "The vectorized engine does not compute every indicator -> %s" % engine.INDICATOR_KEYS
+	return engine.compare_with_ta_engine(all_prices)
+
+def main():
+	# Bars without volume are common, they change the window of the volume based indicators
+	all_prices = [generate_symbol_prices(i, args.bars, seed = args.seed, zero_volume_probability = 0.1) for i in range(0, args.symbols)]
+
+	differences = check_feature_windows(all_prices)
+	for (engine_name, name), difference in differences.items():
+		print("Feature window %s %s: largest difference %g" % (engine_name, name, difference))
+	failed = ["%s %s" % key for key, difference in differences.items() if difference > 1e-9]
+	assert len(failed) == 0, "Features of the feature window differ from the whole history for %s" % ", ".join(failed)
+
+	mismatches = check_vectorized_engine(all_prices)
+	print("Vectorized engine against TAEngine: %d mismatches" % len(mismatches))
+	assert len(mismatches) == 0, "The vectorized engine differs from TAEngine for %s" % ", ".join("symbol %d %s (%g)" % mismatch for mismatch in mismatches[:10])
+
+	print("All indicator checks passed")
+
+main()
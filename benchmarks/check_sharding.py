@@ -0,0 +1,110 @@
+# Basic libraries
+import os
+import sys
+import glob
+import tempfile
+import contextlib
+import multiprocessing
+import numpy as np
+import warnings
+warnings.filterwarnings("ignore")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from detection_engine import create_config, Surpriver
+from synthetic_data import write_price_files
+
+# Argument parsing
+import argparse
+argParser = argparse.ArgumentParser()
+argParser.add_argument("--symbols", type=int, default = 300, help="Number of synthetic symbols to scan.")
+argParser.add_argument("--bars", type=int, default = 500, help="Number of bars per symbol.")
+argParser.add_argument("--shard_count", type=int, default = 3, help="Number of shards, every shard is scanned by its own worker process.")
+argParser.add_argument("--seed", type=int, default = 0, help="Seed of the synthetic data.")
+args = argParser.parse_args()
+
+"""
+Runs sharded scans of synthetic symbols on this host, with every worker in its own process and a shared temporary shard directory, and checks:
+- The coordinator merges the shards into the same symbols and features as a scan of all symbols in one process.
+- A coordinator that is started before the workers finish waits for their shards.
+- Missing shards, and shards left over from a run with another run id, are not merged.
+Sample run:
+python benchmarks/check_sharding.py --symbols 1000 --shard_count 4
+"""
+
+def create_surpriver(data_directory, work_directory, **arguments):
+	config = create_config(data_source = "local", data_directory = data_directory, data_dictionary_path = os.path.join(work_directory, "data_dictionary.npy"),
+							shard_directory = os.path.join(work_directory, "shards"), top_n = 0, **arguments)
+	with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+		surpriver = Surpriver(config)
+	surpriver.dataEngine.stocks_list = sorted(os.path.basename(path)[:-len(".csv")] for path in glob.glob(os.path.join(data_directory, "*.csv")))
+	return surpriver
+
+def gather_data(surpriver):
+	with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+		features, _, _, symbol_names = surpriver.gather_data()
+	return np.asarray(features), list(symbol_names)
+
+def scan_shard(data_directory, work_directory, shard_index, run_id):
+	"""
+	One shard worker, inside its own process
+	"""
+	surpriver = create_surpriver(data_directory, work_directory, shard_count = args.shard_count, shard_index = shard_index, shard_run_id = run_id)
+	with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+		return surpriver.scan_shard()
+
+def start_workers(pool, data_directory, work_directory, run_id, shard_indices = None):
+	shard_indices = range(0, args.shard_count) if shard_indices is None else shard_indices
+	return [pool.apply_async(scan_shard, (data_directory, work_directory, shard_index, run_id)) for shard_index in shard_indices]
+
+def merge(data_directory, work_directory, run_id, shard_wait_minutes = 0):
+	"""
+	Features and symbols of a coordinator, or the error it gave up with
+	"""
+	surpriver = create_surpriver(data_directory, work_directory, shard_count = args.shard_count, is_merge_shards = 1, shard_run_id = run_id,
+									shard_wait_minutes = shard_wait_minutes)
+	try:
+		return gather_data(surpriver) + (None, )
+	except ValueError as e:
+		return None, None, str(e)
+
+def main():
+	with tempfile.TemporaryDirectory() as work_directory, multiprocessing.get_context("fork").Pool(args.shard_count) as pool:
+		data_directory = os.path.join(work_directory, "prices")
+		os.makedirs(data_directory)
+		write_price_files(data_directory, args.symbols, args.bars, seed = args.seed)
+		reference_features, reference_symbols = gather_data(create_surpriver(data_directory, os.path.join(work_directory, "single_process"), is_save_dictionary = 0))
+		print("Scan in one process: %d symbols" % len(reference_symbols))
+
+		# All workers at the same time, then the coordinator
+		shard_paths = [worker.get() for worker in start_workers(pool, data_directory, work_directory, "run-1")]
+		assert len(set(shard_paths)) == args.shard_count, "Workers wrote to the same shard"
+		dictionary_paths = glob.glob(os.path.join(work_directory, "data_dictionary.shard*of%d.npy" % args.shard_count))
+		assert len(dictionary_paths) == args.shard_count, "Workers did not save their own data dictionaries -> %s" % dictionary_paths
+		features, symbol_names, error = merge(data_directory, work_directory, "run-1")
+		assert error is None, error
+		assert symbol_names == reference_symbols and np.array_equal(features, reference_features), "The merged shards differ from the scan in one process"
+		print("%d workers and the coordinator: %d symbols, same features as one process" % (args.shard_count, len(symbol_names)))
+
+		# A coordinator of the next run finds only shards of the last run and gives up without waiting
+		_, _, error = merge(data_directory, work_directory, "run-2")
+		assert error is not None and "Shards %s are missing" % ", ".join(str(shard_index) for shard_index in range(0, args.shard_count)) in error, error
+		print("Shards left over from another run: %s" % error)
+
+		# Only the first worker of the next run is done, the others are still missing
+		start_workers(pool, data_directory, work_directory, "run-2", [0])[0].get()
+		_, _, error = merge(data_directory, work_directory, "run-2")
+		assert error is not None and "Shards %s are missing" % ", ".join(str(shard_index) for shard_index in range(1, args.shard_count)) in error, error
+		print("Missing shards: %s" % error)
+
+		# The coordinator waits for the workers that are still scanning
+		workers = start_workers(pool, data_directory, work_directory, "run-2", range(1, args.shard_count))
+		features, symbol_names, error = merge(data_directory, work_directory, "run-2", shard_wait_minutes = 10)
+		assert error is None, error
+		for worker in workers:
+			worker.get()
+		assert symbol_names == reference_symbols and np.array_equal(features, reference_features), "The merged shards differ from the scan in one process"
+		print("Coordinator started before the workers were done: %d symbols, same features as one process" % len(symbol_names))
+
+	print("All sharding checks passed")
+
+main()
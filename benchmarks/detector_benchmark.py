@@ -0,0 +1,116 @@
+# Basic libraries
+import os
+import sys
+import time
+import json
+import tempfile
+import tracemalloc
+import contextlib
+import numpy as np
+import pandas as pd
+import warnings
+warnings.filterwarnings("ignore")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from detection_engine import create_config, Surpriver
+from detectors import DETECTORS, create_anomaly_detector
+from synthetic_data import write_price_files
+
+# Argument parsing
+import argparse
+argParser = argparse.ArgumentParser()
+argParser.add_argument("--symbols", type=int, default = 2000, help="Number of synthetic symbols whose features are scored.")
+argParser.add_argument("--bars", type=int, default = 500, help="Number of bars per symbol.")
+argParser.add_argument("--seed", type=int, default = 0, help="Seed of the synthetic data.")
+argParser.add_argument("--history_to_use", type=int, default = 14, help="History length of the features.")
+argParser.add_argument("--detectors", type=str, default = ",".join(DETECTORS), help="Comma separated detector backends to benchmark.")
+argParser.add_argument("--chunk_sizes", type=str, default = "0,256", help="Comma separated score_chunk_size values. 0 scores all symbols at once.")
+argParser.add_argument("--sample_count", type=int, default = 500, help="How many single samples are scored and learned one at a time, like streamed bars.")
+argParser.add_argument("--top_n", type=int, default = 25, help="Size of the top list that is compared with the isolation forest.")
+argParser.add_argument("--data_directory", type=str, default = "", help="Directory for the synthetic price files. Files from an earlier run with the same settings are reused. Empty uses a temporary directory.")
+argParser.add_argument("--output_path", type=str, default = "detector_results.json", help="JSON file the results are written to.")
+args = argParser.parse_args()
+
+"""
+Fits and scores every detector backend on the same feature matrix of synthetic symbols. Reports the fit time, the batch scoring time and
+peak memory for every chunk size, the latency of scoring and learning one streamed sample, and how close the ranking is to the isolation forest.
+Sample run:
+python benchmarks/detector_benchmark.py --symbols 10000 --chunk_sizes 0,1000 --detectors isolation_forest,half_space_trees,mahalanobis
+"""
+
+def get_features(data_directory, symbol_names):
+	config = create_config(data_source = "local", data_directory = data_directory, history_to_use = args.history_to_use, indicator_engine = "vectorized",
+							is_save_dictionary = 0, is_load_from_dictionary = 0)
+	with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+		surpriver = Surpriver(config)
+		surpriver.dataEngine.stocks_list = symbol_names
+		features, _, _, _ = surpriver.gather_data()
+	return np.asarray(features, dtype = np.float64)
+
+def get_rank_correlation(scores, other_scores):
+	ranks = np.argsort(np.argsort(scores))
+	other_ranks = np.argsort(np.argsort(other_scores))
+	return np.corrcoef(ranks, other_ranks)[0, 1]
+
+def benchmark_detector(name, features, chunk_size):
+	detector = create_anomaly_detector(name, chunk_size = chunk_size)
+	start = time.perf_counter()
+	detector.fit(features)
+	fit_seconds = time.perf_counter() - start
+
+	tracemalloc.start()
+	start = time.perf_counter()
+	scores = detector.decision_function(features)
+	score_seconds = time.perf_counter() - start
+	_, peak_bytes = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+
+	# Streamed samples are scored first and learned from after, like the streaming scanner does
+	score_latencies, update_latencies = [], []
+	for sample in features[:args.sample_count]:
+		start = time.perf_counter()
+		detector.decision_function_for_sample(sample)
+		score_latencies.append(time.perf_counter() - start)
+		start = time.perf_counter()
+		detector.update(sample)
+		update_latencies.append(time.perf_counter() - start)
+
+	return scores, {"detector": name, "chunk_size": chunk_size, "fit_seconds": fit_seconds, "score_seconds": score_seconds,
+					"score_peak_mb": peak_bytes / 1024.0 ** 2, "sample_score_p50_ms": np.percentile(score_latencies, 50) * 1000,
+					"sample_score_p99_ms": np.percentile(score_latencies, 99) * 1000, "update_p50_ms": np.percentile(update_latencies, 50) * 1000,
+					"anomalous_fraction": float(np.mean(scores < 0))}
+
+def main():
+	names = [name.strip() for name in args.detectors.split(",") if name.strip() != ""]
+	chunk_sizes = [int(value) for value in args.chunk_sizes.split(",")]
+	with tempfile.TemporaryDirectory() as work_directory:
+		data_directory = args.data_directory if args.data_directory != "" else os.path.join(work_directory, "prices")
+		print("Writing %d synthetic symbols with %d bars each to %s..." % (args.symbols, args.bars, data_directory))
+		symbol_names = write_price_files(data_directory, args.symbols, args.bars, seed = args.seed)
+		features = get_features(data_directory, symbol_names)
+	print("Feature matrix has %d symbols and %d features" % features.shape)
+
+	# Every backend is compared with the isolation forest on the same features
+	reference_scores = create_anomaly_detector("isolation_forest").fit(features).decision_function(features)
+	reference_top = set(np.argsort(reference_scores)[:args.top_n])
+
+	rows = []
+	for name in names:
+		for chunk_size in chunk_sizes:
+			print("Benchmarking %s with chunk size %d..." % (name, chunk_size))
+			scores, row = benchmark_detector(name, features, chunk_size)
+			row["rank_correlation"] = get_rank_correlation(scores, reference_scores)
+			row["top_n_overlap"] = len(reference_top.intersection(np.argsort(scores)[:args.top_n])) / float(min(args.top_n, len(scores)))
+			rows.append(row)
+
+	results = pd.DataFrame(rows)
+	pd.set_option("display.width", 250)
+	pd.set_option("display.max_columns", 50)
+	print("\nDetector backends on %d symbols, rank correlation and top %d overlap are with the isolation forest" % (len(features), args.top_n))
+	print(results.round(4).to_string(index = False))
+
+	with open(args.output_path, "w") as results_file:
+		json.dump({"symbols": len(features), "features": features.shape[1], "results": rows}, results_file, indent = 1)
+	print("Results stored in", args.output_path)
+
+main()
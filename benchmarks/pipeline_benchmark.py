@@ -0,0 +1,177 @@
+# Basic libraries
+import os
+import sys
+import json
+import resource
+import tempfile
+import contextlib
+import multiprocessing
+import numpy as np
+import pandas as pd
+import warnings
+warnings.filterwarnings("ignore")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from detection_engine import create_config, Surpriver
+from synthetic_data import write_price_files
+
+# Argument parsing
+import argparse
+argParser = argparse.ArgumentParser()
+argParser.add_argument("--universe_sizes", type=str, default = "500,2000", help="Comma separated numbers of synthetic symbols to scan.")
+argParser.add_argument("--history_lengths", type=str, default = "7,14", help="Comma separated values of history_to_use to scan with.")
+argParser.add_argument("--bars", type=int, default = 500, help="Number of bars per symbol before gaps are removed.")
+argParser.add_argument("--seed", type=int, default = 0, help="Seed of the synthetic data.")
+argParser.add_argument("--gap_probability", type=float, default = 0.0, help="Probability that a bar is missing, like missing bars from yahoo finance. Missing bars are filled when the bars are aligned to the shared timestamp index.")
+argParser.add_argument("--zero_volume_probability", type=float, default = 0.02, help="Probability that a bar has no volume.")
+argParser.add_argument("--indicator_engine", type=str, default = "ta", help="Indicator engine to benchmark. Can be ta or vectorized.")
+argParser.add_argument("--data_dictionary_path", type=str, default = "data_dictionary.npy", help="File name of the data dictionary. Use a name ending with .bars to benchmark the bar store.")
+argParser.add_argument("--data_directory", type=str, default = "", help="Directory for the synthetic price files. Files from an earlier run with the same settings are reused. Empty uses a temporary directory.")
+argParser.add_argument("--output_path", type=str, default = "benchmark_results.json", help="JSON file the results are written to. It can be used as the baseline of a later run.")
+argParser.add_argument("--baseline_path", type=str, default = "", help="Results of an earlier run to compare with.")
+argParser.add_argument("--regression_threshold", type=float, default = 1.2, help="Stages that take this many times longer than in the baseline are reported as regressions.")
+args = argParser.parse_args()
+
+"""
+Times every stage of a scan of synthetic symbols that are read with the local data source, for every universe size and history length.
+Every case runs in its own process: a scan that saves the data dictionary, then a scan that loads it.
+Sample run:
+python benchmarks/pipeline_benchmark.py --universe_sizes 1000,5000,10000 --history_lengths 7,14,28 --output_path new.json --baseline_path old.json
+"""
+
+# Stages of the two runs of every case that are reported, as (name in the report, run, stage)
+REPORTED_STAGES = [("fetch", "scan", "fetch"), ("prefilter", "scan", "prefilter"), ("indicators", "scan", "indicators"),
+					("feature_assembly", "scan", "feature_assembly"), ("save_dictionary", "scan", "save_dictionary"),
+					("load_dictionary", "load", "load_dictionary"), ("load_feature_assembly", "load", "feature_assembly"),
+					("checkpoint", "scan", "checkpoint"), ("fit", "scan", "fit"), ("score", "scan", "score")]
+
+def run_scan(run, symbol_names, history_to_use, data_directory, data_dictionary_path):
+	"""
+	One find_anomalies run inside a worker process. Returns its metrics and the peak memory of the process in MB.
+	"""
+	config = create_config(data_source = "local", data_directory = data_directory, history_to_use = history_to_use, indicator_engine = args.indicator_engine,
+							data_dictionary_path = data_dictionary_path, top_n = 0, is_save_dictionary = 1 if run == "scan" else 0,
+							is_load_from_dictionary = 1 if run == "load" else 0)
+	with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+		surpriver = Surpriver(config)
+		surpriver.dataEngine.stocks_list = symbol_names
+		surpriver.find_anomalies()
+	return surpriver.metrics.get_summary(), resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+def run_in_new_process(*arguments):
+	"""
+	Run a scan in a fresh process, so its peak memory and caches are its own
+	"""
+	with multiprocessing.get_context("fork").Pool(1) as pool:
+		return pool.apply(run_scan, arguments)
+
+def run_case(symbol_names, history_to_use, data_directory, work_directory):
+	data_dictionary_path = os.path.join(work_directory, args.data_dictionary_path)
+	runs = {run: run_in_new_process(run, symbol_names, history_to_use, data_directory, data_dictionary_path) for run in ["scan", "load"]}
+	os.remove(data_dictionary_path)
+
+	stages = {name: runs[run][0]["stages"].get(stage, {"seconds": 0.0})["seconds"] for name, run, stage in REPORTED_STAGES}
+	return {"symbols": len(symbol_names), "history_to_use": history_to_use, "stages": stages,
+			"scan_seconds": runs["scan"][0]["total_seconds"], "load_seconds": runs["load"][0]["total_seconds"],
+			"scan_peak_memory_mb": runs["scan"][1], "load_peak_memory_mb": runs["load"][1],
+			"scanned_symbols": runs["scan"][0]["counters"].get("symbols_scanned", 0),
+			"symbol_latency_seconds": runs["scan"][0]["symbol_latency_seconds"]}
+
+def get_case_table(cases):
+	rows = []
+	for case in cases:
+		rows.append({"symbols": case["symbols"], "history": case["history_to_use"], **case["stages"],
+					"scan": case["scan_seconds"], "load": case["load_seconds"], "scan_mb": case["scan_peak_memory_mb"], "load_mb": case["load_peak_memory_mb"]})
+	return pd.DataFrame(rows).set_index(["symbols", "history"])
+
+def get_scaling_exponents(table):
+	"""
+	How every stage grows with the number of symbols between the smallest and the largest universe, for every history length. 1 is linear.
+	"""
+	exponents = {}
+	for history, history_table in table.groupby(level = "history"):
+		history_table = history_table.droplevel("history").sort_index()
+		if len(history_table) < 2:
+			continue
+		smallest, largest = history_table.iloc[0], history_table.iloc[-1]
+		with np.errstate(divide = "ignore", invalid = "ignore"):
+			exponents[history] = np.log(largest / smallest) / np.log(history_table.index[-1] / history_table.index[0])
+	return pd.DataFrame(exponents).T.rename_axis("history")
+
+def print_report(results, baseline):
+	table = get_case_table(results["cases"])
+	pd.set_option("display.width", 250)
+	pd.set_option("display.max_columns", 50)
+	print("\nSeconds per stage, total seconds of both runs and their peak memory in MB")
+	print(table.round(3).to_string())
+
+	time_columns = [name for name, _, _ in REPORTED_STAGES] + ["scan", "load"]
+	print("\nMilliseconds per symbol")
+	print((table[time_columns].div(table.index.get_level_values("symbols"), axis = 0) * 1000).round(3).to_string())
+
+	exponents = get_scaling_exponents(table[time_columns])
+	if len(exponents) > 0:
+		print("\nScaling exponent with the number of symbols (1 is linear)")
+		print(exponents.round(2).to_string())
+
+	if baseline is None:
+		return
+
+	# Stages that the baseline did not report yet are left empty
+	baseline_table = get_case_table(baseline["cases"]).reindex(columns = table.columns)
+	common_cases = table.index.intersection(baseline_table.index)
+	if len(common_cases) == 0:
+		print("\nThe baseline has no case with the same number of symbols and history")
+		return
+
+	ratios = table.loc[common_cases] / baseline_table.loc[common_cases]
+	print("\nCurrent / baseline")
+	print(ratios.round(2).to_string())
+
+	baseline_exponents = get_scaling_exponents(baseline_table.loc[common_cases, time_columns])
+	if len(baseline_exponents) > 0:
+		print("\nScaling exponent change (current - baseline)")
+		print((get_scaling_exponents(table.loc[common_cases, time_columns]) - baseline_exponents).round(2).to_string())
+
+	# Very short stages are too noisy to compare
+	regressions = []
+	for (symbols, history), row in ratios[time_columns].iterrows():
+		for stage, ratio in row.items():
+			if ratio > args.regression_threshold and table.loc[(symbols, history), stage] > 0.05:
+				regressions.append("%d symbols, history %d: %s %.2fx (%.3fs -> %.3fs)" % (symbols, history, stage, ratio, baseline_table.loc[(symbols, history), stage], table.loc[(symbols, history), stage]))
+	print("\n%d regressions over %.2fx" % (len(regressions), args.regression_threshold))
+	for regression in regressions:
+		print(regression)
+
+def main():
+	universe_sizes = sorted(int(value) for value in args.universe_sizes.split(","))
+	history_lengths = sorted(int(value) for value in args.history_lengths.split(","))
+	settings = {"bars": args.bars, "seed": args.seed, "gap_probability": args.gap_probability, "zero_volume_probability": args.zero_volume_probability,
+				"indicator_engine": args.indicator_engine, "data_dictionary_path": args.data_dictionary_path}
+
+	with tempfile.TemporaryDirectory() as work_directory:
+		data_directory = args.data_directory if args.data_directory != "" else os.path.join(work_directory, "prices")
+		print("Writing %d synthetic symbols with %d bars each to %s..." % (universe_sizes[-1], args.bars, data_directory))
+		symbol_names = write_price_files(data_directory, universe_sizes[-1], args.bars, seed = args.seed, gap_probability = args.gap_probability,
+										zero_volume_probability = args.zero_volume_probability)
+
+		cases = []
+		for number_of_symbols in universe_sizes:
+			for history_to_use in history_lengths:
+				print("Scanning %d symbols with history %d..." % (number_of_symbols, history_to_use))
+				cases.append(run_case(symbol_names[:number_of_symbols], history_to_use, data_directory, work_directory))
+
+	results = {"settings": settings, "cases": cases}
+	with open(args.output_path, "w") as results_file:
+		json.dump(results, results_file, indent = 1)
+	print("Results stored in", args.output_path)
+
+	baseline = None
+	if args.baseline_path != "":
+		with open(args.baseline_path) as baseline_file:
+			baseline = json.load(baseline_file)
+		if baseline["settings"] != settings:
+			print("The baseline was run with different settings:", baseline["settings"])
+	print_report(results, baseline)
+
+main()
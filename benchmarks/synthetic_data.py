@@ -0,0 +1,71 @@
+# Basic libraries
+import os
+import json
+import numpy as np
+import pandas as pd
+
+"""
+Deterministic synthetic OHLCV bars for the benchmarks. Symbol i gets the same bars for the same seed no matter how many symbols are generated,
+so a small universe is always a prefix of a bigger one.
+"""
+
+# Settings stored next to the price files, so files that were written with the same settings are reused
+MANIFEST_FILE = "synthetic_data.json"
+
+def get_symbol_names(number_of_symbols):
+	return ["SYM%05d" % i for i in range(0, number_of_symbols)]
+
+def generate_symbol_prices(symbol_index, number_of_bars, seed = 0, gap_probability = 0.0, zero_volume_probability = 0.02, granularity_minutes = 15):
+	"""
+	Bars of one symbol -> 'Datetime', 'Open', 'High', 'Low', 'Close', 'Volume'. Every symbol has its own price level, volatility and volume level,
+	and a few price jumps with a volume spike. Bars are missing with gap_probability and have no volume with zero_volume_probability.
+	"""
+	random_state = np.random.RandomState([seed, symbol_index])
+	base_price = np.exp(random_state.uniform(np.log(2), np.log(500)))
+	volatility = np.exp(random_state.uniform(np.log(0.001), np.log(0.03)))
+	average_volume = np.exp(random_state.uniform(np.log(500), np.log(5000000)))
+
+	returns = random_state.normal(0, volatility, number_of_bars)
+	is_jump = random_state.rand(number_of_bars) < 0.002
+	returns[is_jump] += random_state.normal(0, 10 * volatility, is_jump.sum())
+	close = base_price * np.exp(np.cumsum(returns))
+	open_prices = np.concatenate([close[:1], close[:-1]]) * (1 + random_state.normal(0, volatility / 4, number_of_bars))
+	high = np.maximum(open_prices, close) * (1 + np.abs(random_state.normal(0, volatility / 2, number_of_bars)))
+	low = np.minimum(open_prices, close) * (1 - np.abs(random_state.normal(0, volatility / 2, number_of_bars)))
+	volume = np.round(average_volume * random_state.lognormal(0, 0.5, number_of_bars) * np.where(is_jump, 5, 1))
+	volume[random_state.rand(number_of_bars) < zero_volume_probability] = 0
+
+	dates = pd.date_range("2020-08-03 09:30", periods = number_of_bars, freq = "%dmin" % granularity_minutes, tz = "America/New_York")
+	prices = pd.DataFrame({"Datetime": dates, "Open": open_prices, "High": high, "Low": low, "Close": close, "Volume": volume})
+	if gap_probability > 0:
+		prices = prices[random_state.rand(number_of_bars) >= gap_probability].reset_index(drop = True)
+	return prices
+
+def generate_prices(number_of_symbols, number_of_bars, **settings):
+	"""
+	Symbol -> bars for the first number_of_symbols symbols. settings are passed on to generate_symbol_prices.
+	"""
+	return {symbol: generate_symbol_prices(i, number_of_bars, **settings) for i, symbol in enumerate(get_symbol_names(number_of_symbols))}
+
+def write_price_files(data_directory, number_of_symbols, number_of_bars, **settings):
+	"""
+	Write <symbol>.csv files that the local data source can read. Nothing is written if the directory already has at least as many symbols
+	generated with the same settings. Returns the symbol names.
+	"""
+	manifest_path = os.path.join(data_directory, MANIFEST_FILE)
+	manifest = {"number_of_bars": number_of_bars, **settings}
+	if os.path.exists(manifest_path):
+		with open(manifest_path) as manifest_file:
+			existing_manifest = json.load(manifest_file)
+		if existing_manifest.pop("number_of_symbols", 0) >= number_of_symbols and existing_manifest == manifest:
+			return get_symbol_names(number_of_symbols)
+		os.remove(manifest_path)
+
+	os.makedirs(data_directory, exist_ok = True)
+	for i, symbol in enumerate(get_symbol_names(number_of_symbols)):
+		generate_symbol_prices(i, number_of_bars, **settings).to_csv(os.path.join(data_directory, symbol + ".csv"), index = False)
+
+	# The manifest is written last, so an interrupted run writes the files again
+	with open(manifest_path, "w") as manifest_file:
+		json.dump({"number_of_symbols": number_of_symbols, **manifest}, manifest_file)
+	return get_symbol_names(number_of_symbols)
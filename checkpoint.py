@@ -0,0 +1,118 @@
+# Basic libraries
+import os
+import glob
+import time
+import collections
+import numpy as np
+
+class CheckpointLog:
+	"""
+	Append-only log of the symbols a scan has finished, kept in a directory next to the data dictionary. Finished symbols are buffered and
+	committed as a new segment file every commit_interval symbols, so every record is written once no matter how large the scan gets.
+	A segment is written next to its final name and renamed, so a crash loses at most the symbols after the last commit and never breaks
+	the committed segments. At the end of a scan the log is compacted into the data dictionary and removed. The segments left behind by
+	an interrupted scan are read back to resume it. Segments committed more than max_age_seconds ago hold outdated bars, they are removed and
+	their symbols are scanned again.
+	"""
+	def __init__(self, directory, settings, commit_interval = 100, max_age_seconds = None):
+		self.DIRECTORY = directory
+		self.COMMIT_INTERVAL = commit_interval
+		self.MAX_AGE_SECONDS = max_age_seconds
+
+		# Arguments that change the records. Segments written with other settings are not resumed.
+		self.settings = settings
+
+		# Finished symbols since the last commit
+		self.records = []
+		self.dropped_symbols = []
+		self.committed_symbols = set()
+		self.next_segment = None
+
+	def get_segment_paths(self):
+		return sorted(glob.glob(os.path.join(self.DIRECTORY, "segment_*.npy")))
+
+	def get_segment_number(self, segment_path):
+		return int(os.path.basename(segment_path)[len("segment_"):-len(".npy")])
+
+	def add_record(self, symbol, record):
+		"""
+		Log a symbol that made it into the data dictionary. Symbols that were resumed from the log are already in it.
+		"""
+		if symbol in self.committed_symbols:
+			return
+		self.records.append((symbol, record))
+		self.commit_if_full()
+
+	def add_dropped_symbol(self, symbol, reason, detail = None):
+		"""
+		Log a symbol that was dropped before it got into the data dictionary, so a resumed scan does not download it again
+		"""
+		if symbol in self.committed_symbols:
+			return
+		self.dropped_symbols.append((symbol, reason, detail))
+		self.commit_if_full()
+
+	def commit_if_full(self):
+		if len(self.records) + len(self.dropped_symbols) >= self.COMMIT_INTERVAL:
+			self.commit()
+
+	def commit(self):
+		"""
+		Write the buffered symbols as a new segment
+		"""
+		if len(self.records) + len(self.dropped_symbols) == 0:
+			return
+		os.makedirs(self.DIRECTORY, exist_ok = True)
+		if self.next_segment is None:
+			self.next_segment = max([self.get_segment_number(path) for path in self.get_segment_paths()], default = 0) + 1
+		segment_path = os.path.join(self.DIRECTORY, "segment_%06d.npy" % self.next_segment)
+		with open(segment_path + ".tmp", "wb") as segment_file:
+			np.save(segment_file, {"settings": self.settings, "commit_time": time.time(), "records": self.records,
+					"dropped_symbols": self.dropped_symbols})
+		os.replace(segment_path + ".tmp", segment_path)
+		self.next_segment += 1
+
+		self.committed_symbols.update(symbol for symbol, _ in self.records)
+		self.committed_symbols.update(symbol for symbol, _, _ in self.dropped_symbols)
+		self.records, self.dropped_symbols = [], []
+
+	def resume(self):
+		"""
+		Records and dropped symbols of all committed segments, in the order they were finished. A log with other settings or a broken segment
+		is removed and nothing is resumed. Segments committed more than max_age_seconds ago are removed on their own, the others are resumed.
+		"""
+		now = time.time()
+		records, dropped_symbols = collections.OrderedDict(), collections.OrderedDict()
+		for segment_path in self.get_segment_paths():
+			try:
+				segment = np.load(segment_path, allow_pickle = True).item()
+			except Exception as e:
+				print("Could not read checkpoint segment %s, starting over" % segment_path, e)
+				self.clear()
+				return collections.OrderedDict(), collections.OrderedDict()
+			if segment["settings"] != self.settings:
+				print("The checkpoint in %s was written with other settings, starting over" % self.DIRECTORY)
+				self.clear()
+				return collections.OrderedDict(), collections.OrderedDict()
+			# Bars downloaded that long ago are outdated, the symbols of the segment are scanned again
+			if self.MAX_AGE_SECONDS is not None and now - segment.get("commit_time", 0) > self.MAX_AGE_SECONDS:
+				print("Checkpoint segment %s is older than %g minutes, its symbols are scanned again" % (segment_path, self.MAX_AGE_SECONDS / 60))
+				os.remove(segment_path)
+				continue
+			records.update(segment["records"])
+			dropped_symbols.update((symbol, (reason, detail)) for symbol, reason, detail in segment["dropped_symbols"])
+
+		self.committed_symbols = set(records) | set(dropped_symbols)
+		return records, dropped_symbols
+
+	def clear(self):
+		"""
+		Remove every segment, after the log was compacted into the data dictionary. Half written segments of a crash go too.
+		"""
+		for segment_path in glob.glob(os.path.join(self.DIRECTORY, "segment_*")):
+			os.remove(segment_path)
+		self.records, self.dropped_symbols = [], []
+		self.committed_symbols = set()
+		self.next_segment = None
+		if os.path.isdir(self.DIRECTORY) and len(os.listdir(self.DIRECTORY)) == 0:
+			os.rmdir(self.DIRECTORY)
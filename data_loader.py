@@ -1,39 +1,81 @@
 # Basic libraries
 import os
-import ta
-import sys
-import json
-import math
-import pickle
+import time
 import random
-import requests
+import threading
 import collections
 import numpy as np
-from os import walk
 import pandas as pd
-import yfinance as yf
-import datetime as dt
 from tqdm import tqdm
-from scipy.stats import linregress
-from datetime import datetime, timedelta
-from feature_generator import TAEngine
+from concurrent.futures import ThreadPoolExecutor
+from feature_generator import TAEngine, PRICE_COLUMNS
+from data_sources import create_data_source
+from bar_store import BarStore, is_bar_store_path
+from symbol_arrays import FeatureMatrix, PriceHistories
+from metrics import ScanMetrics
+from checkpoint import CheckpointLog
+from prefilters import PriceScreens
+from bar_alignment import BarCalendar
+from granularity_fusion import MultiGranularityTAEngine
 import warnings
-from binance.client import Client
 
 warnings.filterwarnings("ignore")
 
+class RateLimiter:
+	def __init__(self, requests_per_second):
+		self.MIN_INTERVAL = 1.0 / requests_per_second if requests_per_second > 0 else 0
+		self.lock = threading.Lock()
+		self.next_request_time = 0
+
+	def wait(self, number_of_requests = 1):
+		"""
+		Block until another request (or a batch of requests) is allowed. Safe to call from multiple threads.
+		"""
+		with self.lock:
+			now = time.monotonic()
+			wait_time = self.next_request_time - now
+			self.next_request_time = max(now, self.next_request_time) + self.MIN_INTERVAL * number_of_requests
+		if wait_time > 0:
+			time.sleep(wait_time)
+
 class DataEngine:
-	def __init__(self, history_to_use, data_granularity_minutes, is_save_dict, is_load_dict, dict_path, min_volume_filter, is_test, future_bars_for_testing, volatility_filter, stocks_list, data_source):
+	def __init__(self, history_to_use, data_granularity_minutes, is_save_dict, is_load_dict, dict_path, min_volume_filter, is_test, future_bars_for_testing, volatility_filter, stocks_list, data_source,
+				fetch_workers = 1, requests_per_second = 0, max_retries = 3, retry_backoff_seconds = 1.0, price_fetcher = None, batch_size = 1, feature_workers = 1, indicator_engine = "ta", data_directory = None, series_only = False, indicator_cache_size = None, max_gap_fraction = 0.1, fusion_granularities = None, checkpoint_max_age_minutes = 720, metrics = None):
 		print("Data engine has been initialized...")
 		self.DATA_GRANULARITY_MINUTES = data_granularity_minutes
 		self.IS_SAVE_DICT = is_save_dict
 		self.IS_LOAD_DICT = is_load_dict
 		self.DICT_PATH = dict_path
+		self.bar_store = BarStore()
 		self.VOLUME_FILTER = min_volume_filter
 		self.FUTURE_FOR_TESTING = future_bars_for_testing
 		self.IS_TEST = is_test
 		self.VOLATILITY_THRESHOLD = volatility_filter
 		self.DATA_SOURCE = data_source
+		self.FETCH_WORKERS = max(1, fetch_workers)
+		self.MAX_RETRIES = max_retries
+		self.RETRY_BACKOFF_SECONDS = retry_backoff_seconds
+		self.MAX_GAP_FRACTION = max_gap_fraction
+
+		# Stage timings and dropped symbols of this run
+		self.metrics = metrics if metrics is not None else ScanMetrics()
+
+		# Data source adapter that downloads the prices
+		self.data_source = create_data_source(self.DATA_SOURCE, self.DATA_GRANULARITY_MINUTES, fetch_workers = self.FETCH_WORKERS, data_directory = data_directory)
+
+		# Only some data sources can download several symbols in one call. A custom price fetcher always works symbol by symbol.
+		if self.data_source.SUPPORTS_BATCHES and price_fetcher is None:
+			self.BATCH_SIZE = max(1, batch_size)
+		else:
+			self.BATCH_SIZE = 1
+
+		# Requests to the same data source share one rate limiter across all fetch workers
+		if requests_per_second <= 0:
+			requests_per_second = self.data_source.DEFAULT_REQUESTS_PER_SECOND
+		self.rate_limiter = RateLimiter(requests_per_second)
+
+		# Function used to download prices for a symbol. It can be replaced by a local stub for testing without a network connection
+		self.price_fetcher = price_fetcher if price_fetcher is not None else self.download_prices
 
 		# Stocks list
 		self.directory_path = str(os.path.dirname(os.path.abspath(__file__)))
@@ -44,16 +86,41 @@ class DataEngine:
 		self.load_stocks_from_file()
 
 		# Load Technical Indicator engine
-		self.taEngine = TAEngine(history_to_use = history_to_use)
+		self.HISTORY_TO_USE = history_to_use
+		if indicator_engine == "vectorized":
+			from vectorized_feature_generator import VectorizedTAEngine
+			self.taEngine = VectorizedTAEngine(history_to_use = history_to_use, series_only = series_only)
+		else:
+			self.taEngine = TAEngine(history_to_use = history_to_use, feature_workers = feature_workers, series_only = series_only)
+
+		# Indicator series are cached for the symbols that were computed last, so rescans and runs with another history reuse them
+		if indicator_cache_size is not None:
+			self.taEngine.indicator_cache.resize(indicator_cache_size)
+
+		# Number of symbols that are sent to the indicator engine at once
+		if indicator_engine == "vectorized":
+			self.FEATURE_CHUNK_SIZE = self.taEngine.SYMBOLS_PER_CHUNK
+		elif feature_workers > 1:
+			self.FEATURE_CHUNK_SIZE = feature_workers * 8
+		else:
+			self.FEATURE_CHUNK_SIZE = 1
+
+		# Features of coarser granularities are computed from the same bars, resampled in memory
+		self.FUSION_GRANULARITIES = list(fusion_granularities) if fusion_granularities is not None else []
+		if len(self.FUSION_GRANULARITIES) > 0:
+			self.taEngine = MultiGranularityTAEngine(self.taEngine, self.FUSION_GRANULARITIES)
 
 		# Dictionary to store data. This will only store and save data if the argument is_save_dictionary is 1.
 		self.features_dictionary_for_all_symbols = {}
 
-		# Data length
-		self.stock_data_length = []
-		
-		# Create an instance of the Binance Client with no api key and no secret (api key and secret not required for the functionality needed for this script)
-		self.binance_client = Client("","")
+		# Finished symbols are logged next to the data dictionary while it is collected, so an interrupted scan can resume
+		self.checkpoint = CheckpointLog(str(dict_path) + ".checkpoint", {"history_to_use": history_to_use, "data_granularity_minutes": data_granularity_minutes,
+										"is_test": is_test, "future_bars": future_bars_for_testing, "volatility_filter": volatility_filter, "min_volume": min_volume_filter,
+										"max_gap_fraction": max_gap_fraction, "fusion_granularities": fusion_granularities,
+										"data_source": data_source}, max_age_seconds = checkpoint_max_age_minutes * 60 if checkpoint_max_age_minutes > 0 else None)
+
+		# Shared timestamp index that the bars of every symbol are aligned to. A new one is built for every scan.
+		self.bar_calendar = BarCalendar()
 
 	def load_stocks_from_file(self):
 		"""
@@ -68,134 +135,403 @@ class DataEngine:
 		print("Total number of stocks: %d" % len(stocks_list))
 		self.stocks_list = stocks_list
 
-	def get_most_frequent_key(self, input_list):
-		counter = collections.Counter(input_list)
-		counter_keys = list(counter.keys())
-		frequent_key = counter_keys[0]
-		return frequent_key
+	def download_prices(self, symbol, start = None):
+		"""
+		Download raw prices for a symbol from the data source. Returns a data frame with columns -> 'Datetime', 'Open', 'High', 'Low', 'Close', 'Volume'.
+		If start is given, only bars from that time on are downloaded.
+		"""
+		return self.data_source.download_prices(symbol, start)
+
+	def download_prices_batch(self, symbols, start = None):
+		"""
+		Download raw prices for several symbols with a single call. Returns a list of data frames in the same order as symbols, with None for symbols without data.
+		"""
+		return self.data_source.download_prices_batch(symbols, start)
+
+	def fetch_prices(self, symbol, start = None):
+		"""
+		Fetch raw prices for a symbol while respecting the rate limit of the data source. Failed requests are retried with exponential backoff.
+		A custom price fetcher is called with start as a keyword argument for incremental updates.
+		"""
+		for attempt in range(0, self.MAX_RETRIES + 1):
+			self.rate_limiter.wait()
+			try:
+				download_start = time.perf_counter()
+				if start is None:
+					stock_prices = self.price_fetcher(symbol)
+				else:
+					stock_prices = self.price_fetcher(symbol, start = start)
+				self.metrics.add_symbol_latency("fetch", time.perf_counter() - download_start)
+				return stock_prices
+			except Exception as e:
+				if attempt == self.MAX_RETRIES:
+					self.metrics.drop_symbol(symbol, "download_failed", e)
+					return None
+				self.metrics.increment("fetch_retries")
+				time.sleep(self.RETRY_BACKOFF_SECONDS * (2 ** attempt) * (1 + random.random()))
+
+	def fetch_prices_batch(self, symbols, start_times = None):
+		"""
+		Fetch raw prices for a batch of symbols. Batches are downloaded in one call when the data source supports it, otherwise symbol by symbol.
+		start_times maps symbols to the time from which their bars are needed. Symbols without a start time get the full period.
+		"""
+		start_times = start_times if start_times is not None else {}
+		if self.BATCH_SIZE == 1:
+			return [self.fetch_prices(symbol, start_times.get(symbol)) for symbol in symbols]
+
+		# One call has one start time, so the whole batch starts at the earliest one. A symbol that is not cached needs the full period.
+		batch_start_times = [start_times.get(symbol) for symbol in symbols]
+		batch_start = None if None in batch_start_times else min(batch_start_times)
+
+		for attempt in range(0, self.MAX_RETRIES + 1):
+			# yfinance still sends one request per symbol under the hood
+			self.rate_limiter.wait(len(symbols))
+			try:
+				download_start = time.perf_counter()
+				all_prices = self.download_prices_batch(symbols, batch_start)
+				self.metrics.add_symbol_latency("fetch", time.perf_counter() - download_start, len(symbols))
+				return all_prices
+			except Exception as e:
+				if attempt == self.MAX_RETRIES:
+					for symbol in symbols:
+						self.metrics.drop_symbol(symbol, "download_failed", e)
+					return [None] * len(symbols)
+				self.metrics.increment("fetch_retries")
+				time.sleep(self.RETRY_BACKOFF_SECONDS * (2 ** attempt) * (1 + random.random()))
+
+	def fetch_prices_for_all_tickers(self, start_times = None, symbols = None):
+		"""
+		Fetch raw prices for all symbols, or the given ones, using a pool of workers. Yields (symbol, prices) in the same order as the stocks list.
+		Only a bounded number of batches are in flight at once so downloaded data does not pile up in memory.
+		"""
+		if symbols is None:
+			symbols = self.stocks_list
+		batches = [symbols[i:i + self.BATCH_SIZE] for i in range(0, len(symbols), self.BATCH_SIZE)]
+		max_in_flight = self.FETCH_WORKERS * 4
+		with ThreadPoolExecutor(max_workers = self.FETCH_WORKERS) as executor:
+			pending = collections.deque()
+			for batch in batches:
+				pending.append((batch, executor.submit(self.fetch_prices_batch, batch, start_times)))
+				if len(pending) >= max_in_flight:
+					next_batch, future = pending.popleft()
+					for symbol, stock_prices in zip(next_batch, future.result()):
+						yield symbol, stock_prices
+
+			while len(pending) > 0:
+				next_batch, future = pending.popleft()
+				for symbol, stock_prices in zip(next_batch, future.result()):
+					yield symbol, stock_prices
 
 	def get_data(self, symbol):
 		"""
 		Get stock data.
 		"""
+		return self.process_prices(self.fetch_prices(symbol), symbol)
 
-		# Find period
-		if self.DATA_GRANULARITY_MINUTES == 1:
-			period = "7d"
-		else:
-			period = "30d"
-
+	def process_prices(self, stock_prices, symbol = None, screens = None):
+		"""
+		Align raw prices to the timestamp index of the scan, split them into historical and future prices and drop partial data.
+		The reason a symbol is dropped goes to the metrics. If screens are given, they run on the raw columns first, so rejected symbols never build a price frame.
+		"""
 		try:
-			# get crytpo price from Binance
-			if(self.DATA_SOURCE == 'binance'):
-				# Binance clients doesn't like 60m as an interval
-				if(self.DATA_GRANULARITY_MINUTES == 60):
-					interval = '1h'
-				else:
-					interval = str(self.DATA_GRANULARITY_MINUTES) + "m"
-				stock_prices = self.binance_client.get_klines(symbol=symbol, interval = interval)
-				# ensure that stock prices contains some data, otherwise the pandas operations below could fail
-				if len(stock_prices) == 0:
+			if stock_prices is None or len(stock_prices) == 0:
+				self.reject_bars(symbol, screens, "no_data")
+				return [], [], True
+
+			# Missing bars are filled, symbols that miss too many of them are partial data
+			if self.bar_calendar.is_ready():
+				stock_prices, gap_mask = self.bar_calendar.align(stock_prices)
+				if gap_mask.mean() > self.MAX_GAP_FRACTION:
+					self.reject_bars(symbol, screens, "partial_data", "%d of %d bars missing" % (gap_mask.sum(), len(gap_mask)))
 					return [], [], True
-				# convert list to pandas dataframe
-				stock_prices = pd.DataFrame(stock_prices, columns=['Datetime', 'Open', 'High', 'Low', 'Close',
-                                             'Volume', 'close_time', 'quote_av', 'trades', 'tb_base_av', 'tb_quote_av', 'ignore'])
-				stock_prices['Datetime'] = stock_prices['Datetime'].astype(float)
-				stock_prices['Open'] = stock_prices['Open'].astype(float)
-				stock_prices['High'] = stock_prices['High'].astype(float)
-				stock_prices['Low'] = stock_prices['Low'].astype(float)
-				stock_prices['Close'] = stock_prices['Close'].astype(float)
-				stock_prices['Volume'] = stock_prices['Volume'].astype(float)
-			# get stock prices from yahoo finance
-			else:
-				stock_prices = yf.download(
-								tickers = symbol,
-								period = period,
-								interval = str(self.DATA_GRANULARITY_MINUTES) + "m",
-								auto_adjust = False,
-								progress=False)
-			stock_prices = stock_prices.reset_index()
-			stock_prices = stock_prices[['Datetime','Open', 'High', 'Low', 'Close', 'Volume']]
-			data_length = len(stock_prices.values.tolist())
-			self.stock_data_length.append(data_length)
-
-			# After getting some data, ignore partial data based on number of data samples
-			if len(self.stock_data_length) > 5:
-				most_frequent_key = self.get_most_frequent_key(self.stock_data_length)
-				if data_length != most_frequent_key:
+				if gap_mask.any():
+					self.metrics.increment("aligned_symbols")
+					self.metrics.increment("filled_bars", int(gap_mask.sum()))
+
+			if screens is not None:
+				rejection = screens.screen(*self.get_raw_history(stock_prices))
+				if rejection is not None:
+					self.metrics.drop_symbol(symbol, *rejection)
 					return [], [], True
 
-			if self.IS_TEST == 1:
-				stock_prices_list = stock_prices.values.tolist()
-				stock_prices_list = stock_prices_list[1:]  # For some reason, yfinance gives some 0 values in the first index
-				future_prices_list = stock_prices_list[-(self.FUTURE_FOR_TESTING + 1):]
-				historical_prices = stock_prices_list[:-self.FUTURE_FOR_TESTING]
-				historical_prices = pd.DataFrame(historical_prices)
-				historical_prices.columns = ['Datetime','Open', 'High', 'Low', 'Close', 'Volume']
-			else:
-				# No testing
-				stock_prices_list = stock_prices.values.tolist()
-				stock_prices_list = stock_prices_list[1:]
-				historical_prices = pd.DataFrame(stock_prices_list)
-				historical_prices.columns = ['Datetime','Open', 'High', 'Low', 'Close', 'Volume']
-				future_prices_list = []
-
-			if len(stock_prices.values.tolist()) == 0:
-				return [], [], True
-		except:
+			# For some reason, yfinance gives some 0 values in the first index
+			stock_prices = self.get_price_frame(stock_prices.iloc[1:])
+			historical_prices, future_prices_list = self.split_prices(stock_prices)
+		except Exception as e:
+			self.reject_bars(symbol, screens, "bad_prices", e)
 			return [], [], True
 
 		return historical_prices, future_prices_list, False
 
+	def reject_bars(self, symbol, screens, reason, detail = None):
+		self.metrics.drop_symbol(symbol, reason, detail)
+		if screens is not None:
+			screens.reject("bars")
+
+	def get_raw_history(self, stock_prices):
+		"""
+		Close prices and volumes of the historical bars of raw prices, the same values that process_prices puts into the historical price frame
+		"""
+		close_prices = np.asarray(stock_prices["Close"].values[1:], dtype = np.float64)
+		volumes = np.asarray(stock_prices["Volume"].values[1:], dtype = np.float64)
+		if self.IS_TEST == 1:
+			return close_prices[:-self.FUTURE_FOR_TESTING], volumes[:-self.FUTURE_FOR_TESTING]
+		return close_prices, volumes
+
+	def get_price_frame(self, stock_prices):
+		"""
+		Copy raw prices once into a data frame with the datetimes and a single float64 block for 'Open', 'High', 'Low', 'Close', 'Volume'.
+		Historical and future prices are row slices of this frame, so they share its buffer instead of being rebuilt from python lists.
+		"""
+		price_values = np.asarray(stock_prices[PRICE_COLUMNS].values, dtype = np.float64)
+		price_frame = pd.DataFrame(price_values, columns = PRICE_COLUMNS, copy = False)
+		price_frame.insert(0, 'Datetime', stock_prices['Datetime'].array)
+		return price_frame
+
+	def split_prices(self, stock_prices):
+		"""
+		Split a data frame of bars into historical prices and the future prices kept for testing
+		"""
+		if self.IS_TEST == 1:
+			future_prices_list = stock_prices.iloc[-(self.FUTURE_FOR_TESTING + 1):].values.tolist()
+			historical_prices = stock_prices.iloc[:-self.FUTURE_FOR_TESTING]
+		else:
+			# No testing
+			future_prices_list = []
+			historical_prices = stock_prices
+
+		return historical_prices, future_prices_list
+
+	def get_cached_prices(self, cached_data):
+		"""
+		All bars of a symbol in the data dictionary. The first future bar is the same as the last historical bar.
+		"""
+		cached_prices = cached_data["current_prices"][['Datetime','Open', 'High', 'Low', 'Close', 'Volume']]
+		if len(cached_data["future_prices"]) > 1:
+			future_prices = pd.DataFrame(cached_data["future_prices"][1:], columns = ['Datetime','Open', 'High', 'Low', 'Close', 'Volume'])
+			cached_prices = pd.concat([cached_prices, future_prices], ignore_index = True)
+		return cached_prices.reset_index(drop = True)
+
+	def get_last_bar_time(self, cached_data):
+		if len(cached_data["future_prices"]) > 0:
+			return cached_data["future_prices"][-1][0]
+		return cached_data["current_prices"]["Datetime"].iloc[-1]
+
+	def merge_new_bars(self, cached_prices, new_prices):
+		"""
+		Append newly downloaded bars to the cached ones and drop the oldest bars so the number of bars stays the same.
+		The last cached bar may still have been in progress when it was downloaded, so bars that come again replace the cached ones.
+		Returns the merged prices and whether anything changed.
+		"""
+		if new_prices is None:
+			return cached_prices, False
+
+		new_prices = new_prices[new_prices["Datetime"] >= cached_prices["Datetime"].iloc[-1]]
+		if len(new_prices) == 0:
+			return cached_prices, False
+
+		merged_prices = pd.concat([cached_prices[cached_prices["Datetime"] < new_prices["Datetime"].iloc[0]], new_prices], ignore_index = True)
+		merged_prices = merged_prices.iloc[-len(cached_prices):].reset_index(drop = True)
+		return merged_prices, not merged_prices.equals(cached_prices)
+
+	def update_cached_prices(self, cached_data, new_prices, symbol = None):
+		"""
+		Same as process_prices for a symbol from the data dictionary. new_prices only holds the bars after the cached ones.
+		Also returns the cached technical indicators if they are still valid, otherwise None.
+		"""
+		try:
+			merged_prices, is_updated = self.merge_new_bars(self.get_cached_prices(cached_data), new_prices)
+			historical_prices, future_prices_list = self.split_prices(self.get_price_frame(merged_prices))
+		except Exception as e:
+			self.metrics.drop_symbol(symbol, "bad_prices", e)
+			return [], [], True, None
+
+		# Prices that did not change keep their technical indicators
+		if is_updated or len(historical_prices) != len(cached_data["current_prices"]) or self.is_features_outdated(cached_data):
+			return historical_prices, future_prices_list, False, None
+		return historical_prices, future_prices_list, False, cached_data["features"]
+
 	def calculate_volatility(self, stock_price_data):
-		CLOSE_PRICE_INDEX = 4
-		stock_price_data_list = stock_price_data.values.tolist()
-		close_prices = [float(item[CLOSE_PRICE_INDEX]) for item in stock_price_data_list]
-		close_prices = [item for item in close_prices if item != 0]
+		close_prices = stock_price_data['Close'].values
+		close_prices = close_prices[close_prices != 0]
 		volatility = np.std(close_prices)
 		return volatility
 
-	def collect_data_for_all_tickers(self):
+	def collect_data_for_all_tickers(self, cached_dictionary = None):
 		"""
-		Iterates over all symbols and collects their data
+		Iterates over all symbols and collects their data. Symbols in cached_dictionary only download the bars after the cached ones.
 		"""
 
 		print("Loading data for all stocks...")
-		features = []
+		self.metrics.increment("symbols_requested", len(self.stocks_list))
+		self.screens = PriceScreens(self.HISTORY_TO_USE, self.VOLATILITY_THRESHOLD, self.VOLUME_FILTER, self.metrics)
+		self.bar_calendar = BarCalendar()
+		features = FeatureMatrix(len(self.stocks_list))
 		symbol_names = []
 		historical_price_info = []
 		future_price_info = []
 
-		 # Any stock with very low volatility is ignored. You can change this line to address that.
-		for i in tqdm(range(len(self.stocks_list))):
-			symbol = self.stocks_list[i]
+		# Symbols that passed the volatility filter and are waiting for their technical indicators
+		pending_symbols = []
+
+		# Symbols that an interrupted scan already finished are not downloaded again
+		resumed_records, resumed_drops = collections.OrderedDict(), collections.OrderedDict()
+		if self.IS_SAVE_DICT == 1:
+			resumed_records, resumed_drops = self.checkpoint.resume()
+			if len(resumed_records) + len(resumed_drops) > 0:
+				print("Resuming an interrupted scan, %d symbols were already finished" % (len(resumed_records) + len(resumed_drops)))
+				self.metrics.increment("symbols_resumed", len(resumed_records) + len(resumed_drops))
+		symbols_to_fetch = [symbol for symbol in self.stocks_list if symbol not in resumed_records and symbol not in resumed_drops]
+
+		# Time of the last cached bar of every symbol that can be updated incrementally
+		start_times = {}
+		if cached_dictionary is not None:
+			start_times = {symbol: self.get_last_bar_time(cached_dictionary[symbol]) for symbol in symbols_to_fetch if symbol in cached_dictionary}
+
+		# Feature workers have to be forked before the download threads start
+		self.taEngine.open_pool()
+		try:
+			# Finished symbols come first in the stocks list, so the resumed ones keep their place in the feature matrix
+			for symbol in self.stocks_list:
+				if symbol in resumed_drops:
+					self.metrics.drop_symbol(symbol, *resumed_drops[symbol])
+				elif symbol in resumed_records:
+					self.resume_symbol(symbol, resumed_records[symbol], pending_symbols)
+
+			# Symbols with broken bars, bad prices, low volatility or low volume are screened out before their technical indicators are computed.
+			# Prices are downloaded concurrently but processed in the order of the stocks list. The first downloads build the timestamp index.
+			prices_stream = self.bar_calendar.warm_up(self.metrics.time_iterator("fetch", self.fetch_prices_for_all_tickers(start_times, symbols_to_fetch)), start_times)
+			for symbol, stock_prices in tqdm(prices_stream, total = len(symbols_to_fetch)):
+				filter_start = time.perf_counter()
+				try:
+					with self.metrics.stage("prefilter"):
+						cached_features = None
+						if symbol in start_times:
+							stock_price_data, future_prices, not_found, cached_features = self.update_cached_prices(cached_dictionary[symbol], stock_prices, symbol)
+							if not_found:
+								self.screens.reject("bars")
+							else:
+								rejection = self.screens.screen(stock_price_data["Close"].values, stock_price_data["Volume"].values)
+								if rejection is not None:
+									self.metrics.drop_symbol(symbol, *rejection)
+									not_found = True
+						else:
+							stock_price_data, future_prices, not_found = self.process_prices(stock_prices, symbol, self.screens)
+
+						if not not_found:
+							pending_symbols.append([symbol, stock_price_data, future_prices, cached_features])
+						else:
+							self.drop_symbol(symbol, *(self.metrics.get_drop_reason(symbol) or ("no_data", None)))
+
+				except Exception as e:
+					print("Exception", e)
+					self.drop_symbol(symbol, "error", e)
+					continue
+				finally:
+					self.metrics.add_symbol_latency("prefilter", time.perf_counter() - filter_start)
+
+				if len(pending_symbols) >= self.FEATURE_CHUNK_SIZE:
+					self.add_features_for_symbols(pending_symbols, features, symbol_names, historical_price_info, future_price_info)
+					pending_symbols = []
+
+			self.add_features_for_symbols(pending_symbols, features, symbol_names, historical_price_info, future_price_info)
+		finally:
+			self.taEngine.close_pool()
+
+			# Symbols that were finished before a crash or an interrupt are kept for the next run
+			if self.IS_SAVE_DICT == 1:
+				with self.metrics.stage("checkpoint"):
+					self.checkpoint.commit()
+
+		print(self.screens.get_summary())
+
+		# Compact the checkpoint into the data dictionary, which is written once per scan
+		if self.IS_SAVE_DICT == 1:
+			self.save_data_dictionary(self.features_dictionary_for_all_symbols)
+			self.checkpoint.clear()
+
+		# Sometimes, there are some errors in feature generation or price extraction, let us remove that stuff
+		with self.metrics.stage("feature_assembly"):
+			features, historical_price_info, future_price_info, symbol_names = self.remove_bad_data(features, historical_price_info, future_price_info, symbol_names)
+		self.metrics.increment("symbols_scanned", len(symbol_names))
+
+		# The data dictionary shares the packed prices instead of keeping a second copy of them
+		for i, symbol in enumerate(symbol_names):
+			self.features_dictionary_for_all_symbols[symbol]["current_prices"] = historical_price_info[i]
+
+		return features, historical_price_info, future_price_info, symbol_names
+
+	def resume_symbol(self, symbol, record, pending_symbols):
+		"""
+		Queue a symbol from the checkpoint of an interrupted scan like a freshly downloaded one. Its technical indicators are reused if they are still valid.
+		"""
+		cached_features = None if self.is_features_outdated(record) else record["features"]
+		pending_symbols.append([symbol, record["current_prices"], record["future_prices"], cached_features])
+
+	def drop_symbol(self, symbol, reason, detail = None):
+		"""
+		Record why a symbol was dropped. When the data dictionary is saved, the symbol is also logged so a resumed scan skips it.
+		"""
+		self.metrics.drop_symbol(symbol, reason, detail)
+		if self.IS_SAVE_DICT == 1:
+			with self.metrics.stage("checkpoint"):
+				self.checkpoint.add_dropped_symbol(symbol, reason, None if detail is None else str(detail))
+
+	def collect_prices_for_all_tickers(self):
+		"""
+		Download and split the prices of all symbols without computing technical indicators. Symbols with missing or broken bars are dropped like in
+		a scan, the other price screens depend on the configuration and are applied by the parameter sweep.
+		"""
+		print("Loading prices for all stocks...")
+		symbol_names = []
+		historical_price_info = []
+		future_price_info = []
+		self.bar_calendar = BarCalendar()
+
+		prices_stream = self.bar_calendar.warm_up(self.metrics.time_iterator("fetch", self.fetch_prices_for_all_tickers()))
+		for symbol, stock_prices in tqdm(prices_stream, total = len(self.stocks_list)):
 			try:
-				stock_price_data, future_prices, not_found = self.get_data(symbol)
-					
+				stock_price_data, future_prices, not_found = self.process_prices(stock_prices, symbol)
 				if not not_found:
-					volatility = self.calculate_volatility(stock_price_data)
+					symbol_names.append(symbol)
+					historical_price_info.append(stock_price_data)
+					future_price_info.append(future_prices)
+			except Exception as e:
+				print("Exception", e)
+				continue
 
-					# Filter low volatility stocks
-					if volatility < self.VOLATILITY_THRESHOLD:
+		return symbol_names, PriceHistories(historical_price_info), future_price_info
+
+	def add_features_for_symbols(self, pending_symbols, features, symbol_names, historical_price_info, future_price_info):
+		"""
+		Compute technical indicators for a chunk of symbols that passed the pre-filters and add them to the feature matrix and the output lists
+		"""
+		if len(pending_symbols) == 0:
+			return
+
+		# Technical indicators are only computed for symbols that do not have valid cached ones
+		symbols_to_compute = [item for item in pending_symbols if item[3] is None]
+		with self.metrics.stage("indicators"):
+			indicators_start = time.perf_counter()
+			computed_indicators = iter(self.taEngine.get_technical_indicators_for_all([item[1] for item in symbols_to_compute]))
+			self.metrics.add_symbol_latency("indicators", time.perf_counter() - indicators_start, len(symbols_to_compute))
+		all_indicators = [next(computed_indicators) if item[3] is None else (item[3], None) for item in pending_symbols]
+
+		with self.metrics.stage("feature_assembly"):
+			for (symbol, stock_price_data, future_prices, _), (features_dictionary, error) in zip(pending_symbols, all_indicators):
+				try:
+					if error is not None:
+						print("Exception", error)
+						self.drop_symbol(symbol, "indicator_error", error)
 						continue
-						
-					features_dictionary = self.taEngine.get_technical_indicators(stock_price_data)
+
 					feature_list = self.taEngine.get_features(features_dictionary)
 
-					# Add to dictionary
+					# Add to dictionary, and to the checkpoint that is committed every 100 symbols
 					self.features_dictionary_for_all_symbols[symbol] = {"features": features_dictionary, "current_prices": stock_price_data, "future_prices": future_prices}
-
-					# Save dictionary after every 100 symbols
-					if len(self.features_dictionary_for_all_symbols) % 100 == 0 and self.IS_SAVE_DICT == 1:
-						np.save(self.DICT_PATH, self.features_dictionary_for_all_symbols)
-
-					if np.isnan(feature_list).any() == True:
-						continue
-
-					# Check for volume
-					average_volume_last_30_tickers = np.mean(list(stock_price_data["Volume"])[-30:])
-					if average_volume_last_30_tickers < self.VOLUME_FILTER:
-						continue
+					if self.IS_SAVE_DICT == 1:
+						with self.metrics.stage("checkpoint"):
+							self.checkpoint.add_record(symbol, self.features_dictionary_for_all_symbols[symbol])
 
 					# Add to lists
 					features.append(feature_list)
@@ -203,57 +539,111 @@ class DataEngine:
 					historical_price_info.append(stock_price_data)
 					future_price_info.append(future_prices)
 
-			except Exception as e:
-				print("Exception", e)
-				continue
+				except Exception as e:
+					print("Exception", e)
+					self.drop_symbol(symbol, "error", e)
+					continue
 
-		# Sometimes, there are some errors in feature generation or price extraction, let us remove that stuff
-		features, historical_price_info, future_price_info, symbol_names = self.remove_bad_data(features, historical_price_info, future_price_info, symbol_names)
+	def save_data_dictionary(self, data_dictionary):
+		"""
+		Save the data dictionary. Paths ending with .bars use the columnar bar store, anything else is saved as a pickled numpy file.
+		Both are written next to the target and renamed, so a crash never leaves a half written dictionary behind.
+		"""
+		with self.metrics.stage("save_dictionary"):
+			if is_bar_store_path(self.DICT_PATH):
+				self.bar_store.save(self.DICT_PATH, data_dictionary)
+			else:
+				# np.save adds the .npy extension to paths without it
+				dictionary_path = self.DICT_PATH if str(self.DICT_PATH).endswith(".npy") else str(self.DICT_PATH) + ".npy"
+				with open(dictionary_path + ".tmp", "wb") as dictionary_file:
+					np.save(dictionary_file, data_dictionary)
+				os.replace(dictionary_path + ".tmp", dictionary_path)
+
+	def read_data_dictionary(self):
+		if is_bar_store_path(self.DICT_PATH):
+			return self.bar_store.load(self.DICT_PATH)
+		else:
+			return np.load(self.DICT_PATH, allow_pickle = True).item()
 
-		return features, historical_price_info, future_price_info, symbol_names
+	def update_data_from_dictionary(self):
+		"""
+		Same as collect_data_for_all_tickers, but symbols that are in the data dictionary only download the bars after the last cached bar
+		"""
+		if not os.path.exists(self.DICT_PATH):
+			print("No data dictionary found at %s, downloading everything" % self.DICT_PATH)
+			return self.collect_data_for_all_tickers()
+
+		print("Updating data from dictionary")
+		return self.collect_data_for_all_tickers(self.read_data_dictionary())
+
+	def is_features_outdated(self, cached_data):
+		"""
+		Indicators in the dictionary were computed for the history length and the features of the run that saved it. Features of granularities this
+		run does not use make them outdated too, because get_features would add them to the feature vector.
+		"""
+		features = cached_data["features"]
+		if any(key not in features for key in self.taEngine.INDICATOR_KEYS):
+			return True
+		if any(key not in self.taEngine.INDICATOR_KEYS and any(feature_key in key for feature_key in self.taEngine.FEATURE_KEYS) for key in features):
+			return True
+		return "daily_log_return" in features and len(features["daily_log_return"]) != min(self.HISTORY_TO_USE, len(cached_data["current_prices"]))
 
 	def load_data_from_dictionary(self):
 		# Load data from dictionary
 		print("Loading data from dictionary")
-		dictionary_data = np.load(self.DICT_PATH, allow_pickle = True).item()
+		with self.metrics.stage("load_dictionary"):
+			dictionary_data = self.read_data_dictionary()
+		self.metrics.increment("symbols_requested", len(dictionary_data))
+
+		# Recompute technical indicators from the stored prices if they were computed for a different history length
+		outdated_symbols = [symbol for symbol in dictionary_data if self.is_features_outdated(dictionary_data[symbol])]
+		if len(outdated_symbols) > 0:
+			print("Recomputing technical indicators for %d symbols" % len(outdated_symbols))
+			with self.metrics.stage("indicators"):
+				indicators_start = time.perf_counter()
+				self.taEngine.open_pool()
+				try:
+					all_indicators = self.taEngine.get_technical_indicators_for_all([dictionary_data[symbol]["current_prices"] for symbol in outdated_symbols])
+				finally:
+					self.taEngine.close_pool()
+				self.metrics.add_symbol_latency("indicators", time.perf_counter() - indicators_start, len(outdated_symbols))
+
+			for symbol, (features_dictionary, error) in zip(outdated_symbols, all_indicators):
+				if error is not None:
+					self.metrics.drop_symbol(symbol, "indicator_error", error)
+					del dictionary_data[symbol]
+				else:
+					dictionary_data[symbol]["features"] = features_dictionary
 		
-		features = []
-		symbol_names = []
-		historical_price_info = []
-		future_price_info = []
-		for symbol in dictionary_data:
-			feature_list = self.taEngine.get_features(dictionary_data[symbol]["features"])
-			current_prices = dictionary_data[symbol]["current_prices"]
-			future_prices = dictionary_data[symbol]["future_prices"]
-			
-			# Check if there is any null value
-			if np.isnan(feature_list).any() == True:
-				continue
-
-			features.append(feature_list)
-			symbol_names.append(symbol)
-			historical_price_info.append(current_prices)
-			future_price_info.append(future_prices)
-
-		# Sometimes, there are some errors in feature generation or price extraction, let us remove that stuff
-		features, historical_price_info, future_price_info, symbol_names = self.remove_bad_data(features, historical_price_info, future_price_info, symbol_names)
+		with self.metrics.stage("feature_assembly"):
+			features = FeatureMatrix(len(dictionary_data))
+			symbol_names = []
+			historical_price_info = []
+			future_price_info = []
+			for symbol in dictionary_data:
+				features.append(self.taEngine.get_features(dictionary_data[symbol]["features"]))
+				symbol_names.append(symbol)
+				historical_price_info.append(dictionary_data[symbol]["current_prices"])
+				future_price_info.append(dictionary_data[symbol]["future_prices"])
+
+			# Sometimes, there are some errors in feature generation or price extraction, let us remove that stuff
+			features, historical_price_info, future_price_info, symbol_names = self.remove_bad_data(features, historical_price_info, future_price_info, symbol_names)
+		self.metrics.increment("symbols_scanned", len(symbol_names))
 
 		return features, historical_price_info, future_price_info, symbol_names
 
 	def remove_bad_data(self, features, historical_price_info, future_price_info, symbol_names):
 		"""
-		Remove bad data i.e data that had some errors while scraping or feature generation
+		Remove bad data i.e data that had some errors while scraping or feature generation. features is a FeatureMatrix with one row per symbol,
+		rows with NaN values or another number of features than most rows are dropped. Returns the features as a matrix and the prices packed in a PriceHistories.
 		"""
-		length_dictionary = collections.Counter([len(feature) for feature in features])
-		length_dictionary = list(length_dictionary.keys())
-		most_common_length = length_dictionary[0]
-
-		filtered_features, filtered_historical_price, filtered_future_prices, filtered_symbols = [], [], [], []
-		for i in range(0, len(features)):
-			if len(features[i]) == most_common_length:
-				filtered_features.append(features[i])
-				filtered_symbols.append(symbol_names[i])
-				filtered_historical_price.append(historical_price_info[i])
-				filtered_future_prices.append(future_price_info[i])
-
-		return filtered_features, filtered_historical_price, filtered_future_prices, filtered_symbols
\ No newline at end of file
+		valid_rows = features.get_valid_rows()
+		for i in np.flatnonzero(~valid_rows):
+			self.metrics.drop_symbol(symbol_names[i], "bad_features", "NaN values or a different number of features")
+		symbol_indices = np.flatnonzero(valid_rows)
+		filtered_features = features.get_rows(symbol_indices)
+		filtered_historical_price = PriceHistories([historical_price_info[i] for i in symbol_indices])
+		filtered_future_prices = [future_price_info[i] for i in symbol_indices]
+		filtered_symbols = [symbol_names[i] for i in symbol_indices]
+
+		return filtered_features, filtered_historical_price, filtered_future_prices, filtered_symbols
@@ -0,0 +1,209 @@
+# Basic libraries
+import os
+import threading
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta
+import warnings
+warnings.filterwarnings("ignore")
+
+# yf.download keeps its results in a module level dictionary, so only one batch download can run at a time
+YAHOO_DOWNLOAD_LOCK = threading.Lock()
+
+class DataError(ValueError):
+	"""
+	The data of a run can not be used, e.g. future data is missing or shards are missing. The command line prints it and exits with status 1.
+	"""
+	pass
+
+class DataSource:
+	"""
+	Downloads raw prices from one data source. Prices are returned as data frames with columns -> 'Datetime', 'Open', 'High', 'Low', 'Close', 'Volume',
+	or None if there is no data for a symbol. If start is given, only bars from that time on are needed.
+	"""
+	# Whether several symbols can be downloaded in a single call
+	SUPPORTS_BATCHES = False
+
+	# Request rate that is used unless requests_per_second is given. 0 means no limit.
+	DEFAULT_REQUESTS_PER_SECOND = 0
+
+	def __init__(self, data_granularity_minutes, fetch_workers = 1, data_directory = None):
+		self.DATA_GRANULARITY_MINUTES = data_granularity_minutes
+		self.FETCH_WORKERS = fetch_workers
+		self.DATA_DIRECTORY = data_directory
+
+	def get_period(self):
+		"""
+		Find how far back the data should be downloaded
+		"""
+		if self.DATA_GRANULARITY_MINUTES == 1:
+			return "7d"
+		else:
+			return "30d"
+
+	def download_prices(self, symbol, start = None):
+		raise NotImplementedError
+
+	def download_prices_batch(self, symbols, start = None):
+		return [self.download_prices(symbol, start) for symbol in symbols]
+
+class YahooFinanceDataSource(DataSource):
+	# Yahoo finance starts throttling well before binance does
+	SUPPORTS_BATCHES = True
+	DEFAULT_REQUESTS_PER_SECOND = 5
+
+	def get_time_range(self, start = None):
+		"""
+		Arguments for yahoo finance that select which bars are downloaded. Either the usual period or everything after start.
+		"""
+		if start is None:
+			return {"period": self.get_period()}
+
+		# yfinance reads start as a local time without a time zone. Starting a day early makes sure no bar is skipped, the bars that were already cached are dropped when merging.
+		return {"start": datetime.fromtimestamp(pd.Timestamp(start).timestamp()) - timedelta(days = 1)}
+
+	def download_prices(self, symbol, start = None):
+		# yfinance is slow to import, so it is only imported when yahoo finance is used
+		import yfinance as yf
+
+		# yf.download keeps its results in a module level dictionary, so concurrent calls overwrite each other. Ticker objects do not share that state.
+		stock_prices = yf.Ticker(symbol).history(
+						**self.get_time_range(start),
+						interval = str(self.DATA_GRANULARITY_MINUTES) + "m",
+						auto_adjust = False)
+		# Unknown or delisted symbols come back empty, there is no point in retrying those
+		if len(stock_prices) == 0:
+			return None
+		stock_prices = stock_prices.reset_index()
+		stock_prices = stock_prices[['Datetime','Open', 'High', 'Low', 'Close', 'Volume']]
+		return stock_prices
+
+	def download_prices_batch(self, symbols, start = None):
+		"""
+		Download raw prices for several symbols with a single yahoo finance call. Returns a list of data frames in the same order as symbols, with None for symbols without data.
+		"""
+		import yfinance as yf
+
+		with YAHOO_DOWNLOAD_LOCK:
+			batch_prices = yf.download(
+							tickers = symbols,
+							**self.get_time_range(start),
+							interval = str(self.DATA_GRANULARITY_MINUTES) + "m",
+							auto_adjust = False,
+							group_by = 'ticker',
+							threads = self.FETCH_WORKERS,
+							progress = False)
+		return self.split_batch_prices(batch_prices, symbols)
+
+	def split_batch_prices(self, batch_prices, symbols):
+		"""
+		Split the wide data frame returned by yf.download (columns -> (symbol, field)) into one OHLCV data frame per symbol
+		"""
+		is_multi_index = isinstance(batch_prices.columns, pd.MultiIndex)
+		available_symbols = set(batch_prices.columns.get_level_values(0)) if is_multi_index else set()
+
+		all_prices = []
+		for symbol in symbols:
+			if is_multi_index and symbol in available_symbols:
+				stock_prices = batch_prices[symbol]
+			elif not is_multi_index and len(symbols) == 1:
+				stock_prices = batch_prices
+			else:
+				all_prices.append(None)
+				continue
+
+			# Bars only present for other symbols in the batch show up as empty rows
+			stock_prices = stock_prices.dropna(how = 'all')
+			if len(stock_prices) == 0:
+				all_prices.append(None)
+				continue
+
+			stock_prices = stock_prices.reset_index()
+			stock_prices = stock_prices.rename(columns = {stock_prices.columns[0]: 'Datetime'})
+			stock_prices = stock_prices[['Datetime','Open', 'High', 'Low', 'Close', 'Volume']]
+			all_prices.append(stock_prices)
+
+		return all_prices
+
+class BinanceDataSource(DataSource):
+	# Binance allows 1200 request weight per minute
+	DEFAULT_REQUESTS_PER_SECOND = 15
+
+	def __init__(self, data_granularity_minutes, fetch_workers = 1, data_directory = None):
+		super().__init__(data_granularity_minutes, fetch_workers = fetch_workers, data_directory = data_directory)
+		self.binance_client = None
+		self.binance_client_lock = threading.Lock()
+
+	def get_binance_client(self):
+		"""
+		Importing the binance client is slow and creating it already talks to binance, so it only happens the first time prices are downloaded
+		"""
+		with self.binance_client_lock:
+			if self.binance_client is None:
+				from binance.client import Client
+				from requests.adapters import HTTPAdapter
+
+				# Create an instance of the Binance Client with no api key and no secret (api key and secret not required for the functionality needed for this script)
+				self.binance_client = Client("","")
+
+				# All fetch workers share the client's session. Its default pool keeps only 10 connections, so more workers would keep opening new ones.
+				self.binance_client.session.mount("https://", HTTPAdapter(pool_connections = 1, pool_maxsize = max(10, self.FETCH_WORKERS)))
+		return self.binance_client
+
+	def download_prices(self, symbol, start = None):
+		# Binance clients doesn't like 60m as an interval
+		if(self.DATA_GRANULARITY_MINUTES == 60):
+			interval = '1h'
+		else:
+			interval = str(self.DATA_GRANULARITY_MINUTES) + "m"
+		klines_range = {} if start is None else {"startTime": int(start)}
+		stock_prices = self.get_binance_client().get_klines(symbol=symbol, interval = interval, **klines_range)
+		# ensure that stock prices contains some data, otherwise the pandas operations below could fail
+		if len(stock_prices) == 0:
+			return None
+		# Klines are lists of strings. Convert the first six columns -> open time, open, high, low, close, volume to floats in one step
+		stock_prices = np.array(stock_prices, dtype = object)[:, :6].astype(np.float64)
+		stock_prices = pd.DataFrame(stock_prices, columns = ['Datetime','Open', 'High', 'Low', 'Close', 'Volume'], copy = False)
+		return stock_prices
+
+class LocalDataSource(DataSource):
+	"""
+	Reads prices from <symbol>.csv or <symbol>.parquet files in a directory, so the whole pipeline can run without a network connection.
+	Files need the columns 'Datetime', 'Open', 'High', 'Low', 'Close', 'Volume'. Datetimes can be timestamps or epoch milliseconds.
+	"""
+	def get_price_file(self, symbol):
+		for extension in [".parquet", ".csv"]:
+			price_file = os.path.join(self.DATA_DIRECTORY, symbol + extension)
+			if os.path.exists(price_file):
+				return price_file
+		return None
+
+	def download_prices(self, symbol, start = None):
+		price_file = self.get_price_file(symbol)
+		if price_file is None:
+			return None
+
+		if price_file.endswith(".parquet"):
+			stock_prices = pd.read_parquet(price_file)
+		else:
+			stock_prices = pd.read_csv(price_file)
+			if stock_prices['Datetime'].dtype == object:
+				datetimes = pd.to_datetime(stock_prices['Datetime'])
+
+				# Timestamps with different offsets, e.g. across a daylight saving change, only fit in one column as UTC
+				if not pd.api.types.is_datetime64_any_dtype(datetimes):
+					datetimes = pd.to_datetime(stock_prices['Datetime'], utc = True)
+				stock_prices['Datetime'] = datetimes
+
+		stock_prices = stock_prices[['Datetime','Open', 'High', 'Low', 'Close', 'Volume']]
+		if start is not None:
+			stock_prices = stock_prices[stock_prices['Datetime'] >= start].reset_index(drop = True)
+		if len(stock_prices) == 0:
+			return None
+		return stock_prices
+
+# Data sources that can be chosen with the data_source argument
+DATA_SOURCES = {"yahoo_finance": YahooFinanceDataSource, "binance": BinanceDataSource, "local": LocalDataSource}
+
+def create_data_source(data_source, data_granularity_minutes, fetch_workers = 1, data_directory = None):
+	return DATA_SOURCES[data_source](data_granularity_minutes, fetch_workers = fetch_workers, data_directory = data_directory)
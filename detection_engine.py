@@ -1,32 +1,26 @@
  # Basic libraries
 import os
-import ta
 import sys
 import json
-import math
-import pickle
-import random
-import requests
-import collections
+import time
+import joblib
+import cProfile
 import numpy as np
-from os import walk, path
 import pandas as pd
-import yfinance as yf
+from os import path
 import datetime as dt
-from scipy.stats import linregress
-from datetime import datetime, timedelta
-import matplotlib.pyplot as plt
-from sklearn.ensemble import IsolationForest
+from detectors import DETECTORS, create_anomaly_detector, load_detector
 from data_loader import DataEngine
+from data_sources import DATA_SOURCES, DataError
+from streaming_scanner import StreamingScanner, create_bar_source
+from backtest import WalkForwardBacktest
+from parameter_sweep import ParameterSweep
+from metrics import ScanMetrics
+from sharding import ShardDirectory, get_shard_symbols, get_shard_dictionary_path, merge_shards
 import warnings
 
 warnings.filterwarnings("ignore")
 
-# Styling for plots
-plt.style.use('seaborn-white')
-plt.rc('grid', linestyle="dotted", color='#a0a0a0')
-plt.rcParams['axes.edgecolor'] = "#04383F"
-
 # Argument parsing
 import argparse
 argParser = argparse.ArgumentParser()
@@ -36,88 +30,310 @@ argParser.add_argument("--history_to_use", type=int, default = 7, help="How many
 argParser.add_argument("--is_load_from_dictionary", type=int, default = 0, help="Whether to load data from dictionary or get it from data source.")
 argParser.add_argument("--data_dictionary_path", type=str, default = "dictionaries/data_dictionary.npy", help="Data dictionary path.")
 argParser.add_argument("--is_save_dictionary", type=int, default = 1, help="Whether to save data in a dictionary.")
+argParser.add_argument("--is_incremental_update", type=int, default = 0, help="Whether to download only the bars that came after the ones in the data dictionary. Symbols that are not in the dictionary are downloaded in full.")
+argParser.add_argument("--checkpoint_max_age_minutes", type=float, default = 720, help="How old the checkpoint segments of an interrupted scan can be to be resumed. The symbols of older segments are downloaded again. Use 0 to resume segments of any age.")
 argParser.add_argument("--data_granularity_minutes", type=int, default = 15, help="Minute level data granularity that you want to use. Default is 60 minute bars.")
+argParser.add_argument("--fusion_granularities", type=str, default = "", help="Comma separated coarser granularities in minutes, e.g. 30,60. The downloaded bars are resampled to each of them and the features of all granularities are concatenated. Empty uses only data_granularity_minutes.")
 argParser.add_argument("--is_test", type=int, default = 0, help="Whether to test the tool or just predict for future. When testing, you should set the future_bars to larger than 1.")
 argParser.add_argument("--future_bars", type=int, default = 25, help="How many bars to keep for testing purposes.")
 argParser.add_argument("--volatility_filter", type=float, default = 0.05, help="Stocks with volatility less than this value will be ignored.")
 argParser.add_argument("--output_format", type=str, default = "CLI", help="What format to use for printing/storing results. Can be CLI or JSON.")
 argParser.add_argument("--stock_list", type=str, default = "stocks.txt", help="What is the name of the file in the stocks directory which contains the stocks you wish to predict.")
-argParser.add_argument("--data_source", type=str, default = "yahoo_finance", help="The name of the data engine to use.")
-
-args = argParser.parse_args()
-top_n = args.top_n
-min_volume = args.min_volume
-history_to_use = args.history_to_use
-is_load_from_dictionary = args.is_load_from_dictionary
-data_dictionary_path = args.data_dictionary_path
-is_save_dictionary = args.is_save_dictionary
-data_granularity_minutes = args.data_granularity_minutes
-is_test = args.is_test
-future_bars = args.future_bars
-volatility_filter = args.volatility_filter
-output_format = args.output_format.upper()
-stock_list = args.stock_list
-data_source = args.data_source
+argParser.add_argument("--data_source", type=str, default = "yahoo_finance", help="The name of the data engine to use. Can be yahoo_finance, binance or local.")
+argParser.add_argument("--data_directory", type=str, default = "", help="Directory with <symbol>.csv or <symbol>.parquet price files for the local data source.")
+argParser.add_argument("--fetch_workers", type=int, default = 8, help="How many symbols to download concurrently.")
+argParser.add_argument("--requests_per_second", type=float, default = 0, help="Maximum number of requests per second sent to the data source. Use 0 for the default limit of the data source.")
+argParser.add_argument("--batch_size", type=int, default = 50, help="How many symbols to download in a single yahoo finance call. Use 1 to download symbols one by one.")
+argParser.add_argument("--feature_workers", type=int, default = 1, help="How many processes to use for computing technical indicators.")
+argParser.add_argument("--indicator_engine", type=str, default = "ta", help="How technical indicators are computed. Can be ta (one symbol at a time with the ta library) or vectorized (all symbols at once with numpy).")
+argParser.add_argument("--indicator_cache_size", type=int, default = 1024, help="For how many symbols the full technical indicator series are kept in memory, so runs with another history reuse them. Use 0 to turn the cache off.")
+argParser.add_argument("--max_retries", type=int, default = 3, help="How many times a failed download is retried before the symbol is skipped.")
+argParser.add_argument("--max_gap_fraction", type=float, default = 0.1, help="Bars of every symbol are aligned to a timestamp index shared by all symbols. Symbols that miss more than this fraction of its bars are dropped, the missing bars of the others are filled.")
+argParser.add_argument("--is_streaming", type=int, default = 0, help="Whether to keep running after the first scan and score new bars as they arrive from the bar source.")
+argParser.add_argument("--bar_source", type=str, default = "file", help="Where new bars come from when streaming. Can be file (a csv file that keeps getting appended to) or socket.")
+argParser.add_argument("--bar_source_address", type=str, default = "", help="Path of the csv file, or host:port of the socket, that new bars are read from. One bar per line -> symbol,datetime,open,high,low,close,volume")
+argParser.add_argument("--refit_interval_minutes", type=float, default = 60, help="How often the anomaly detector is refit on all symbols when streaming. Use 0 to never refit.")
+argParser.add_argument("--alert_threshold", type=float, default = 0, help="New bars that give an anomaly score below this value are printed as alerts when streaming.")
+argParser.add_argument("--detector", type=str, default = "isolation_forest", help="Anomaly detector backend. Can be isolation_forest, half_space_trees (online, learns from every streamed bar), robust_zscore or mahalanobis.")
+argParser.add_argument("--score_chunk_size", type=int, default = 10000, help="How many symbols the anomaly detector scores at a time, so scoring memory stays bounded. Use 0 to score all symbols at once.")
+argParser.add_argument("--detector_workers", type=int, default = 1, help="How many cores to use for building and scoring the trees of the anomaly detector. Use -1 for all cores.")
+argParser.add_argument("--max_samples", type=str, default = "auto", help="How many samples are used to build each tree of the anomaly detector. Can be auto, a number of samples or a fraction like 0.5.")
+argParser.add_argument("--model_directory", type=str, default = "models", help="Directory where fitted anomaly detectors are saved.")
+argParser.add_argument("--is_save_model", type=int, default = 0, help="Whether to save the fitted anomaly detector so later runs can reuse it.")
+argParser.add_argument("--is_score_only", type=int, default = 0, help="Whether to score with a saved anomaly detector instead of fitting a new one. A new one is fit if there is no saved detector for the same features and granularity.")
+argParser.add_argument("--is_backtest", type=int, default = 0, help="Whether to run a walk-forward backtest instead of a single scan. The last future_bars bars of every window are held out.")
+argParser.add_argument("--backtest_windows", type=int, default = 10, help="How many cut points the walk-forward backtest tests.")
+argParser.add_argument("--backtest_step_bars", type=int, default = 0, help="How many bars the cut point moves back between windows. Use 0 to move it by future_bars.")
+argParser.add_argument("--backtest_workers", type=int, default = 1, help="How many processes score backtest windows at the same time.")
+argParser.add_argument("--backtest_output_path", type=str, default = "backtest_results.json", help="JSON file the backtest results are written to.")
+argParser.add_argument("--metrics_path", type=str, default = "", help="File the stage timings, symbol latencies and dropped symbols of the run are written to. Paths ending with .prom or .txt get the Prometheus text format, anything else JSON.")
+argParser.add_argument("--profile_path", type=str, default = "", help="File a cProfile dump of the whole run is written to. It can be read with pstats or snakeviz.")
+argParser.add_argument("--is_sweep", type=int, default = 0, help="Whether to test every combination of the sweep arguments instead of a single scan. Needs is_test 1, every configuration is tested on the last future_bars bars.")
+argParser.add_argument("--sweep_history_to_use", type=str, default = "", help="Comma separated values of history_to_use to sweep over. Empty uses history_to_use.")
+argParser.add_argument("--sweep_data_granularity_minutes", type=str, default = "", help="Comma separated values of data_granularity_minutes to sweep over. Empty uses data_granularity_minutes.")
+argParser.add_argument("--sweep_min_volume", type=str, default = "", help="Comma separated values of min_volume to sweep over. Empty uses min_volume.")
+argParser.add_argument("--sweep_volatility_filter", type=str, default = "", help="Comma separated values of volatility_filter to sweep over. Empty uses volatility_filter.")
+argParser.add_argument("--sweep_workers", type=int, default = 1, help="How many processes test sweep configurations at the same time.")
+argParser.add_argument("--sweep_output_path", type=str, default = "sweep_results.csv", help="CSV file the ranked sweep results are written to.")
+argParser.add_argument("--shard_count", type=int, default = 1, help="Number of shards the stocks list is split into by a hash of the symbol. Use more than 1 to scan on several hosts.")
+argParser.add_argument("--shard_index", type=int, default = 0, help="Shard this worker scans, from 0 to shard_count - 1. The worker writes its features to shard_directory and does not fit a detector.")
+argParser.add_argument("--shard_directory", type=str, default = "", help="Shared directory where the workers write their shards and the coordinator reads them.")
+argParser.add_argument("--is_merge_shards", type=int, default = 0, help="Whether to run as the coordinator, which merges the shards of all workers, fits one detector on all symbols and scores them.")
+argParser.add_argument("--shard_wait_minutes", type=float, default = 0, help="How long the coordinator waits for missing shards before it gives up.")
+argParser.add_argument("--shard_run_id", type=str, default = "", help="Id of a sharded scan, e.g. a date or a job id, that the workers and the coordinator share. The coordinator only merges shards with its id. Sharded scans need one.")
 
 """
 Sample run:
 python detection_engine.py --is_test 1 --future_bars 25 --top_n 25 --min_volume 5000 --data_granularity_minutes 60 --history_to_use 14 --is_load_from_dictionary 0 --data_dictionary_path 'dictionaries/feature_dict.npy' --is_save_dictionary 1 --output_format 'CLI'
 """
 
+def create_config(**arguments):
+	"""
+	Configuration for Surpriver with the default value of every command line argument. Any argument can be changed by name, e.g. create_config(top_n = 10, is_load_from_dictionary = 1)
+	"""
+	config = argParser.parse_args([])
+	for name in arguments:
+		if not hasattr(config, name):
+			raise ValueError("Unknown argument %s" % name)
+		setattr(config, name, arguments[name])
+	return config
+
+def parse_max_samples(value):
+	"""
+	max_samples of IsolationForest from the command line -> "auto", a number of samples or a fraction of the samples
+	"""
+	if isinstance(value, str) and value != "auto":
+		return float(value) if "." in value else int(value)
+	return value
+
+def parse_grid(value, value_type):
+	"""
+	Values of a comma separated sweep argument. An empty string gives an empty list.
+	"""
+	return [value_type(item) for item in value.split(",") if item.strip() != ""]
+
 class ArgChecker:
-	def __init__(self):
+	def __init__(self, config, exit_on_error = True):
 		print("Checking arguments...")
+		self.config = config
+		self.EXIT_ON_ERROR = exit_on_error
 		self.check_arugments()
 
+	def fail(self, message):
+		"""
+		Print the problem and exit when running from the command line. When Surpriver is used as a library, a ValueError is raised instead.
+		"""
+		if not self.EXIT_ON_ERROR:
+			raise ValueError(message)
+		print(message)
+		exit()
+
 	def check_arugments(self):
+		config = self.config
 		granularity_constraints_list = [1, 5, 10, 15, 30, 60]
 		granularity_constraints_list_string = ''.join(str(value) + "," for value in granularity_constraints_list).strip(",")
 		directory_path = str(os.path.dirname(os.path.abspath(__file__)))
 
-		if data_granularity_minutes not in granularity_constraints_list:
-			print("You can only choose the following values for 'data_granularity_minutes' argument -> %s\nExiting now..." % granularity_constraints_list_string)
-			exit()
+		if config.data_granularity_minutes not in granularity_constraints_list:
+			self.fail("You can only choose the following values for 'data_granularity_minutes' argument -> %s\nExiting now..." % granularity_constraints_list_string)
 
-		if is_test == 1 and future_bars < 2:
-			print("You want to test but the future bars are less than 2. That does not give us enough data to test the model properly. Please use a value larger than 2.\nExiting now...")
-			exit()
+		if config.is_test == 1 and config.future_bars < 2:
+			self.fail("You want to test but the future bars are less than 2. That does not give us enough data to test the model properly. Please use a value larger than 2.\nExiting now...")
 		
-		if output_format not in ["CLI", "JSON"]:
-			print("Please choose CLI or JSON for the output format field. Default is CLI.")
-			exit()
-		if not path.exists(directory_path + f'/stocks/{stock_list}'):
-			print("The stocks list file must exist in the stocks directory")
-			exit()
-		if data_source not in ['binance', 'yahoo_finance']:
-			print("Data source must be a valid and supported service.")
-			exit()
+		if config.output_format.upper() not in ["CLI", "JSON"]:
+			self.fail("Please choose CLI or JSON for the output format field. Default is CLI.")
+		if not path.exists(directory_path + f'/stocks/{config.stock_list}'):
+			self.fail("The stocks list file must exist in the stocks directory")
+		if config.data_source not in DATA_SOURCES:
+			self.fail("Data source must be a valid and supported service.")
+		if config.data_source == "local" and not path.isdir(config.data_directory):
+			self.fail("The local data source needs an existing data_directory with the price files.")
+		if config.is_incremental_update == 1 and config.is_load_from_dictionary == 1:
+			self.fail("Incremental updates download new data, please set is_load_from_dictionary to 0.\nExiting now...")
+		if config.fetch_workers < 1:
+			self.fail("Please use at least one fetch worker.")
+		if config.batch_size < 1:
+			self.fail("The batch size must be at least 1.")
+		if config.feature_workers < 1:
+			self.fail("Please use at least one feature worker.")
+		if config.indicator_engine.lower() not in ["ta", "vectorized"]:
+			self.fail("Please choose ta or vectorized for the indicator engine. Default is ta.")
+		if config.indicator_cache_size < 0:
+			self.fail("The indicator cache size can not be negative.")
+		if config.checkpoint_max_age_minutes < 0:
+			self.fail("The checkpoint age can not be negative. Use 0 to resume checkpoints of any age.")
+		if config.max_retries < 0:
+			self.fail("The number of retries can not be negative.")
+		if not 0 <= config.max_gap_fraction < 1:
+			self.fail("The maximum gap fraction must be at least 0 and less than 1.")
+		if config.is_streaming == 1 and config.is_test == 1:
+			self.fail("Streaming scores live bars, there is no future data to test with. Please set is_test to 0.\nExiting now...")
+		if config.bar_source.lower() not in ["file", "socket"]:
+			self.fail("Please choose file or socket for the bar source. Default is file.")
+		if config.is_streaming == 1 and config.bar_source_address == "":
+			self.fail("Please give the path or host:port of the bar source with bar_source_address.")
+		if config.is_streaming == 1 and config.bar_source.lower() == "socket" and ":" not in config.bar_source_address:
+			self.fail("The address of a socket bar source must look like host:port.")
+		if config.refit_interval_minutes < 0:
+			self.fail("The refit interval can not be negative.")
+		if config.is_backtest == 1 and config.is_test == 1:
+			self.fail("The backtest holds out future bars for every window itself, please set is_test to 0.\nExiting now...")
+		if config.is_backtest == 1 and config.is_streaming == 1:
+			self.fail("Please choose either streaming or a backtest.\nExiting now...")
+		if config.is_backtest == 1 and config.future_bars < 2:
+			self.fail("The backtest needs future_bars of at least 2 to measure what happened after every cut point.")
+		if config.backtest_windows < 1:
+			self.fail("The backtest needs at least one window.")
+		if config.backtest_step_bars < 0:
+			self.fail("The backtest step can not be negative.")
+		if config.backtest_workers < 1:
+			self.fail("Please use at least one backtest worker.")
+		if config.is_sweep == 1 and config.is_test == 0:
+			self.fail("The sweep tests every configuration on the last future_bars bars, please set is_test to 1.\nExiting now...")
+		if config.is_sweep == 1 and (config.is_streaming == 1 or config.is_backtest == 1):
+			self.fail("Please choose only one of streaming, a backtest or a sweep.\nExiting now...")
+		if config.is_sweep == 1 and (config.is_load_from_dictionary == 1 or config.is_incremental_update == 1):
+			self.fail("The sweep downloads the prices of every granularity itself, please set is_load_from_dictionary and is_incremental_update to 0.\nExiting now...")
+		if config.sweep_workers < 1:
+			self.fail("Please use at least one sweep worker.")
+		try:
+			sweep_histories = parse_grid(config.sweep_history_to_use, int)
+			sweep_granularities = parse_grid(config.sweep_data_granularity_minutes, int)
+			parse_grid(config.sweep_min_volume, float)
+			parse_grid(config.sweep_volatility_filter, float)
+		except ValueError:
+			self.fail("Sweep arguments must be comma separated numbers.")
+		if any(granularity not in granularity_constraints_list for granularity in sweep_granularities):
+			self.fail("You can only sweep over the following values of 'data_granularity_minutes' -> %s\nExiting now..." % granularity_constraints_list_string)
+		if any(history < 1 for history in sweep_histories):
+			self.fail("Every history_to_use in the sweep must be at least 1.")
+		try:
+			fusion_granularities = parse_grid(config.fusion_granularities, int)
+		except ValueError:
+			self.fail("Fusion granularities must be comma separated numbers.")
+		for granularity in sweep_granularities or [config.data_granularity_minutes]:
+			if any(fusion_granularity <= granularity or fusion_granularity % granularity != 0 for fusion_granularity in fusion_granularities):
+				self.fail("Every fusion granularity must be a larger multiple of the data granularity of %d minutes.\nExiting now..." % granularity)
+		if config.shard_count < 1:
+			self.fail("The shard count must be at least 1.")
+		if not 0 <= config.shard_index < config.shard_count:
+			self.fail("The shard index must be between 0 and shard_count - 1.")
+		if config.shard_count > 1 and config.shard_directory == "":
+			self.fail("Sharded scans need a shard_directory that the workers and the coordinator share.")
+		if config.is_merge_shards == 1 and config.shard_count < 2:
+			self.fail("Merging needs a shard_count of at least 2.")
+		if config.shard_count > 1 and config.is_sweep == 1:
+			self.fail("The sweep can not be sharded, please set shard_count to 1.\nExiting now...")
+		if config.shard_count > 1 and config.is_merge_shards == 0 and (config.is_streaming == 1 or config.is_backtest == 1):
+			self.fail("Shard workers only write their features, streaming and backtests run on the coordinator with is_merge_shards 1.\nExiting now...")
+		if config.shard_count > 1 and (config.is_load_from_dictionary == 1 or (config.is_merge_shards == 1 and config.is_incremental_update == 1)):
+			self.fail("Shards are downloaded by the workers, please set is_load_from_dictionary to 0, and is_incremental_update to 0 on the coordinator.\nExiting now...")
+		if config.shard_count > 1 and config.shard_run_id == "":
+			self.fail("Sharded scans need a shard_run_id that the workers and the coordinator share, so shards of an earlier run are not merged.")
+		if config.shard_wait_minutes < 0:
+			self.fail("The shard wait time can not be negative.")
+		if config.detector.lower() not in DETECTORS:
+			self.fail("Invalid detector. Please use one of -> %s" % ", ".join(DETECTORS))
+		if config.score_chunk_size < 0:
+			self.fail("score_chunk_size can not be negative. Use 0 to score all symbols at once.")
+		if config.detector_workers == 0 or config.detector_workers < -1:
+			self.fail("Please use at least one detector worker, or -1 for all cores.")
+		try:
+			max_samples = parse_max_samples(config.max_samples)
+		except ValueError:
+			max_samples = None
+		if max_samples != "auto" and not (isinstance(max_samples, int) and max_samples >= 1) and not (isinstance(max_samples, float) and 0 < max_samples <= 1):
+			self.fail("max_samples must be auto, a number of samples of at least 1 or a fraction between 0 and 1.")
 
 class Surpriver:
-	def __init__(self):
+	def __init__(self, config):
 		print("Surpriver has been initialized...")
-		self.TOP_PREDICTIONS_TO_PRINT = top_n
-		self.HISTORY_TO_USE = history_to_use
-		self.MINIMUM_VOLUME = min_volume
-		self.IS_LOAD_FROM_DICTIONARY = is_load_from_dictionary
-		self.DATA_DICTIONARY_PATH = data_dictionary_path
-		self.IS_SAVE_DICTIONARY = is_save_dictionary
-		self.DATA_GRANULARITY_MINUTES = data_granularity_minutes
-		self.IS_TEST = is_test
-		self.FUTURE_BARS_FOR_TESTING = future_bars
-		self.VOLATILITY_FILTER = volatility_filter
-		self.OUTPUT_FORMAT = output_format
-		self.STOCK_LIST = stock_list
-		self.DATA_SOURCE = data_source
+		self.TOP_PREDICTIONS_TO_PRINT = config.top_n
+		self.HISTORY_TO_USE = config.history_to_use
+		self.MINIMUM_VOLUME = config.min_volume
+		self.IS_LOAD_FROM_DICTIONARY = config.is_load_from_dictionary
+		self.DATA_DICTIONARY_PATH = config.data_dictionary_path
+		self.IS_SAVE_DICTIONARY = config.is_save_dictionary
+		self.CHECKPOINT_MAX_AGE_MINUTES = config.checkpoint_max_age_minutes
+		self.IS_INCREMENTAL_UPDATE = config.is_incremental_update
+		self.DATA_GRANULARITY_MINUTES = config.data_granularity_minutes
+		self.IS_TEST = config.is_test
+		self.FUTURE_BARS_FOR_TESTING = config.future_bars
+		self.VOLATILITY_FILTER = config.volatility_filter
+		self.OUTPUT_FORMAT = config.output_format.upper()
+		self.STOCK_LIST = config.stock_list
+		self.DATA_SOURCE = config.data_source
+		self.DATA_DIRECTORY = config.data_directory
+		self.FETCH_WORKERS = config.fetch_workers
+		self.REQUESTS_PER_SECOND = config.requests_per_second
+		self.MAX_RETRIES = config.max_retries
+		self.MAX_GAP_FRACTION = config.max_gap_fraction
+		self.BATCH_SIZE = config.batch_size
+		self.FEATURE_WORKERS = config.feature_workers
+		self.INDICATOR_ENGINE = config.indicator_engine.lower()
+		self.INDICATOR_CACHE_SIZE = config.indicator_cache_size
+		self.IS_STREAMING = config.is_streaming
+		self.BAR_SOURCE = config.bar_source.lower()
+		self.BAR_SOURCE_ADDRESS = config.bar_source_address
+		self.REFIT_INTERVAL_MINUTES = config.refit_interval_minutes
+		self.ALERT_THRESHOLD = config.alert_threshold
+		self.DETECTOR = config.detector.lower()
+		self.SCORE_CHUNK_SIZE = config.score_chunk_size
+		self.DETECTOR_WORKERS = config.detector_workers
+		self.MAX_SAMPLES = parse_max_samples(config.max_samples)
+		self.MODEL_DIRECTORY = config.model_directory
+		self.IS_SAVE_MODEL = config.is_save_model
+		self.IS_SCORE_ONLY = config.is_score_only
+		self.IS_BACKTEST = config.is_backtest
+		self.BACKTEST_WINDOWS = config.backtest_windows
+		self.BACKTEST_STEP_BARS = config.backtest_step_bars
+		self.BACKTEST_WORKERS = config.backtest_workers
+		self.BACKTEST_OUTPUT_PATH = config.backtest_output_path
+		self.SWEEP_HISTORIES = parse_grid(config.sweep_history_to_use, int) or [self.HISTORY_TO_USE]
+		self.SWEEP_GRANULARITIES = parse_grid(config.sweep_data_granularity_minutes, int) or [self.DATA_GRANULARITY_MINUTES]
+		self.SWEEP_MIN_VOLUMES = parse_grid(config.sweep_min_volume, float) or [self.MINIMUM_VOLUME]
+		self.SWEEP_VOLATILITY_FILTERS = parse_grid(config.sweep_volatility_filter, float) or [self.VOLATILITY_FILTER]
+		self.SWEEP_WORKERS = config.sweep_workers
+		self.SWEEP_OUTPUT_PATH = config.sweep_output_path
+		self.FUSION_GRANULARITIES = parse_grid(config.fusion_granularities, int)
+		self.SHARD_COUNT = config.shard_count
+		self.SHARD_INDEX = config.shard_index
+		self.SHARD_DIRECTORY = config.shard_directory
+		self.IS_MERGE_SHARDS = config.is_merge_shards
+		self.SHARD_WAIT_MINUTES = config.shard_wait_minutes
+		self.SHARD_RUN_ID = config.shard_run_id
+
+		# Every shard worker keeps its own data dictionary and checkpoint log
+		if self.SHARD_COUNT > 1 and self.IS_MERGE_SHARDS == 0:
+			self.DATA_DICTIONARY_PATH = get_shard_dictionary_path(self.DATA_DICTIONARY_PATH, self.SHARD_INDEX, self.SHARD_COUNT)
+
+		# Stage timings and dropped symbols of the run. They are shared with every data engine.
+		self.metrics = ScanMetrics()
 
 		# Create data engine
-		self.dataEngine = DataEngine(self.HISTORY_TO_USE, self.DATA_GRANULARITY_MINUTES, 
+		self.dataEngine = self.create_data_engine(self.HISTORY_TO_USE, self.DATA_GRANULARITY_MINUTES)
+
+	def create_data_engine(self, history_to_use, data_granularity_minutes, series_only = False):
+		return DataEngine(history_to_use, data_granularity_minutes, 
 							self.IS_SAVE_DICTIONARY, self.IS_LOAD_FROM_DICTIONARY, self.DATA_DICTIONARY_PATH,
 							self.MINIMUM_VOLUME,
 							self.IS_TEST, self.FUTURE_BARS_FOR_TESTING,
 							self.VOLATILITY_FILTER,
 							self.STOCK_LIST,
-							self.DATA_SOURCE)
-		
+							self.DATA_SOURCE,
+							fetch_workers = self.FETCH_WORKERS,
+							requests_per_second = self.REQUESTS_PER_SECOND,
+							max_retries = self.MAX_RETRIES,
+							batch_size = self.BATCH_SIZE,
+							feature_workers = self.FEATURE_WORKERS,
+							indicator_engine = self.INDICATOR_ENGINE,
+							data_directory = self.DATA_DIRECTORY,
+							series_only = series_only,
+							indicator_cache_size = self.INDICATOR_CACHE_SIZE,
+							max_gap_fraction = self.MAX_GAP_FRACTION,
+							fusion_granularities = self.FUSION_GRANULARITIES,
+							checkpoint_max_age_minutes = self.CHECKPOINT_MAX_AGE_MINUTES,
+							metrics = self.metrics)
 
 	def is_nan(self, object):
 		"""
@@ -143,133 +359,284 @@ class Surpriver:
 
 		return value
 
-	def calculate_volume_changes(self, historical_price):
-		volume = list(historical_price["Volume"])
-		dates = list(historical_price["Datetime"])
-		dates = [str(date) for date in dates]
-
-		# Get volume by date
-		volume_by_date_dictionary = collections.defaultdict(list)
-		for j in range(0, len(volume)):
-			date = dates[j].split(" ")[0]
-			volume_by_date_dictionary[date].append(volume[j])
-
-		for key in volume_by_date_dictionary:
-			volume_by_date_dictionary[key] = np.sum(volume_by_date_dictionary[key]) # taking average as we have multiple bars per day. 
+	def get_day_keys(self, times):
+		"""
+		Day of every bar. Time zone aware bars are grouped by their local date. Times that are not dates, like binance epoch milliseconds, are their own day.
+		"""
+		if pd.api.types.is_datetime64_any_dtype(times):
+			if times.dt.tz is not None:
+				times = times.dt.tz_localize(None)
+			return times.values.astype("datetime64[D]")
+		if pd.api.types.is_numeric_dtype(times):
+			return times.values
+		return np.array([str(time).split(" ")[0] for time in times])
 
-		# Get all dates
-		all_dates = list(reversed(sorted(volume_by_date_dictionary.keys())))
-		latest_date = all_dates[0]
-		latest_data_point =  list(reversed(sorted(dates)))[0]
+	def calculate_volume_changes(self, historical_price):
+		volume = historical_price["Volume"].values
+		times = historical_price["Datetime"]
+
+		# Sum the volume of every day that has bars, latest day first
+		days, day_positions = np.unique(self.get_day_keys(times), return_inverse = True)
+		volume_by_date = np.bincount(day_positions, weights = volume, minlength = len(days))[::-1]
+		if pd.api.types.is_object_dtype(times):
+			latest_data_point = max(str(time) for time in times)
+		else:
+			latest_data_point = str(times.max())
 
 		# Get volume information
-		today_volume = volume_by_date_dictionary[latest_date]
-		average_vol_last_five_days = np.mean([volume_by_date_dictionary[date] for date in all_dates[1:6]])
-		average_vol_last_twenty_days = np.mean([volume_by_date_dictionary[date] for date in all_dates[1:20]])
+		today_volume = volume_by_date[0]
+		average_vol_last_five_days = np.mean(volume_by_date[1:6])
+		average_vol_last_twenty_days = np.mean(volume_by_date[1:20])
 
-		
 		return latest_data_point, self.parse_large_values(today_volume), self.parse_large_values(average_vol_last_five_days), self.parse_large_values(average_vol_last_twenty_days)
 
 	def calculate_recent_volatility(self, historical_price):
-		close_price = list(historical_price["Close"])
+		close_price = historical_price["Close"].values
 		volatility_five_bars = np.std(close_price[-5:])
 		volatility_twenty_bars = np.std(close_price[-20:])
 		volatility_all = np.std(close_price)
 		return volatility_five_bars, volatility_twenty_bars, volatility_all
 
 	def calculate_future_performance(self, future_data):
+		total_sum_percentage_change, future_volatility = self.calculate_future_performance_for_all([future_data])
+		return total_sum_percentage_change[0], future_volatility[0]
+
+	def calculate_future_performance_for_all(self, future_prices):
+		"""
+		Absolute sum of the percentage changes from the alert bar and volatility of the future close prices of every symbol.
+		Close prices of 0 are missing data and are ignored, shorter future prices are padded with them.
+		"""
 		CLOSE_PRICE_INDEX = 4
-		price_at_alert = future_data[0][CLOSE_PRICE_INDEX]
-		prices_in_future = [item[CLOSE_PRICE_INDEX] for item in future_data[1:]]
-		prices_in_future = [item for item in prices_in_future if item != 0]
-		total_sum_percentage_change = abs(sum([self.calculate_percentage_change(price_at_alert, next_price) for next_price in prices_in_future]))
-		future_volatility = np.std(prices_in_future)
+		number_of_bars = max([len(future_data) for future_data in future_prices] + [1])
+		close_prices = np.zeros((len(future_prices), number_of_bars))
+		for i, future_data in enumerate(future_prices):
+			close_prices[i, :len(future_data)] = [bar[CLOSE_PRICE_INDEX] for bar in future_data]
+		return self.calculate_future_performance_from_close_prices(close_prices)
+
+	def calculate_future_performance_from_close_prices(self, close_prices):
+		"""
+		Same as calculate_future_performance_for_all for a (symbols x bars) matrix of close prices that starts with the alert bar
+		"""
+		price_at_alert = close_prices[:, :1]
+		prices_in_future = close_prices[:, 1:]
+		is_price = prices_in_future != 0
+		with np.errstate(divide = "ignore", invalid = "ignore"):
+			percentage_changes = self.calculate_percentage_change(price_at_alert, prices_in_future)
+			total_sum_percentage_change = np.abs(np.where(is_price, percentage_changes, 0).sum(axis = 1))
+
+			# Same as np.std over the prices that are not missing
+			number_of_prices = is_price.sum(axis = 1)
+			mean_prices = np.where(is_price, prices_in_future, 0).sum(axis = 1) / number_of_prices
+			future_volatility = np.sqrt(np.where(is_price, (prices_in_future - mean_prices[:, None]) ** 2, 0).sum(axis = 1) / number_of_prices)
 		return total_sum_percentage_change, future_volatility
 
+	def gather_data(self):
+		"""
+		Gather data for all stocks
+		"""
+		if self.IS_MERGE_SHARDS == 1:
+			# The workers already downloaded everything
+			return self.merge_shards()
+		elif self.IS_LOAD_FROM_DICTIONARY == 0 and self.IS_INCREMENTAL_UPDATE == 1:
+			# Only download the bars after the ones in the dictionary
+			return self.dataEngine.update_data_from_dictionary()
+		elif self.IS_LOAD_FROM_DICTIONARY == 0:
+			return self.dataEngine.collect_data_for_all_tickers()
+		else:
+			# Load data from dictionary
+			return self.dataEngine.load_data_from_dictionary()
+
+	def get_detector_parameters(self):
+		"""
+		Parameters of the detector backend. max_samples and detector_workers only apply to the isolation forest.
+		"""
+		if self.DETECTOR == "isolation_forest":
+			return {"max_samples": self.MAX_SAMPLES, "n_jobs": self.DETECTOR_WORKERS, "chunk_size": self.SCORE_CHUNK_SIZE}
+		return {"chunk_size": self.SCORE_CHUNK_SIZE}
+
+	def get_shard_settings(self):
+		"""
+		Arguments that change the features or the split of the prices. Workers and the coordinator must agree on them.
+		"""
+		return {"history_to_use": self.HISTORY_TO_USE, "data_granularity_minutes": self.DATA_GRANULARITY_MINUTES, "is_test": self.IS_TEST,
+				"future_bars": self.FUTURE_BARS_FOR_TESTING, "indicator_engine": self.INDICATOR_ENGINE, "min_volume": self.MINIMUM_VOLUME,
+				"volatility_filter": self.VOLATILITY_FILTER, "max_gap_fraction": self.MAX_GAP_FRACTION,
+				"fusion_granularities": self.FUSION_GRANULARITIES, "data_source": self.DATA_SOURCE}
+
+	def scan_shard(self):
+		"""
+		Worker of a sharded scan. Downloads and featurizes the symbols of its shard and writes them to the shard directory, the coordinator fits and scores.
+		"""
+		scan_start_time = time.time()
+		self.dataEngine.stocks_list = get_shard_symbols(self.dataEngine.stocks_list, self.SHARD_INDEX, self.SHARD_COUNT)
+		print("Scanning shard %d of %d with %d symbols..." % (self.SHARD_INDEX, self.SHARD_COUNT, len(self.dataEngine.stocks_list)))
+		features, historical_price_info, future_prices, symbol_names = self.gather_data()
+
+		with self.metrics.stage("save_shard"):
+			dropped_symbols = self.metrics.get_summary()["dropped_symbols"]
+			shard_path = ShardDirectory(self.SHARD_DIRECTORY, self.SHARD_COUNT, self.SHARD_RUN_ID).save_shard(self.SHARD_INDEX, self.get_shard_settings(), features,
+											historical_price_info, future_prices, symbol_names, len(self.dataEngine.stocks_list), dropped_symbols, scan_start_time)
+		print("Shard with %d symbols stored successfully in %s" % (len(symbol_names), shard_path))
+		return shard_path
+
+	def merge_shards(self):
+		"""
+		Coordinator of a sharded scan. Waits for the shards of all workers and merges them in the order of the stocks list, so the detector
+		is fit on the same rows as a scan of the whole list in one process. Only shards of the same run id are merged.
+		"""
+		shard_directory = ShardDirectory(self.SHARD_DIRECTORY, self.SHARD_COUNT, self.SHARD_RUN_ID)
+		missing_shards = shard_directory.wait_for_shards(self.SHARD_WAIT_MINUTES * 60)
+		if len(missing_shards) > 0:
+			raise DataError("Shards %s are missing or left over from an earlier run in %s" % (", ".join(str(shard_index) for shard_index in missing_shards), self.SHARD_DIRECTORY))
+
+		print("Merging %d shards from %s" % (self.SHARD_COUNT, self.SHARD_DIRECTORY))
+		with self.metrics.stage("merge_shards"):
+			shards = shard_directory.load_shards(self.get_shard_settings())
+			features, historical_price_info, future_prices, symbol_names = merge_shards(shards, self.dataEngine.stocks_list)
+
+		# Symbols the workers dropped are reported by the coordinator too
+		for shard in shards:
+			self.metrics.increment("symbols_requested", shard["symbols_requested"])
+			for dropped_symbol in shard["dropped_symbols"]:
+				self.metrics.drop_symbol(dropped_symbol["symbol"], dropped_symbol["reason"], dropped_symbol["detail"])
+		self.metrics.increment("symbols_scanned", len(symbol_names))
+		return features, historical_price_info, future_prices, symbol_names
+
+	def create_detector(self):
+		return create_anomaly_detector(self.DETECTOR, **self.get_detector_parameters())
+
+	def get_model_path(self, number_of_features):
+		"""
+		A saved detector only fits features with the same layout, which is set by the history length and the number of features, computed from bars of the same granularities.
+		Every backend gets its own file.
+		"""
+		granularities = "+".join("%dm" % granularity for granularity in [self.DATA_GRANULARITY_MINUTES] + self.FUSION_GRANULARITIES)
+		return os.path.join(self.MODEL_DIRECTORY, "%s_%s_%dh_%df.joblib" % (self.DETECTOR, granularities, self.HISTORY_TO_USE, number_of_features))
+
+	def get_detector(self, features):
+		"""
+		Load the saved detector in score only mode, otherwise fit a new one on the features and save it if asked to
+		"""
+		model_path = self.get_model_path(features.shape[1])
+		if self.IS_SCORE_ONLY == 1:
+			if path.exists(model_path):
+				print("Scoring with the saved anomaly detector", model_path)
+				with self.metrics.stage("load_model"):
+					detector = load_detector(model_path)
+				detector.set_workers(self.DETECTOR_WORKERS)
+				return detector
+			print("No saved anomaly detector found at %s, fitting a new one" % model_path)
+
+		detector = self.create_detector()
+		with self.metrics.stage("fit"):
+			detector.fit(features)
+
+		if self.IS_SAVE_MODEL == 1:
+			os.makedirs(self.MODEL_DIRECTORY, exist_ok = True)
+			# Written next to the target and renamed, so a crash never leaves a broken model behind
+			with self.metrics.stage("save_model"):
+				joblib.dump(detector, model_path + ".tmp")
+				os.replace(model_path + ".tmp", model_path)
+			print("Anomaly detector saved to", model_path)
+		return detector
+
 	def find_anomalies(self):
 		"""
-		Main function that does everything
+		Main function that does everything. Returns a list with a dictionary of statistics for each of the top predictions.
 		"""
 
 		# Gather data for all stocks
-		if self.IS_LOAD_FROM_DICTIONARY == 0:
-			features, historical_price_info, future_prices, symbol_names = self.dataEngine.collect_data_for_all_tickers()
-		else:
-			# Load data from dictionary
-			features, historical_price_info, future_prices, symbol_names = self.dataEngine.load_data_from_dictionary()
+		features, historical_price_info, future_prices, symbol_names = self.gather_data()
 		
-		# Find anomalous stocks using the Isolation Forest model. Read more about the model at -> https://scikit-learn.org/stable/modules/generated/sklearn.ensemble.IsolationForest.html
-		detector = IsolationForest(n_estimators = 100, random_state = 0)
-		detector.fit(features)
-		predictions = detector.decision_function(features)
+		# Find anomalous stocks with the chosen detector backend. The default Isolation Forest is described at -> https://scikit-learn.org/stable/modules/generated/sklearn.ensemble.IsolationForest.html
+		detector = self.get_detector(features)
+		with self.metrics.stage("score"):
+			predictions = detector.decision_function(features)
 		
-		# Print top predictions with some statistics
-		predictions_with_output_data = [[predictions[i], symbol_names[i], historical_price_info[i], future_prices[i]] for i in range(0, len(predictions))]
-		predictions_with_output_data = list(sorted(predictions_with_output_data))
+		with self.metrics.stage("report"):
+			# Print top predictions with some statistics. Ties are broken by symbol name.
+			prediction_order = np.lexsort((np.array(symbol_names), predictions))
+			predictions_with_output_data = [[predictions[i], symbol_names[i], historical_price_info[i], future_prices[i]] for i in prediction_order[:self.TOP_PREDICTIONS_TO_PRINT]]
 
-		#Results object for storing results in JSON format
-		results = []
+			#Results object for storing results in JSON format
+			results = []
 
-		for item in predictions_with_output_data[:self.TOP_PREDICTIONS_TO_PRINT]:
-			# Get some stats to print
-			prediction, symbol, historical_price, future_price = item
+			for item in predictions_with_output_data:
+				# Get some stats to print
+				prediction, symbol, historical_price, future_price = item
 
-			# Check if future data is present or not
-			if self.IS_TEST == 1 and len(future_price) < 5:
-				print("No future data is present. Please make sure that you ran the prior command with is_test enabled or disable that command now. Exiting now...")
-				exit()
+				# Check if future data is present or not
+				if self.IS_TEST == 1 and len(future_price) < 5:
+					raise DataError("No future data is present. Please make sure that you ran the prior command with is_test enabled or disable that command now.")
 
-			latest_date, today_volume, average_vol_last_five_days, average_vol_last_twenty_days = self.calculate_volume_changes(historical_price)
-			volatility_vol_last_five_days, volatility_vol_last_twenty_days, _ = self.calculate_recent_volatility(historical_price)
-			if average_vol_last_five_days == None or volatility_vol_last_five_days == None:
-				continue
+				latest_date, today_volume, average_vol_last_five_days, average_vol_last_twenty_days = self.calculate_volume_changes(historical_price)
+				volatility_vol_last_five_days, volatility_vol_last_twenty_days, _ = self.calculate_recent_volatility(historical_price)
+				if average_vol_last_five_days == None or volatility_vol_last_five_days == None:
+					continue
 
-			if self.IS_TEST == 0:
-				# Not testing so just add/print the predictions
+				if self.IS_TEST == 0:
+					# Not testing so just add/print the predictions
 				
-				if self.OUTPUT_FORMAT == "CLI":
-					print("Last Bar Time: %s\nSymbol: %s\nAnomaly Score: %.3f\nToday Volume: %s\nAverage Volume 5d: %s\nAverage Volume 20d: %s\nVolatility 5bars: %.3f\nVolatility 20bars: %.3f\n----------------------" % 
-																	(latest_date, symbol, prediction,
-																	today_volume, average_vol_last_five_days, average_vol_last_twenty_days,
-																	volatility_vol_last_five_days, volatility_vol_last_twenty_days))
-				results.append({
-					'latest_date' : latest_date,
-					'Symbol' : symbol,
-					'Anomaly Score' : prediction,
-					'Today Volume' : today_volume,
-					'Average Volume 5d' : average_vol_last_five_days,
-					'Average Volume 20d' : average_vol_last_twenty_days,
-					'Volatility 5bars' : volatility_vol_last_five_days,
-					'Volatility 20bars' : volatility_vol_last_twenty_days
-				})
-
-			else:
-				# Testing so show what happened in the future
-				future_abs_sum_percentage_change, _ = self.calculate_future_performance(future_price)
-
-				if self.OUTPUT_FORMAT == "CLI":
-					print("Last Bar Time: %s\nSymbol: %s\nAnomaly Score: %.3f\nToday Volume: %s\nAverage Volume 5d: %s\nAverage Volume 20d: %s\nVolatility 5bars: %.3f\nVolatility 20bars: %.3f\nFuture Absolute Sum Price Changes: %.2f\n----------------------" % 
-																	(latest_date, symbol, prediction,
-																	today_volume, average_vol_last_five_days, average_vol_last_twenty_days,
-																	volatility_vol_last_five_days, volatility_vol_last_twenty_days,
-																	future_abs_sum_percentage_change))
-				results.append({
-					'latest_date' : latest_date,
-					'Symbol' : symbol,
-					'Anomaly Score' : prediction,
-					'Today Volume' : today_volume,
-					'Average Volume 5d' : average_vol_last_five_days,
-					'Average Volume 20d' : average_vol_last_twenty_days,
-					'Volatility 5bars' : volatility_vol_last_five_days,
-					'Volatility 20bars' : volatility_vol_last_twenty_days,
-					'Future Absolute Sum Price Changes' : future_abs_sum_percentage_change
-				})
-
-		if self.OUTPUT_FORMAT == "JSON":
-			self.store_results(results)
-
-		if self.IS_TEST == 1:
-			self.calculate_future_stats(predictions_with_output_data)
+					if self.OUTPUT_FORMAT == "CLI":
+						print("Last Bar Time: %s\nSymbol: %s\nAnomaly Score: %.3f\nToday Volume: %s\nAverage Volume 5d: %s\nAverage Volume 20d: %s\nVolatility 5bars: %.3f\nVolatility 20bars: %.3f\n----------------------" % 
+																		(latest_date, symbol, prediction,
+																		today_volume, average_vol_last_five_days, average_vol_last_twenty_days,
+																		volatility_vol_last_five_days, volatility_vol_last_twenty_days))
+					results.append({
+						'latest_date' : latest_date,
+						'Symbol' : symbol,
+						'Anomaly Score' : prediction,
+						'Today Volume' : today_volume,
+						'Average Volume 5d' : average_vol_last_five_days,
+						'Average Volume 20d' : average_vol_last_twenty_days,
+						'Volatility 5bars' : volatility_vol_last_five_days,
+						'Volatility 20bars' : volatility_vol_last_twenty_days
+					})
+
+				else:
+					# Testing so show what happened in the future
+					future_abs_sum_percentage_change, _ = self.calculate_future_performance(future_price)
+
+					if self.OUTPUT_FORMAT == "CLI":
+						print("Last Bar Time: %s\nSymbol: %s\nAnomaly Score: %.3f\nToday Volume: %s\nAverage Volume 5d: %s\nAverage Volume 20d: %s\nVolatility 5bars: %.3f\nVolatility 20bars: %.3f\nFuture Absolute Sum Price Changes: %.2f\n----------------------" % 
+																		(latest_date, symbol, prediction,
+																		today_volume, average_vol_last_five_days, average_vol_last_twenty_days,
+																		volatility_vol_last_five_days, volatility_vol_last_twenty_days,
+																		future_abs_sum_percentage_change))
+					results.append({
+						'latest_date' : latest_date,
+						'Symbol' : symbol,
+						'Anomaly Score' : prediction,
+						'Today Volume' : today_volume,
+						'Average Volume 5d' : average_vol_last_five_days,
+						'Average Volume 20d' : average_vol_last_twenty_days,
+						'Volatility 5bars' : volatility_vol_last_five_days,
+						'Volatility 20bars' : volatility_vol_last_twenty_days,
+						'Future Absolute Sum Price Changes' : future_abs_sum_percentage_change
+					})
+
+			if self.OUTPUT_FORMAT == "JSON":
+				self.store_results(results)
+
+			if self.IS_TEST == 1:
+				self.calculate_future_stats(predictions, historical_price_info, future_prices)
+
+		return results
+
+	def scan_stream(self):
+		"""
+		Keep the detector and the latest bars in memory and score every new bar that comes from the bar source
+		"""
+		features, historical_price_info, _, symbol_names = self.gather_data()
+		scanner = StreamingScanner(self.dataEngine, symbol_names, historical_price_info, features,
+							refit_interval_minutes = self.REFIT_INTERVAL_MINUTES,
+							alert_threshold = self.ALERT_THRESHOLD,
+							detector = self.get_detector(features),
+							detector_factory = self.create_detector)
+		try:
+			scanner.run(create_bar_source(self.BAR_SOURCE, self.BAR_SOURCE_ADDRESS).read_bars())
+		except KeyboardInterrupt:
+			print("Stopping the streaming scanner")
 
 	def store_results(self, results):
 		"""
@@ -290,51 +657,63 @@ class Surpriver:
 
 		print("Results stored successfully in", file_name)
 
-	def calculate_future_stats(self, predictions_with_output_data):
+	def remove_invalid_future_results(self, anomalous_score, future_change, future_volatilities, historical_volatilities):
 		"""
-		Calculate different stats for future data to show whether the anomalous stocks found were actually better than non-anomalous ones
+		Skip for when there is a reverse split, the yfinance package does not handle that well so percentages get weirdly large
 		"""
-		future_change = []
-		anomalous_score = []
-		historical_volatilities = []
-		future_volatilities = []
+		anomalous_score = np.asarray(anomalous_score)
+		is_valid = ~(np.abs(future_change) > 250) & ~np.isnan(future_change) & ~np.isnan(anomalous_score)
+		return anomalous_score[is_valid], future_change[is_valid], future_volatilities[is_valid], historical_volatilities[is_valid]
 
-		for item in predictions_with_output_data:
-			prediction, symbol, historical_price, future_price = item
-			future_sum_percentage_change, future_volatility = self.calculate_future_performance(future_price)
-			_, _, historical_volatility = self.calculate_recent_volatility(historical_price)
+	def get_future_stats(self, anomalous_score, future_change, future_volatilities, historical_volatilities):
+		"""
+		Correlation between the anomaly scores and the future changes, and averages for anomalous vs normal stocks. Anything less than 0 is considered anomalous.
+		"""
+		is_anomalous = anomalous_score < 0
+		with np.errstate(divide = "ignore", invalid = "ignore"):
+			return {
+				'Correlation' : np.corrcoef(anomalous_score, future_change)[0, 1] if len(anomalous_score) > 1 else np.nan,
+				'Anomalous Future Changes' : np.mean(future_change[is_anomalous]),
+				'Normal Future Changes' : np.mean(future_change[~is_anomalous]),
+				'Anomalous Future Volatility' : np.mean(future_volatilities[is_anomalous]),
+				'Normal Future Volatility' : np.mean(future_volatilities[~is_anomalous]),
+				'Anomalous Historical Volatility' : np.mean(historical_volatilities[is_anomalous]),
+				'Normal Historical Volatility' : np.mean(historical_volatilities[~is_anomalous])
+			}
+
+	def print_future_stats(self, stats):
+		print("Correlation between future absolute change vs anomalous score (lower is better, range = (-1, 1)): **%.2f**\nTotal absolute change in future for Anomalous Stocks: **%.3f**\nTotal absolute change in future for Normal Stocks: **%.3f**\nAverage future volatility of Anomalous Stocks: **%.3f**\nAverage future volatility of Normal Stocks: **%.3f**\nHistorical volatility for Anomalous Stocks: **%.3f**\nHistorical volatility for Normal Stocks: **%.3f**\n" % (
+								stats['Correlation'],
+								stats['Anomalous Future Changes'], stats['Normal Future Changes'],
+								stats['Anomalous Future Volatility'], stats['Normal Future Volatility'],
+								stats['Anomalous Historical Volatility'], stats['Normal Historical Volatility']))
 
-			# Skip for when there is a reverse split, the yfinance package does not handle that well so percentages get weirdly large
-			if abs(future_sum_percentage_change) > 250 or self.is_nan(future_sum_percentage_change) == True or self.is_nan(prediction) == True:
-				continue
+	def calculate_future_stats(self, predictions, historical_price_info, future_prices):
+		"""
+		Calculate different stats for future data to show whether the anomalous stocks found were actually better than non-anomalous ones. The stats are printed, plotted and returned.
+		"""
+		# Plotting is only needed here, matplotlib is slow to import
+		import matplotlib.pyplot as plt
+
+		# Styling for plots
+		plt.style.use('seaborn-white')
+		plt.rc('grid', linestyle="dotted", color='#a0a0a0')
+		plt.rcParams['axes.edgecolor'] = "#04383F"
 
-			future_change.append(future_sum_percentage_change)
-			anomalous_score.append(prediction)
-			future_volatilities.append(future_volatility)
-			historical_volatilities.append(historical_volatility)
+		future_change, future_volatilities = self.calculate_future_performance_for_all(future_prices)
+		historical_volatilities = historical_price_info.get_close_volatilities()
+		anomalous_score, future_change, future_volatilities, historical_volatilities = self.remove_invalid_future_results(predictions, future_change, future_volatilities, historical_volatilities)
 
 		# Calculate correlation and stats
-		correlation = np.corrcoef(anomalous_score, future_change)[0, 1]
-		anomalous_future_changes = np.mean([future_change[x] for x in range(0, len(future_change)) if anomalous_score[x] < 0]) # Anything less than 0 is considered anomalous
-		normal_future_changes = np.mean([future_change[x] for x in range(0, len(future_change)) if anomalous_score[x] >= 0])
-		anomalous_future_volatilities = np.mean([future_volatilities[x] for x in range(0, len(future_volatilities)) if anomalous_score[x] < 0]) # Anything less than 0 is considered anomalous
-		normal_future_volatilities = np.mean([future_volatilities[x] for x in range(0, len(future_volatilities)) if anomalous_score[x] >= 0])
-		anomalous_historical_volatilities = np.mean([historical_volatilities[x] for x in range(0, len(historical_volatilities)) if anomalous_score[x] < 0]) # Anything less than 0 is considered anomalous
-		normal_historical_volatilities = np.mean([historical_volatilities[x] for x in range(0, len(historical_volatilities)) if anomalous_score[x] >= 0])
-		
+		stats = self.get_future_stats(anomalous_score, future_change, future_volatilities, historical_volatilities)
 		print("\n*************** Future Performance ***************")
-		print("Correlation between future absolute change vs anomalous score (lower is better, range = (-1, 1)): **%.2f**\nTotal absolute change in future for Anomalous Stocks: **%.3f**\nTotal absolute change in future for Normal Stocks: **%.3f**\nAverage future volatility of Anomalous Stocks: **%.3f**\nAverage future volatility of Normal Stocks: **%.3f**\nHistorical volatility for Anomalous Stocks: **%.3f**\nHistorical volatility for Normal Stocks: **%.3f**\n" % (
-								correlation,
-								anomalous_future_changes, normal_future_changes, 
-								anomalous_future_volatilities, normal_future_volatilities,
-								anomalous_historical_volatilities, normal_historical_volatilities))
+		self.print_future_stats(stats)
 
 		# Plot
 		FONT_SIZE = 14
-		colors = ['#c91414' if anomalous_score[x] < 0 else '#035AA6' for x in range(0, len(anomalous_score))]
-		anomalous_vs_normal = np.array([1 if anomalous_score[x] < 0 else 0 for x in range(0, len(anomalous_score))])
-		plt.scatter(np.array(anomalous_score)[anomalous_vs_normal == 1], np.array(future_change)[anomalous_vs_normal == 1], marker='v', color = '#c91414')
-		plt.scatter(np.array(anomalous_score)[anomalous_vs_normal == 0], np.array(future_change)[anomalous_vs_normal == 0], marker='P', color = '#035AA6')
+		is_anomalous = anomalous_score < 0
+		plt.scatter(anomalous_score[is_anomalous], future_change[is_anomalous], marker='v', color = '#c91414')
+		plt.scatter(anomalous_score[~is_anomalous], future_change[~is_anomalous], marker='P', color = '#035AA6')
 		plt.axvline(x = 0, linestyle = '--', color = '#848484')
 		plt.xlabel("Anomaly Score", fontsize = FONT_SIZE)
 		plt.ylabel("Absolute Future Change", fontsize = FONT_SIZE)
@@ -346,12 +725,137 @@ class Surpriver:
 		plt.grid()
 		plt.show()
 
+		return stats
+
+	def run_backtest(self):
+		"""
+		Walk-forward backtest. Prices are gathered once, then the cut point between historical and future bars is moved back backtest_step_bars bars
+		at a time. Every window gets its own detector and future stats, and the stats of all windows are written to backtest_output_path as JSON.
+		"""
+		_, historical_price_info, _, symbol_names = self.gather_data()
+		backtest = WalkForwardBacktest(self.dataEngine.taEngine, historical_price_info, self.FUTURE_BARS_FOR_TESTING,
+							detector = self.DETECTOR, detector_parameters = self.get_detector_parameters(),
+							workers = self.BACKTEST_WORKERS)
+		cut_points = backtest.get_cut_points(self.BACKTEST_WINDOWS, self.BACKTEST_STEP_BARS if self.BACKTEST_STEP_BARS > 0 else self.FUTURE_BARS_FOR_TESTING)
+		print("Backtesting %d windows..." % len(cut_points))
+
+		with self.metrics.stage("backtest_windows"):
+			window_scores = backtest.score_windows(cut_points)
+
+		windows, all_results = [], []
+		for bars_back, (symbol_indices, predictions) in zip(cut_points, window_scores):
+			close_prices = historical_price_info.get_future_close_prices(symbol_indices, bars_back, self.FUTURE_BARS_FOR_TESTING)
+			future_change, future_volatilities = self.calculate_future_performance_from_close_prices(close_prices)
+			historical_volatilities = historical_price_info.get_close_volatilities(symbol_indices, bars_back)
+			results = self.remove_invalid_future_results(predictions, future_change, future_volatilities, historical_volatilities)
+			all_results.append(results)
+
+			last_bar_times = historical_price_info.prices["Datetime"].iloc[historical_price_info.offsets[symbol_indices + 1] - bars_back - 1]
+			windows.append({"bars_back": int(bars_back), "last_bar_time": str(last_bar_times.max()) if len(last_bar_times) > 0 else None,
+							"symbols": int(len(results[0])), "anomalous_symbols": int(np.sum(results[0] < 0)), **self.get_future_stats(*results)})
+
+		stats_over_windows = self.get_future_stats(*[np.concatenate(column) for column in zip(*all_results)]) if len(all_results) > 0 else {}
+		mean_stats = {key: np.nanmean([window[key] for window in windows]) for key in stats_over_windows}
+
+		print("\n*************** Backtest Performance, All Windows ***************")
+		if len(stats_over_windows) > 0:
+			self.print_future_stats(stats_over_windows)
+
+		backtest_results = {"symbols": len(symbol_names), "history_to_use": self.HISTORY_TO_USE, "future_bars": self.FUTURE_BARS_FOR_TESTING,
+							"data_granularity_minutes": self.DATA_GRANULARITY_MINUTES, "fusion_granularities": self.FUSION_GRANULARITIES, "windows": windows,
+							"all_windows": stats_over_windows, "mean_over_windows": mean_stats}
+		with open(self.BACKTEST_OUTPUT_PATH, 'w') as result_file:
+			json.dump(self.to_json_value(backtest_results), result_file, indent = 1)
+		print("Backtest results stored successfully in", self.BACKTEST_OUTPUT_PATH)
+		return backtest_results
+
+	def run_sweep(self):
+		"""
+		Parameter sweep. Prices are gathered once for every granularity in the grid and every configuration is tested on the last future_bars bars, like is_test.
+		Configurations are ranked by the correlation between their anomaly scores and the future changes, and the table is written to sweep_output_path.
+		"""
+		sweep = ParameterSweep(self.SWEEP_HISTORIES, self.SWEEP_GRANULARITIES, self.SWEEP_MIN_VOLUMES, self.SWEEP_VOLATILITY_FILTERS,
+							detector = self.DETECTOR, detector_parameters = self.get_detector_parameters(),
+							workers = self.SWEEP_WORKERS)
+		for granularity in sweep.GRANULARITIES:
+			data_engine = self.create_data_engine(max(sweep.HISTORIES), granularity, series_only = True)
+			symbol_names, historical_price_info, future_price_info = data_engine.collect_prices_for_all_tickers()
+			with self.metrics.stage("indicators"):
+				sweep.add_prices(granularity, data_engine, symbol_names, historical_price_info, future_price_info)
+
+		configurations = sweep.get_configurations()
+		print("Testing %d configurations..." % len(configurations))
+		with self.metrics.stage("sweep_configurations"):
+			configuration_scores = sweep.score_configurations(configurations)
+
+		sweep_results = []
+		for configuration, (symbol_indices, predictions) in zip(configurations, configuration_scores):
+			symbol_data = sweep.symbol_data[configuration["data_granularity_minutes"]]
+			future_change, future_volatilities = self.calculate_future_performance_for_all([symbol_data["future_price_info"][i] for i in symbol_indices])
+			historical_volatilities = symbol_data["historical_price_info"].get_close_volatilities(symbol_indices)
+			results = self.remove_invalid_future_results(predictions, future_change, future_volatilities, historical_volatilities)
+			sweep_results.append({**configuration, "symbols": int(len(results[0])), "anomalous_symbols": int(np.sum(results[0] < 0)), **self.get_future_stats(*results)})
+
+		# Lower correlation is better. Configurations without a correlation go last.
+		sweep_results = pd.DataFrame(sweep_results).sort_values("Correlation", kind = "mergesort", na_position = "last").reset_index(drop = True)
+		sweep_results.insert(0, "rank", np.arange(1, len(sweep_results) + 1))
+
+		print("\n*************** Sweep Results ***************")
+		print(sweep_results.to_string(index = False))
+		sweep_results.to_csv(self.SWEEP_OUTPUT_PATH, index = False)
+		print("Sweep results stored successfully in", self.SWEEP_OUTPUT_PATH)
+		return sweep_results
+
+	def to_json_value(self, value):
+		"""
+		NaN is not valid JSON, store it as null
+		"""
+		if isinstance(value, dict):
+			return {key: self.to_json_value(item) for key, item in value.items()}
+		if isinstance(value, list):
+			return [self.to_json_value(item) for item in value]
+		if isinstance(value, float) and value != value:
+			return None
+		return value
+
+
+def main(argv = None):
+	config = argParser.parse_args(argv)
 
-# Check arguments
-argumentChecker = ArgChecker()
+	# Check arguments
+	argumentChecker = ArgChecker(config)
 
-# Create surpriver instance
-supriver = Surpriver()
+	# Create surpriver instance
+	supriver = Surpriver(config)
 
-# Generate predictions
-supriver.find_anomalies()
\ No newline at end of file
+	# Profile the whole run if asked to
+	profiler = cProfile.Profile() if config.profile_path != "" else None
+	if profiler is not None:
+		profiler.enable()
+
+	# Generate predictions
+	try:
+		if config.is_streaming == 1:
+			supriver.scan_stream()
+		elif config.is_backtest == 1:
+			supriver.run_backtest()
+		elif config.is_sweep == 1:
+			supriver.run_sweep()
+		elif config.shard_count > 1 and config.is_merge_shards == 0:
+			supriver.scan_shard()
+		else:
+			supriver.find_anomalies()
+	except DataError as e:
+		# Library callers get the exception, the command line prints it and fails, so cron jobs and shard orchestration notice
+		print(e)
+		sys.exit(1)
+	finally:
+		if profiler is not None:
+			profiler.disable()
+			profiler.dump_stats(config.profile_path)
+			print("Profile stored successfully in", config.profile_path)
+		if config.metrics_path != "":
+			supriver.metrics.save(config.metrics_path)
+
+if __name__ == "__main__":
+	main()
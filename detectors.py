@@ -0,0 +1,312 @@
+# Basic libraries
+import joblib
+import numpy as np
+from sklearn.ensemble import IsolationForest
+import warnings
+warnings.filterwarnings("ignore")
+
+def average_path_length(number_of_samples):
+	"""
+	Average path length of an unsuccessful search in a binary search tree, as used by IsolationForest
+	"""
+	number_of_samples = np.asarray(number_of_samples, dtype = np.float64)
+	with np.errstate(divide = "ignore", invalid = "ignore"):
+		path_length = 2.0 * (np.log(number_of_samples - 1.0) + np.euler_gamma) - 2.0 * (number_of_samples - 1.0) / number_of_samples
+	path_length = np.where(number_of_samples == 2, 1.0, path_length)
+	return np.where(number_of_samples <= 1, 0.0, path_length)
+
+class IsolationForestScorer:
+	"""
+	Scores one sample at a time with the trees of a fitted IsolationForest. decision_function validates its input and dispatches
+	every tree through joblib, which is slow for a single sample. Here all trees are stacked into arrays and walked together, one level per step.
+	"""
+	def __init__(self, detector):
+		trees = [estimator.tree_ for estimator in detector.estimators_]
+		shape = (len(trees), max(tree.node_count for tree in trees))
+		self.left_children = np.zeros(shape, dtype = np.int64)
+		self.right_children = np.zeros(shape, dtype = np.int64)
+		self.features = np.zeros(shape, dtype = np.int64)
+		self.thresholds = np.full(shape, np.inf)
+		self.path_lengths = np.zeros(shape)
+
+		for i, (tree, tree_features) in enumerate(zip(trees, detector.estimators_features_)):
+			nodes = np.arange(tree.node_count)
+			is_leaf = tree.children_left == -1
+
+			# Leaves point to themselves, so walking further down does not move
+			self.left_children[i, :tree.node_count] = np.where(is_leaf, nodes, tree.children_left)
+			self.right_children[i, :tree.node_count] = np.where(is_leaf, nodes, tree.children_right)
+			self.features[i, :tree.node_count] = np.asarray(tree_features)[np.where(is_leaf, 0, tree.feature)]
+			self.thresholds[i, :tree.node_count] = np.where(is_leaf, np.inf, tree.threshold)
+
+			# Children always come after their parent
+			depths = np.zeros(tree.node_count)
+			for node in nodes[~is_leaf]:
+				depths[tree.children_left[node]] = depths[tree.children_right[node]] = depths[node] + 1
+			self.path_lengths[i, :tree.node_count] = depths + average_path_length(tree.n_node_samples)
+
+		self.trees = np.arange(len(trees))
+		self.MAX_DEPTH = max(tree.max_depth for tree in trees)
+		self.NORMALIZER = len(trees) * average_path_length(detector.max_samples_)
+		self.OFFSET = detector.offset_
+
+	def decision_function(self, sample):
+		"""
+		Same as IsolationForest.decision_function for a single sample
+		"""
+		# The trees compare float32 values
+		sample = np.asarray(sample, dtype = np.float32).astype(np.float64)
+		nodes = np.zeros(len(self.trees), dtype = np.int64)
+		for _ in range(0, self.MAX_DEPTH):
+			go_left = sample[self.features[self.trees, nodes]] <= self.thresholds[self.trees, nodes]
+			nodes = np.where(go_left, self.left_children[self.trees, nodes], self.right_children[self.trees, nodes])
+		depths = self.path_lengths[self.trees, nodes].sum()
+		return -(2 ** (-depths / self.NORMALIZER)) - self.OFFSET
+
+class AnomalyDetector:
+	"""
+	Common interface of the anomaly detectors. Like IsolationForest, decision_function gives lower scores to more anomalous samples and
+	negative scores to outliers. Samples are scored chunk_size rows at a time so the memory used for scoring does not grow with the number
+	of symbols, 0 scores all rows at once. Online detectors also learn from every sample that is passed to update.
+	"""
+	IS_ONLINE = False
+
+	def __init__(self, chunk_size = 0, contamination = 0.1):
+		self.CHUNK_SIZE = chunk_size
+		self.CONTAMINATION = contamination
+		self.offset_ = 0.0
+
+	def fit(self, features):
+		"""
+		Learn the normal features, then place the outlier threshold at the contamination quantile of the training scores
+		"""
+		self.fit_model(np.asarray(features, dtype = np.float64))
+		self.offset_ = np.percentile(self.score_samples(features), 100 * self.CONTAMINATION)
+		return self
+
+	def fit_model(self, features):
+		raise NotImplementedError
+
+	def score_chunk(self, features):
+		"""
+		Scores of a chunk of samples, higher is more normal
+		"""
+		raise NotImplementedError
+
+	def score_samples(self, features):
+		features = np.asarray(features, dtype = np.float64)
+		chunk_size = self.CHUNK_SIZE if self.CHUNK_SIZE > 0 else max(len(features), 1)
+		scores = np.empty(len(features))
+		for start in range(0, len(features), chunk_size):
+			scores[start:start + chunk_size] = self.score_chunk(features[start:start + chunk_size])
+		return scores
+
+	def decision_function(self, features):
+		return self.score_samples(features) - self.offset_
+
+	def decision_function_for_sample(self, sample):
+		"""
+		Score of a single feature list, used when streaming
+		"""
+		return self.decision_function(np.asarray(sample, dtype = np.float64)[np.newaxis, :])[0]
+
+	def update(self, sample):
+		"""
+		Learn from one new sample. Only online detectors change.
+		"""
+		pass
+
+	def set_workers(self, workers):
+		pass
+
+class IsolationForestDetector(AnomalyDetector):
+	"""
+	scikit-learn's IsolationForest. Gives the same scores as using the forest directly.
+	"""
+	def __init__(self, n_estimators = 100, max_samples = "auto", n_jobs = 1, random_state = 0, chunk_size = 0):
+		super().__init__(chunk_size)
+		self.model = IsolationForest(n_estimators = n_estimators, max_samples = max_samples, n_jobs = n_jobs, random_state = random_state)
+		self.scorer = None
+
+	@classmethod
+	def from_model(cls, model):
+		detector = cls(chunk_size = 0)
+		detector.model = model
+		detector.offset_ = model.offset_
+		return detector
+
+	def fit(self, features):
+		self.model.fit(features)
+		self.offset_ = self.model.offset_
+		self.scorer = None
+		return self
+
+	def score_chunk(self, features):
+		return self.model.score_samples(features)
+
+	def decision_function_for_sample(self, sample):
+		# The stacked trees are built on the first streamed sample, so batch runs never pay for them
+		if self.scorer is None:
+			self.scorer = IsolationForestScorer(self.model)
+		return self.scorer.decision_function(sample)
+
+	def set_workers(self, workers):
+		self.model.n_jobs = workers
+
+	def __getstate__(self):
+		state = self.__dict__.copy()
+		state["scorer"] = None
+		return state
+
+class HalfSpaceTreesDetector(AnomalyDetector):
+	"""
+	Streaming half-space trees (Tan, Ting and Liu 2011). Every tree splits a random work space around the scaled features in half at every level,
+	and counts how many samples of the reference window fall into every node. Samples in nodes with little mass are anomalous.
+	update walks one path per tree, so it costs n_estimators * max_depth steps no matter how many samples were seen. After window_size updates
+	the counts of the latest window replace the reference counts. window_size 0 uses the number of samples the detector was fit on.
+	"""
+	IS_ONLINE = True
+
+	def __init__(self, n_estimators = 25, max_depth = 10, window_size = 0, size_limit = 0.1, random_state = 0, chunk_size = 0, contamination = 0.1):
+		super().__init__(chunk_size, contamination)
+		self.N_ESTIMATORS = n_estimators
+		self.MAX_DEPTH = max_depth
+		self.WINDOW_SIZE = window_size
+		self.SIZE_LIMIT = size_limit
+		self.RANDOM_STATE = random_state
+
+	def build_trees(self, number_of_features):
+		"""
+		Split feature and split value of every inner node, in level order, so the children of node i are 2i + 1 and 2i + 2
+		"""
+		random_state = np.random.RandomState(self.RANDOM_STATE)
+		trees = np.arange(self.N_ESTIMATORS)[:, np.newaxis]
+		self.split_features = np.zeros((self.N_ESTIMATORS, 2 ** self.MAX_DEPTH - 1), dtype = np.int64)
+		self.split_values = np.zeros((self.N_ESTIMATORS, 2 ** self.MAX_DEPTH - 1))
+
+		# Work space of every tree, around the [0, 1] range of the scaled features
+		centers = random_state.rand(self.N_ESTIMATORS, number_of_features)
+		ranges = 2 * np.maximum(centers, 1 - centers)
+		lows, highs = (centers - ranges)[:, np.newaxis, :], (centers + ranges)[:, np.newaxis, :]
+
+		for depth in range(0, self.MAX_DEPTH):
+			number_of_nodes = 2 ** depth
+			nodes = np.arange(number_of_nodes)[np.newaxis, :]
+			features = random_state.randint(number_of_features, size = (self.N_ESTIMATORS, number_of_nodes))
+			values = (lows[trees, nodes, features] + highs[trees, nodes, features]) / 2
+			self.split_features[:, number_of_nodes - 1:2 * number_of_nodes - 1] = features
+			self.split_values[:, number_of_nodes - 1:2 * number_of_nodes - 1] = values
+
+			left_highs, right_lows = highs.copy(), lows.copy()
+			left_highs[trees, nodes, features] = values
+			right_lows[trees, nodes, features] = values
+			lows = np.stack([lows, right_lows], axis = 2).reshape(self.N_ESTIMATORS, 2 * number_of_nodes, number_of_features)
+			highs = np.stack([left_highs, highs], axis = 2).reshape(self.N_ESTIMATORS, 2 * number_of_nodes, number_of_features)
+
+	def get_paths(self, features):
+		"""
+		Node of every sample in every tree at every depth -> (max_depth + 1, samples, trees)
+		"""
+		features = (features - self.minimums) / self.ranges
+		samples = np.arange(len(features))[:, np.newaxis]
+		trees = np.arange(self.N_ESTIMATORS)[np.newaxis, :]
+		paths = np.zeros((self.MAX_DEPTH + 1, len(features), self.N_ESTIMATORS), dtype = np.int64)
+		for depth in range(0, self.MAX_DEPTH):
+			nodes = paths[depth]
+			go_left = features[samples, self.split_features[trees, nodes]] < self.split_values[trees, nodes]
+			paths[depth + 1] = 2 * nodes + np.where(go_left, 1, 2)
+		return paths
+
+	def count_mass(self, features):
+		mass = np.zeros((self.N_ESTIMATORS, 2 ** (self.MAX_DEPTH + 1) - 1))
+		chunk_size = self.CHUNK_SIZE if self.CHUNK_SIZE > 0 else max(len(features), 1)
+		for start in range(0, len(features), chunk_size):
+			paths = self.get_paths(features[start:start + chunk_size])
+			trees = np.broadcast_to(np.arange(self.N_ESTIMATORS), paths.shape)
+			mass += np.bincount((trees * mass.shape[1] + paths).ravel(), minlength = mass.size).reshape(mass.shape)
+		return mass
+
+	def fit_model(self, features):
+		self.minimums = features.min(axis = 0)
+		ranges = features.max(axis = 0) - self.minimums
+		self.ranges = np.where(ranges > 0, ranges, 1.0)
+		self.build_trees(features.shape[1])
+
+		self.reference_mass = self.count_mass(features)
+		self.reference_size = len(features)
+		self.latest_mass = np.zeros_like(self.reference_mass)
+		self.latest_size = 0
+		self.window_size = self.WINDOW_SIZE if self.WINDOW_SIZE > 0 else len(features)
+
+	def score_chunk(self, features):
+		paths = self.get_paths(features)
+		masses = self.reference_mass[np.arange(self.N_ESTIMATORS)[np.newaxis, np.newaxis, :], paths]
+
+		# Every tree stops at the first node with too little mass to tell more, the mass there is scaled up by its depth
+		is_small = masses <= self.SIZE_LIMIT * self.reference_size
+		stop_depths = np.where(is_small.any(axis = 0), is_small.argmax(axis = 0), self.MAX_DEPTH)
+		stop_masses = np.take_along_axis(masses, stop_depths[np.newaxis], axis = 0)[0]
+		return (stop_masses * 2.0 ** stop_depths).sum(axis = 1) / (self.N_ESTIMATORS * max(self.reference_size, 1))
+
+	def update(self, sample):
+		paths = self.get_paths(np.asarray(sample, dtype = np.float64)[np.newaxis, :])[:, 0, :]
+		self.latest_mass[np.arange(self.N_ESTIMATORS)[np.newaxis, :], paths] += 1
+		self.latest_size += 1
+		if self.latest_size >= self.window_size:
+			self.reference_mass, self.reference_size = self.latest_mass, self.latest_size
+			self.latest_mass, self.latest_size = np.zeros_like(self.reference_mass), 0
+
+class RobustZScoreDetector(AnomalyDetector):
+	"""
+	Distance of every feature from its median in median absolute deviations. The score is the root mean square of the robust z-scores.
+	"""
+	def fit_model(self, features):
+		self.medians = np.median(features, axis = 0)
+		scales = 1.4826 * np.median(np.abs(features - self.medians), axis = 0)
+
+		# Features that are mostly one value fall back to their standard deviation
+		standard_deviations = features.std(axis = 0)
+		scales = np.where(scales > 0, scales, standard_deviations)
+		self.scales = np.where(scales > 0, scales, 1.0)
+
+	def score_chunk(self, features):
+		return -np.sqrt(np.mean(((features - self.medians) / self.scales) ** 2, axis = 1))
+
+class MahalanobisDetector(AnomalyDetector):
+	"""
+	Mahalanobis distance from the mean of the features. The covariance is shrunk towards its diagonal, so correlated or constant features
+	do not make it singular.
+	"""
+	def __init__(self, shrinkage = 0.1, chunk_size = 0, contamination = 0.1):
+		super().__init__(chunk_size, contamination)
+		self.SHRINKAGE = shrinkage
+
+	def fit_model(self, features):
+		self.means = features.mean(axis = 0)
+		covariance = np.atleast_2d(np.cov(features, rowvar = False))
+		covariance = (1 - self.SHRINKAGE) * covariance + self.SHRINKAGE * np.diag(np.diag(covariance))
+		self.precision = np.linalg.pinv(covariance)
+
+	def score_chunk(self, features):
+		centered = features - self.means
+		return -np.sqrt(np.maximum(np.einsum("ij,jk,ik->i", centered, self.precision, centered), 0))
+
+# Detector backends by the name used on the command line
+DETECTORS = {
+	"isolation_forest": IsolationForestDetector,
+	"half_space_trees": HalfSpaceTreesDetector,
+	"robust_zscore": RobustZScoreDetector,
+	"mahalanobis": MahalanobisDetector
+}
+
+def create_anomaly_detector(name, **parameters):
+	return DETECTORS[name](**parameters)
+
+def load_detector(model_path):
+	"""
+	Load a saved detector. Models that were saved as a plain IsolationForest are wrapped.
+	"""
+	detector = joblib.load(model_path)
+	if isinstance(detector, IsolationForest):
+		detector = IsolationForestDetector.from_model(detector)
+	return detector
@@ -1,98 +1,295 @@
 # Basic libraries
-import os
-import ta
-import sys
-import json
-import math
-import pickle
-import random
-import requests
-import matplotlib
 import collections
+import hashlib
+import multiprocessing
+import threading
 import numpy as np
-from os import walk
 import pandas as pd
-import yfinance as yf
-import datetime as dt
-from scipy.stats import linregress
-from datetime import datetime, timedelta
+from scipy.special import stdtr
 import warnings
 warnings.filterwarnings("ignore")
 
+# Columns shipped to the feature workers. Prices travel as a compact float64 array instead of a pickled data frame.
+PRICE_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+# Every technical indicator the engines can compute, in the order they appear in the technical indicators dictionary
+INDICATOR_KEYS = ["rsi-5", "rsi-10", "rsi-15", "stochs-5", "stochs-10", "stochs-15", "acc_dist", "eom-5", "eom-10", "eom-20", "cci-5", "cci-10", "cci-20", "volume_returns", "daily_log_return"]
+
+# Indicators used by get_features. An indicator is used if any of these is part of its key.
+FEATURE_KEYS = ["volume_returns", "daily_log_return", "eom"]
+
+# Indicators whose last HISTORY_TO_USE values only need the bars that get_feature_window keeps. The others look further back or are exponential averages.
+WINDOWED_INDICATORS = ["volume_returns", "daily_log_return", "eom"]
+
+class IndicatorCache:
+	"""
+	Least recently used cache of the full indicator series of a symbol. Entries are keyed by a fingerprint of the prices, so any new or changed bar is a new entry.
+	An entry only holds the indicators that were asked for so far, others are added to it when an engine with a different feature set needs them.
+	"""
+	def __init__(self, max_symbols):
+		self.MAX_SYMBOLS = max_symbols
+		self.entries = collections.OrderedDict()
+		self.lock = threading.Lock()
+
+	def get(self, fingerprint):
+		with self.lock:
+			indicator_series = self.entries.get(fingerprint)
+			if indicator_series is not None:
+				self.entries.move_to_end(fingerprint)
+			return indicator_series
+
+	def put(self, fingerprint, indicator_series):
+		with self.lock:
+			self.entries[fingerprint] = indicator_series
+			self.entries.move_to_end(fingerprint)
+			self.evict()
+
+	def resize(self, max_symbols):
+		with self.lock:
+			self.MAX_SYMBOLS = max_symbols
+			self.evict()
+
+	def evict(self):
+		while len(self.entries) > self.MAX_SYMBOLS:
+			self.entries.popitem(last = False)
+
+# Indicator series of recently seen prices, shared by every engine in this process so engines with different histories or feature sets reuse them
+SHARED_INDICATOR_CACHE = IndicatorCache(max_symbols = 1024)
+
+# Technical indicator engine used inside each worker process of the feature pool
+worker_engine = None
+
+def initialize_feature_worker(history_to_use, series_only = False, feature_keys = None):
+	global worker_engine
+	worker_engine = TAEngine(history_to_use = history_to_use, verbose = False, series_only = series_only, feature_keys = feature_keys)
+
+def compute_indicators_in_worker(price_array):
+	"""
+	Compute technical indicators for a (bars x OHLCV) array inside a worker process
+	"""
+	return worker_engine.get_technical_indicators_safely(pd.DataFrame(price_array, columns = PRICE_COLUMNS))
+
 class TAEngine:
-	def __init__(self, history_to_use):
-		print("Technical Indicator Engine has been initialized")
+	def __init__(self, history_to_use, feature_workers = 1, verbose = True, series_only = False, feature_keys = None, indicator_cache = None):
+		if verbose:
+			print("Technical Indicator Engine has been initialized")
 		self.HISTORY_TO_USE = history_to_use
+		self.FEATURE_WORKERS = max(1, feature_workers)
+
+		# Only return the last HISTORY_TO_USE values of every indicator, without slope statistics. Dictionaries for any shorter history can be built from them with get_technical_indicators_from_series.
+		self.IS_SERIES_ONLY = series_only
+		self.pool = None
+
+		# Only the indicators that get_features uses are computed
+		self.FEATURE_KEYS = list(feature_keys) if feature_keys is not None else FEATURE_KEYS
+		self.INDICATOR_KEYS = [key for key in INDICATOR_KEYS if any(feature_key in key for feature_key in self.FEATURE_KEYS)]
+		self.indicator_cache = indicator_cache if indicator_cache is not None else SHARED_INDICATOR_CACHE
+
+		# Centered x axis and its sum of squares for every window length used in calculate_slopes
+		self.x_axis_statistics = {}
+
+	def open_pool(self):
+		"""
+		Start the worker processes used for feature generation. Call this before starting any threads, the workers are forked from the current process.
+		"""
+		if self.FEATURE_WORKERS > 1 and self.pool is None:
+			self.pool = multiprocessing.Pool(self.FEATURE_WORKERS, initializer = initialize_feature_worker, initargs = (self.HISTORY_TO_USE, self.IS_SERIES_ONLY, self.FEATURE_KEYS))
+
+	def close_pool(self):
+		if self.pool is not None:
+			self.pool.close()
+			self.pool.join()
+			self.pool = None
 
 	def calculate_slope(self, data):
 		"""
 		Calculate slope, p value, and r^2 value given some data
 		"""
-		x_axis = np.arange(len(data))
-		regression_model = linregress(x_axis, data)
-		slope, r_value, p_value = round(regression_model.slope, 3), round(abs(regression_model.rvalue), 3), round(regression_model.pvalue, 4)
-		return slope, r_value, p_value
+		slopes, r_values, p_values = self.calculate_slopes([data])
+		return slopes[0], r_values[0], p_values[0]
+
+	def calculate_slopes(self, windows):
+		"""
+		Calculate slope, r value and p value for every row of a 2-D array of windows at once, with the same rounding as calculate_slope.
+		The x axis is always 0..length-1 so its statistics are computed once per length instead of once per call to linregress.
+		"""
+		windows = np.asarray(windows, dtype = np.float64)
+		length = windows.shape[1]
+		if length == 0:
+			raise ValueError("Can not calculate a slope without any values")
+
+		if length not in self.x_axis_statistics:
+			x_axis_centered = np.arange(length, dtype = np.float64) - (length - 1) / 2.0
+			self.x_axis_statistics[length] = (x_axis_centered, np.dot(x_axis_centered, x_axis_centered))
+		x_axis_centered, ssxm = self.x_axis_statistics[length]
+
+		windows_centered = windows - windows.mean(axis = 1, keepdims = True)
+		ssxym = windows_centered.dot(x_axis_centered)
+		ssym = np.einsum("ij,ij->i", windows_centered, windows_centered)
+
+		# Same as linregress in scipy 1.5: r is 0 for flat windows and the p value comes from a two sided t test
+		with np.errstate(divide = "ignore", invalid = "ignore"):
+			r_denominator = np.sqrt(ssxm * ssym)
+			r_values = np.where(r_denominator == 0, 0.0, ssxym / r_denominator).clip(-1.0, 1.0)
+			slopes = ssxym / ssxm
+			if length == 2:
+				p_values = np.where(windows[:, 0] == windows[:, 1], 1.0, 0.0)
+			else:
+				degrees_of_freedom = length - 2
+				t_statistic = r_values * np.sqrt(degrees_of_freedom / ((1.0 - r_values + 1.0e-20) * (1.0 + r_values + 1.0e-20)))
+				p_values = 2 * stdtr(degrees_of_freedom, -np.abs(t_statistic))
+
+		slopes = [round(value, 3) for value in slopes.tolist()]
+		r_values = [round(abs(value), 3) for value in r_values.tolist()]
+		p_values = [round(value, 4) for value in p_values.tolist()]
+		return slopes, r_values, p_values
+
+	def calculate_slopes_for_series(self, series_dictionary):
+		"""
+		Calculate slope statistics for a dictionary of series. Series of the same length are stacked and regressed together.
+		"""
+		keys_by_length = collections.defaultdict(list)
+		for key in series_dictionary:
+			keys_by_length[len(series_dictionary[key])].append(key)
+
+		slope_statistics = {}
+		for length in keys_by_length:
+			keys = keys_by_length[length]
+			slopes, r_values, p_values = self.calculate_slopes([series_dictionary[key] for key in keys])
+			for i, key in enumerate(keys):
+				slope_statistics[key] = [slopes[i], r_values[i], p_values[i]]
+		return slope_statistics
+
+	def get_price_fingerprint(self, price_data):
+		"""
+		Digest of the 'Open', 'High', 'Low', 'Close', 'Volume' values. Prices with the same fingerprint have the same indicators.
+		"""
+		price_values = np.ascontiguousarray(price_data[PRICE_COLUMNS].values, dtype = np.float64)
+		return hashlib.blake2b(price_values.tobytes(), digest_size = 20).digest()
+
+	def compute_indicator_series(self, price_data, keys):
+		"""
+		Full series of the given technical indicators for a pandas data frame with columns -> 'Open', 'High', 'Low', 'Close', 'Volume'
+		"""
+		# The ta library is only needed when indicators are computed, not for runs that load them from a dictionary
+		import ta
+
+		indicator_series = {}
+		for key in keys:
+			name, _, history = key.partition("-")
+			history = int(history) if history != "" else None
+			if name == "rsi":
+				series = ta.momentum.RSIIndicator(price_data['Close'], n = history, fillna = True).rsi()
+			elif name == "stochs":
+				series = ta.momentum.StochasticOscillator(price_data['High'], price_data['Low'], price_data['Close'], n = history, d_n = int(history/3), fillna = True).stoch()
+			elif name == "acc_dist":
+				series = ta.volume.acc_dist_index(price_data['High'], price_data['Low'], price_data['Close'], price_data['Volume'], fillna=True)
+			elif name == "eom":
+				series = ta.volume.ease_of_movement(price_data['High'], price_data['Low'], price_data['Volume'], n=history, fillna=True)
+			elif name == "cci":
+				series = ta.trend.cci(price_data['High'], price_data['Low'], price_data['Close'], n=history, c=0.015, fillna=True)
+			elif name == "volume_returns":
+				# Volume difference
+				volume = np.asarray(price_data['Volume'].values, dtype = np.float64)
+				volume = volume[volume != 0]
+				series = volume[1:] / volume[:-1]
+			elif name == "daily_log_return":
+				series = ta.others.daily_log_return(price_data['Close'], fillna=True)
+			else:
+				raise ValueError("Unknown technical indicator %s" % key)
+			indicator_series[key] = np.asarray(series, dtype = np.float64)
+		return indicator_series
+
+	def get_indicator_series(self, price_data):
+		"""
+		Full series of the indicators this engine uses. Series of prices that were seen recently come from the indicator cache and only the missing indicators are computed.
+		"""
+		fingerprint = self.get_price_fingerprint(price_data) if self.indicator_cache.MAX_SYMBOLS > 0 else None
+		indicator_series = self.indicator_cache.get(fingerprint) if fingerprint is not None else None
+		if indicator_series is None:
+			indicator_series = {}
+
+		missing_keys = [key for key in self.INDICATOR_KEYS if key not in indicator_series]
+		if len(missing_keys) > 0:
+			indicator_series = {**indicator_series, **self.compute_indicator_series(price_data, missing_keys)}
+			if fingerprint is not None:
+				self.indicator_cache.put(fingerprint, indicator_series)
+		return indicator_series
 
 	def get_technical_indicators(self, price_data):
 		"""
 		Given a pandas data frame with columns -> 'Open', 'High', 'Low', 'Close', 'Volume', extract different technical indicators and returns 
 		"""
+		# Last values of every indicator. Their slopes are calculated together at the end.
+		indicator_series = self.get_indicator_series(price_data)
+		indicator_history = collections.OrderedDict((key, indicator_series[key][-self.HISTORY_TO_USE:].tolist()) for key in self.INDICATOR_KEYS)
+
+		if self.IS_SERIES_ONLY:
+			return indicator_history
+		return self.get_technical_indicators_from_series(indicator_history, self.HISTORY_TO_USE)
+
+	def get_technical_indicators_from_series(self, indicator_history, history_to_use):
+		"""
+		Build the technical indicators dictionary from the last values of every indicator. Only the last history_to_use values are used, so series
+		from an engine with a longer history give the same dictionary as an engine with history_to_use.
+		"""
 		technical_indicators_dictionary = {}
+		indicator_history = collections.OrderedDict((key, indicator_history[key][-history_to_use:]) for key in indicator_history)
 
-		# RSI
-		rsi_history = [5, 10, 15]
-		for history in rsi_history:
-			rsi = ta.momentum.RSIIndicator(price_data['Close'], n = history, fillna = True).rsi().values.tolist()
-			slope_rsi, r_value_rsi, p_value_rsi = self.calculate_slope(rsi[-self.HISTORY_TO_USE:])
-			technical_indicators_dictionary["rsi-" + str(history)] = rsi[-self.HISTORY_TO_USE:] + [slope_rsi, r_value_rsi, p_value_rsi]
-
-		# Stochastics
-		stochastic_history = [5, 10, 15]
-		for history in stochastic_history:
-			stochs = ta.momentum.StochasticOscillator(price_data['High'], price_data['Low'], price_data['Close'], n = history, d_n = int(history/3), fillna = True).stoch().values.tolist()
-			slope_stoch, r_value_stoch, p_value_stoch = self.calculate_slope(stochs[-self.HISTORY_TO_USE:])
-			technical_indicators_dictionary["stochs-" + str(history)] = stochs[-self.HISTORY_TO_USE:] + [slope_stoch, r_value_stoch, p_value_stoch]
-
-		# Accumulation Distribution
-		acc_dist = ta.volume.acc_dist_index(price_data['High'], price_data['Low'], price_data['Close'], price_data['Volume'], fillna=True).values.tolist()
-		acc_dist = acc_dist[-self.HISTORY_TO_USE:]
-		slope_acc_dist, r_value_acc_dist, p_value_acc_dist = self.calculate_slope(acc_dist)
-		technical_indicators_dictionary["acc_dist"] = [slope_acc_dist, r_value_acc_dist, p_value_acc_dist]
-
-		# Ease of movement
-		eom_history = [5, 10, 20]
-		for history in eom_history:
-			eom = ta.volume.ease_of_movement(price_data['High'], price_data['Low'], price_data['Volume'], n=history, fillna=True).values.tolist()
-			slope_eom, r_value_eom, p_value_eom = self.calculate_slope(eom[-self.HISTORY_TO_USE:])
-			technical_indicators_dictionary["eom-" + str(history)] = [slope_eom, r_value_eom, p_value_eom]
-
-		# CCI
-		cci_history = [5, 10, 20]
-		for history in cci_history:
-			cci = ta.trend.cci(price_data['High'], price_data['Low'], price_data['Close'], n=history, c=0.015, fillna=True).values.tolist()
-			slope_cci, r_value_cci, p_value_cci = self.calculate_slope(cci[-self.HISTORY_TO_USE:])
-			technical_indicators_dictionary["cci-" + str(history)] = cci[-self.HISTORY_TO_USE:] + [slope_cci, r_value_cci, p_value_cci]
-
-		# Daily log return
-		daily_return = ta.others.daily_return(price_data['Close'], fillna=True).values.tolist()
-		daily_log_return = ta.others.daily_log_return(price_data['Close'], fillna=True).values.tolist()
-		technical_indicators_dictionary["daily_log_return"] = daily_log_return[-self.HISTORY_TO_USE:] 
-		
-		# Volume difference
-		volume_list = price_data['Volume'].values.tolist()
-		volume_list = [vol for vol in volume_list if vol != 0]
-		volume_returns = [volume_list[x] / volume_list[x - 1] for x in range(1, len(volume_list))]
-		slope_vol, r_value_vol, p_value_vol = self.calculate_slope(volume_returns[-self.HISTORY_TO_USE:])
-		technical_indicators_dictionary["volume_returns"] = volume_returns[-self.HISTORY_TO_USE:] + [slope_vol, r_value_vol, p_value_vol]
+		# Slope, r value and p value of every indicator. Only the slope statistics are kept for accumulation distribution and ease of movement.
+		slope_statistics = self.calculate_slopes_for_series({key: indicator_history[key] for key in indicator_history if key != "daily_log_return"})
+		for key in indicator_history:
+			if key == "daily_log_return":
+				technical_indicators_dictionary[key] = indicator_history[key]
+			elif key == "acc_dist" or key.startswith("eom-"):
+				technical_indicators_dictionary[key] = slope_statistics[key]
+			else:
+				technical_indicators_dictionary[key] = indicator_history[key] + slope_statistics[key]
 
 		return technical_indicators_dictionary
 
+	def get_technical_indicators_for_all(self, price_data_list):
+		"""
+		Compute technical indicators for many symbols. Returns a list of (indicators, error) in the same order as price_data_list.
+		The work is spread over the feature pool if it is open, otherwise it runs in this process.
+		"""
+		if self.pool is None:
+			return [self.get_technical_indicators_safely(price_data) for price_data in price_data_list]
+
+		price_arrays = [np.ascontiguousarray(price_data[PRICE_COLUMNS].values, dtype = np.float64) for price_data in price_data_list]
+		chunk_size = max(1, int(len(price_arrays) / (self.FEATURE_WORKERS * 4)))
+		return list(self.pool.imap(compute_indicators_in_worker, price_arrays, chunksize = chunk_size))
+
+	def get_technical_indicators_safely(self, price_data):
+		"""
+		Same as get_technical_indicators but returns (indicators, error) instead of raising, so one bad symbol does not stop a whole batch
+		"""
+		try:
+			return self.get_technical_indicators(price_data), None
+		except Exception as e:
+			return None, e
+
+	def get_feature_window(self, prices):
+		"""
+		The default features only look at the last HISTORY_TO_USE + 1 bars and the last HISTORY_TO_USE + 1 non zero volumes, so the indicators can be computed
+		on just those bars instead of the whole history. Ease of movement of a bar without volume is filled from the bar with volume before it,
+		which needs one more bar for its own difference. Indicators like rsi, stochs, cci and acc_dist need the whole history.
+		"""
+		if any(key.partition("-")[0] not in WINDOWED_INDICATORS for key in self.INDICATOR_KEYS):
+			return prices
+
+		window = self.HISTORY_TO_USE + 1
+		nonzero_positions = np.flatnonzero(prices["Volume"].values != 0)
+		if len(nonzero_positions) < window:
+			return prices
+		return prices.iloc[max(0, min(len(prices) - window, nonzero_positions[-window] - 1)):]
+
 	def get_features(self, features_dictionary):
 		"""
-		Extract features from the data dictionary. The data dictionary contains values for multiple TAs such as cci, rsi, stocks etc. But here, we will only use the price returns, volume returns, and eom values.
+		Extract features from the data dictionary. The data dictionary can contain values for multiple TAs such as cci, rsi, stocks etc. But by default, we will only use the price returns, volume returns, and eom values.
 		"""
 
-		keys_to_use = ["volume_returns", "daily_log_return", "eom"]
+		keys_to_use = self.FEATURE_KEYS
 		all_keys = list(sorted(features_dictionary.keys()))
 		feature_list = []
 		for key in all_keys:
@@ -103,7 +300,7 @@ class TAEngine:
 				# Add values for the key
 				feature_list.extend(features_dictionary[key])
 			else:
-				# TAs such as CCI, RSI, STOCHS are being ignored. You can add another condition above to use them
+				# TAs such as CCI, RSI, STOCHS are being ignored. You can add them to feature_keys to use them
 				_ = None
 			
 		return feature_list
\ No newline at end of file
@@ -0,0 +1,131 @@
+# Basic libraries
+import numpy as np
+import pandas as pd
+
+PRICE_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+def get_epoch_minutes(datetimes):
+	"""
+	Minutes since the epoch of a Datetime column. Timestamps with a time zone are converted to UTC, numbers are epoch milliseconds like binance klines.
+	"""
+	values = datetimes.values
+	if np.issubdtype(values.dtype, np.number):
+		return np.floor_divide(values.astype(np.float64), 60000).astype(np.int64)
+	if not np.issubdtype(values.dtype, np.datetime64):
+		values = pd.to_datetime(datetimes, utc = True).values
+	return values.astype("datetime64[m]").astype(np.int64)
+
+def resample_price_values(stock_prices, granularity_minutes):
+	"""
+	Aggregate bars into bars of granularity_minutes. Bars are grouped by the interval since the epoch they start in, like pandas resample, and every
+	group becomes one bar with the first open, highest high, lowest low, last close and total volume.
+	Returns the (bars x 5) 'Open', 'High', 'Low', 'Close', 'Volume' values of the resampled bars and the position of the first bar of every group.
+	"""
+	buckets = get_epoch_minutes(stock_prices["Datetime"]) // granularity_minutes
+	bar_starts = np.flatnonzero(np.concatenate([[True], buckets[1:] != buckets[:-1]]))
+	bar_ends = np.append(bar_starts[1:], len(buckets)) - 1
+
+	# Columns are read one by one, selecting all of them at once is slow for frames with several blocks
+	open_prices, high_prices, low_prices, close_prices, volumes = [np.asarray(stock_prices[column].values, dtype = np.float64) for column in PRICE_COLUMNS]
+	resampled_values = np.column_stack([open_prices[bar_starts], np.maximum.reduceat(high_prices, bar_starts), np.minimum.reduceat(low_prices, bar_starts),
+										close_prices[bar_ends], np.add.reduceat(volumes, bar_starts)])
+	return resampled_values, bar_starts
+
+def resample_prices(stock_prices, granularity_minutes):
+	"""
+	Same as resample_price_values, but returns a data frame of the resampled bars. Every bar keeps the time of its first bar.
+	"""
+	resampled_values, bar_starts = resample_price_values(stock_prices, granularity_minutes)
+	resampled_prices = pd.DataFrame(resampled_values, columns = PRICE_COLUMNS, copy = False)
+	resampled_prices.insert(0, 'Datetime', stock_prices["Datetime"].array[bar_starts])
+	return resampled_prices, bar_starts
+
+class MultiGranularityTAEngine:
+	"""
+	Wraps an indicator engine so the features of one download cover several granularities. The bars are resampled in memory to every granularity in
+	granularities, the wrapped engine computes its technical indicators for the bars and for every resampled version, and all of them are merged into
+	one dictionary. Indicators of a resampled granularity are stored with the prefix "<minutes>m_", so get_features concatenates the features of all
+	granularities into one vector.
+	"""
+	def __init__(self, engine, granularities):
+		self.engine = engine
+		self.GRANULARITIES = list(granularities)
+		self.HISTORY_TO_USE = engine.HISTORY_TO_USE
+		self.FEATURE_KEYS = engine.FEATURE_KEYS
+		self.INDICATOR_KEYS = list(engine.INDICATOR_KEYS) + [self.get_prefix(granularity) + key for granularity in self.GRANULARITIES for key in engine.INDICATOR_KEYS]
+		self.indicator_cache = engine.indicator_cache
+
+	def get_prefix(self, granularity):
+		return "%dm_" % granularity
+
+	def get_resampled_prices(self, price_data, granularity):
+		"""
+		Resampled bars for the indicators, which only need 'Open', 'High', 'Low', 'Close', 'Volume'
+		"""
+		resampled_values, bar_starts = resample_price_values(price_data, granularity)
+		return pd.DataFrame(resampled_values, columns = PRICE_COLUMNS, copy = False), bar_starts
+
+	def open_pool(self):
+		self.engine.open_pool()
+
+	def close_pool(self):
+		self.engine.close_pool()
+
+	def merge_indicators(self, all_indicators):
+		"""
+		Merge the indicator dictionaries of the bars and of every granularity, in that order, into one dictionary
+		"""
+		merged_indicators = dict(all_indicators[0])
+		for granularity, indicators in zip(self.GRANULARITIES, all_indicators[1:]):
+			prefix = self.get_prefix(granularity)
+			merged_indicators.update((prefix + key, values) for key, values in indicators.items())
+		return merged_indicators
+
+	def split_indicators(self, merged_indicators):
+		"""
+		Inverse of merge_indicators
+		"""
+		prefixes = [self.get_prefix(granularity) for granularity in self.GRANULARITIES]
+		all_indicators = [{key: values for key, values in merged_indicators.items() if not any(key.startswith(prefix) for prefix in prefixes)}]
+		for prefix in prefixes:
+			all_indicators.append({key[len(prefix):]: values for key, values in merged_indicators.items() if key.startswith(prefix)})
+		return all_indicators
+
+	def get_technical_indicators(self, price_data):
+		all_prices = [price_data] + [self.get_resampled_prices(price_data, granularity)[0] for granularity in self.GRANULARITIES]
+		return self.merge_indicators([self.engine.get_technical_indicators(prices) for prices in all_prices])
+
+	def get_technical_indicators_for_all(self, price_data_list):
+		"""
+		Same as the wrapped engine. Every granularity is one call of the wrapped engine for all symbols, so a vectorized engine still gets whole matrices.
+		"""
+		all_results = [self.engine.get_technical_indicators_for_all(price_data_list)]
+		for granularity in self.GRANULARITIES:
+			all_results.append(self.engine.get_technical_indicators_for_all([self.get_resampled_prices(price_data, granularity)[0] for price_data in price_data_list]))
+
+		results = []
+		for symbol_results in zip(*all_results):
+			errors = [error for _, error in symbol_results if error is not None]
+			if len(errors) > 0:
+				results.append((None, errors[0]))
+			else:
+				results.append((self.merge_indicators([indicators for indicators, _ in symbol_results]), None))
+		return results
+
+	def get_technical_indicators_from_series(self, indicator_history, history_to_use):
+		return self.merge_indicators([self.engine.get_technical_indicators_from_series(series, history_to_use) for series in self.split_indicators(indicator_history)])
+
+	def get_feature_window(self, prices):
+		"""
+		Bars the features of every granularity need. A resampled granularity needs the window of the wrapped engine in resampled bars, and it starts
+		at the first bar of a group so that group is resampled the same way as with the whole history.
+		"""
+		window_start = len(prices) - len(self.engine.get_feature_window(prices))
+		for granularity in self.GRANULARITIES:
+			resampled_prices, bar_starts = self.get_resampled_prices(prices, granularity)
+			resampled_window_start = len(resampled_prices) - len(self.engine.get_feature_window(resampled_prices))
+			window_start = min(window_start, bar_starts[resampled_window_start])
+		return prices.iloc[window_start:]
+
+	def get_features(self, features_dictionary):
+		return self.engine.get_features(features_dictionary)
@@ -0,0 +1,133 @@
+# Basic libraries
+import json
+import time
+import threading
+import contextlib
+import collections
+import numpy as np
+
+class ScanMetrics:
+	"""
+	Stage timings, per symbol latencies, counters and dropped symbols of a run. Stages can be nested, the time of a stage does not include the
+	stages inside it, so the stage times add up to the time that was measured. Safe to update from the download threads.
+	"""
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.start_time = time.perf_counter()
+		self.stage_seconds = collections.OrderedDict()
+		self.stage_calls = collections.Counter()
+		self.symbol_latencies = collections.OrderedDict()
+		self.counters = collections.OrderedDict()
+
+		# Symbol -> (reason, detail). Only the first reason a symbol was dropped for is kept.
+		self.dropped_symbols = collections.OrderedDict()
+
+		# Stages that are running in every thread, innermost last, with the time spent in the stages inside them
+		self.running_stages = threading.local()
+
+	@contextlib.contextmanager
+	def stage(self, name):
+		if not hasattr(self.running_stages, "stack"):
+			self.running_stages.stack = []
+		self.running_stages.stack.append(0.0)
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			elapsed = time.perf_counter() - start
+			inner_seconds = self.running_stages.stack.pop()
+			if len(self.running_stages.stack) > 0:
+				self.running_stages.stack[-1] += elapsed
+			self.add_stage_time(name, elapsed - inner_seconds)
+
+	def add_stage_time(self, name, seconds):
+		with self.lock:
+			self.stage_seconds[name] = self.stage_seconds.get(name, 0.0) + seconds
+			self.stage_calls[name] += 1
+
+	def time_iterator(self, name, iterator):
+		"""
+		Yield the items of iterator and count the time spent waiting for them as stage name
+		"""
+		iterator = iter(iterator)
+		while True:
+			with self.stage(name):
+				try:
+					item = next(iterator)
+				except StopIteration:
+					return
+			yield item
+
+	def add_symbol_latency(self, name, seconds, number_of_symbols = 1):
+		"""
+		Record how long stage name took per symbol. Work that was done for several symbols at once is split evenly over them.
+		"""
+		if number_of_symbols < 1:
+			return
+		with self.lock:
+			self.symbol_latencies.setdefault(name, []).extend([seconds / number_of_symbols] * number_of_symbols)
+
+	def increment(self, name, value = 1):
+		with self.lock:
+			self.counters[name] = self.counters.get(name, 0) + value
+
+	def drop_symbol(self, symbol, reason, detail = None):
+		with self.lock:
+			if symbol not in self.dropped_symbols:
+				self.dropped_symbols[symbol] = (reason, None if detail is None else str(detail))
+
+	def get_drop_reason(self, symbol):
+		"""
+		(reason, detail) of a dropped symbol, or None if it was not dropped
+		"""
+		with self.lock:
+			return self.dropped_symbols.get(symbol)
+
+	def get_summary(self):
+		with self.lock:
+			latencies = {}
+			for name in self.symbol_latencies:
+				values = np.array(self.symbol_latencies[name])
+				latencies[name] = {"count": len(values), "mean": float(values.mean()), "p50": float(np.percentile(values, 50)),
+								"p90": float(np.percentile(values, 90)), "p99": float(np.percentile(values, 99)), "max": float(values.max())}
+
+			return {
+				"total_seconds": time.perf_counter() - self.start_time,
+				"stages": {name: {"seconds": self.stage_seconds[name], "calls": self.stage_calls[name]} for name in self.stage_seconds},
+				"symbol_latency_seconds": latencies,
+				"counters": dict(self.counters),
+				"dropped_by_reason": dict(collections.Counter(reason for reason, _ in self.dropped_symbols.values())),
+				"dropped_symbols": [{"symbol": symbol, "reason": reason, "detail": detail} for symbol, (reason, detail) in self.dropped_symbols.items()]
+			}
+
+	def get_prometheus_text(self):
+		"""
+		Summary in the Prometheus text exposition format. Dropped symbols are only counted by reason.
+		"""
+		summary = self.get_summary()
+		lines = ["# HELP surpriver_run_seconds Wall time of the run.", "# TYPE surpriver_run_seconds gauge",
+				"surpriver_run_seconds %.6f" % summary["total_seconds"],
+				"# HELP surpriver_stage_seconds Time spent in every stage, without the stages inside it.", "# TYPE surpriver_stage_seconds gauge"]
+		lines += ['surpriver_stage_seconds{stage="%s"} %.6f' % (name, stage["seconds"]) for name, stage in summary["stages"].items()]
+		lines += ["# HELP surpriver_symbol_latency_seconds Time per symbol of every stage.", "# TYPE surpriver_symbol_latency_seconds summary"]
+		for name, latency in summary["symbol_latency_seconds"].items():
+			for quantile, key in [("0.5", "p50"), ("0.9", "p90"), ("0.99", "p99")]:
+				lines.append('surpriver_symbol_latency_seconds{stage="%s",quantile="%s"} %.6f' % (name, quantile, latency[key]))
+			lines.append('surpriver_symbol_latency_seconds_sum{stage="%s"} %.6f' % (name, latency["mean"] * latency["count"]))
+			lines.append('surpriver_symbol_latency_seconds_count{stage="%s"} %d' % (name, latency["count"]))
+		lines += ["# HELP surpriver_count Symbols and events counted during the run.", "# TYPE surpriver_count gauge"]
+		lines += ['surpriver_count{name="%s"} %d' % (name, value) for name, value in summary["counters"].items()]
+		lines += ["# HELP surpriver_dropped_symbols Number of symbols that were dropped, by reason.", "# TYPE surpriver_dropped_symbols gauge"]
+		lines += ['surpriver_dropped_symbols{reason="%s"} %d' % (reason, count) for reason, count in summary["dropped_by_reason"].items()]
+		return "\n".join(lines) + "\n"
+
+	def save(self, metrics_path):
+		"""
+		Write the metrics as Prometheus text if the path ends with .prom or .txt, otherwise as JSON
+		"""
+		with open(metrics_path, "w") as metrics_file:
+			if metrics_path.endswith(".prom") or metrics_path.endswith(".txt"):
+				metrics_file.write(self.get_prometheus_text())
+			else:
+				json.dump(self.get_summary(), metrics_file, indent = 1)
+		print("Metrics stored successfully in", metrics_path)
@@ -0,0 +1,107 @@
+# Basic libraries
+import itertools
+import multiprocessing
+import numpy as np
+from detectors import create_anomaly_detector
+from symbol_arrays import FeatureMatrix
+from prefilters import count_bad_close_prices, get_volatility, get_average_volume
+import warnings
+warnings.filterwarnings("ignore")
+
+# Sweep used inside each worker process of the configuration pool
+worker_sweep = None
+
+def initialize_sweep_worker(sweep):
+	global worker_sweep
+	worker_sweep = sweep
+
+def score_configuration_in_worker(configuration):
+	return worker_sweep.score_configuration(configuration)
+
+class ParameterSweep:
+	"""
+	Grid search over history_to_use, data_granularity_minutes, min_volume and volatility_filter on one held out test split.
+	Prices are gathered once per granularity and the indicator series once per granularity with the longest history. The feature windows of
+	shorter histories are tail slices of those series, so every history only rebuilds the slope statistics and the feature lists.
+	"""
+	def __init__(self, histories, granularities, min_volumes, volatility_filters, detector = "isolation_forest", detector_parameters = None, workers = 1):
+		self.HISTORIES = sorted(set(histories))
+		self.GRANULARITIES = sorted(set(granularities))
+		self.MIN_VOLUMES = sorted(set(min_volumes))
+		self.VOLATILITY_FILTERS = sorted(set(volatility_filters))
+		self.DETECTOR = detector
+		self.DETECTOR_PARAMETERS = detector_parameters if detector_parameters is not None else {}
+		self.WORKERS = workers
+
+		# Prices, filter values and feature lists of every symbol, by granularity
+		self.symbol_data = {}
+
+	def get_configurations(self):
+		return [{"data_granularity_minutes": granularity, "history_to_use": history, "min_volume": min_volume, "volatility_filter": volatility_filter}
+				for granularity, history, min_volume, volatility_filter in itertools.product(self.GRANULARITIES, self.HISTORIES, self.MIN_VOLUMES, self.VOLATILITY_FILTERS)]
+
+	def add_prices(self, granularity, data_engine, symbol_names, historical_price_info, future_price_info):
+		"""
+		Compute everything the configurations of one granularity share. data_engine must have an indicator engine with the longest history and series_only set.
+		"""
+		ta_engine = data_engine.taEngine
+		price_windows = [ta_engine.get_feature_window(prices) for prices in historical_price_info]
+
+		ta_engine.open_pool()
+		try:
+			all_series = ta_engine.get_technical_indicators_for_all(price_windows)
+		finally:
+			ta_engine.close_pool()
+
+		# Feature lists of every symbol for every history, None if its indicators could not be computed
+		features_by_history = {}
+		for history in self.HISTORIES:
+			features_by_history[history] = [ta_engine.get_features(ta_engine.get_technical_indicators_from_series(series, history)) if error is None else None
+											for series, error in all_series]
+
+		# Values of the price screens of a scan, so every configuration is scored on the symbols a scan with its arguments would keep
+		close_prices = [np.asarray(prices["Close"].values, dtype = np.float64) for prices in historical_price_info]
+		self.symbol_data[granularity] = {
+			"symbol_names": symbol_names,
+			"historical_price_info": historical_price_info,
+			"future_price_info": future_price_info,
+			"has_bad_close_prices": {history: np.array([count_bad_close_prices(prices, history) > 0 for prices in close_prices], dtype = bool) for history in self.HISTORIES},
+			"volatilities": np.array([get_volatility(prices) for prices in close_prices]),
+			"average_volumes": np.array([get_average_volume(np.asarray(prices["Volume"].values, dtype = np.float64)) for prices in historical_price_info]),
+			"features_by_history": features_by_history
+		}
+
+	def score_configuration(self, configuration):
+		"""
+		Apply the price screens of a configuration, then fit a detector on the symbols that are left the same way find_anomalies does.
+		Returns the indices of the scored symbols and their anomaly scores.
+		"""
+		symbol_data = self.symbol_data[configuration["data_granularity_minutes"]]
+		all_features = symbol_data["features_by_history"][configuration["history_to_use"]]
+		passes_filters = (~symbol_data["has_bad_close_prices"][configuration["history_to_use"]] & ~(symbol_data["volatilities"] < configuration["volatility_filter"]) &
+							~(symbol_data["average_volumes"] < configuration["min_volume"]))
+		symbol_indices = np.array([i for i in np.flatnonzero(passes_filters) if all_features[i] is not None], dtype = np.int64)
+
+		features = FeatureMatrix(len(symbol_indices))
+		for i in symbol_indices:
+			features.append(all_features[i])
+
+		valid_rows = np.flatnonzero(features.get_valid_rows())
+		symbol_indices = symbol_indices[valid_rows]
+		if len(symbol_indices) < 2:
+			return symbol_indices, np.zeros(len(symbol_indices))
+
+		configuration_features = features.get_rows(valid_rows)
+		detector = create_anomaly_detector(self.DETECTOR, **self.DETECTOR_PARAMETERS)
+		detector.fit(configuration_features)
+		return symbol_indices, detector.decision_function(configuration_features)
+
+	def score_configurations(self, configurations):
+		"""
+		Score every configuration, in parallel if there is more than one worker. Results come back in the order of configurations.
+		"""
+		if self.WORKERS > 1 and len(configurations) > 1:
+			# Workers are forked, so they get the shared prices and features without pickling them
+			with multiprocessing.Pool(min(self.WORKERS, len(configurations)), initializer = initialize_sweep_worker, initargs = (self,)) as pool:
+				return list(pool.imap(score_configuration_in_worker, configurations))
+		return [self.score_configuration(configuration) for configuration in configurations]
@@ -0,0 +1,65 @@
+# Basic libraries
+import collections
+import numpy as np
+
+def count_bad_close_prices(close_prices, history_to_use):
+	"""
+	Missing or non positive close prices in the bars the features of history_to_use are computed from
+	"""
+	recent_close_prices = close_prices[-(history_to_use + 1):]
+	return int(np.sum(~(np.isfinite(recent_close_prices) & (recent_close_prices > 0))))
+
+def get_volatility(close_prices):
+	return np.std(close_prices[close_prices != 0])
+
+def get_average_volume(volumes):
+	return np.mean(volumes[-30:])
+
+class PriceScreens:
+	"""
+	Cheap checks that run on the raw close and volume columns of every fetched symbol, before its price frame and technical indicators are built.
+	Screens run in order and a symbol stops at the first one it fails, so only the survivors pay for the indicators. Bar counts are checked by the
+	data engine itself as the bars screen (missing, partial or broken bars), the other screens are:
+	- zero_prices: a missing or non positive close in the bars the features are computed from, which would give infinite log returns
+	- volatility: standard deviation of the close prices below volatility_filter
+	- volume: average volume of the last 30 bars below min_volume
+	The parameter sweep applies the same screens for every configuration with the functions above.
+	"""
+	SCREENS = ["bars", "zero_prices", "volatility", "volume"]
+
+	def __init__(self, history_to_use, volatility_threshold, volume_threshold, metrics):
+		self.HISTORY_TO_USE = history_to_use
+		self.VOLATILITY_THRESHOLD = volatility_threshold
+		self.VOLUME_THRESHOLD = volume_threshold
+		self.metrics = metrics
+		self.rejected = collections.OrderedDict((name, 0) for name in self.SCREENS)
+		self.passed = 0
+
+	def reject(self, name):
+		self.rejected[name] += 1
+		self.metrics.increment("prefilter_rejected_" + name)
+
+	def screen(self, close_prices, volumes):
+		"""
+		Run the screens on the historical bars of a symbol. Returns None if it passes all of them, otherwise the drop reason and its detail.
+		"""
+		bad_close_prices = count_bad_close_prices(close_prices, self.HISTORY_TO_USE)
+		if bad_close_prices > 0:
+			self.reject("zero_prices")
+			return "zero_prices", "%d bad close prices" % bad_close_prices
+
+		volatility = get_volatility(close_prices)
+		if volatility < self.VOLATILITY_THRESHOLD:
+			self.reject("volatility")
+			return "low_volatility", "%.6f" % volatility
+
+		average_volume = get_average_volume(volumes)
+		if average_volume < self.VOLUME_THRESHOLD:
+			self.reject("volume")
+			return "low_volume", "%.1f" % average_volume
+
+		self.passed += 1
+		return None
+
+	def get_summary(self):
+		return "Pre-filters rejected %s, %d symbols left for the technical indicators" % (", ".join("%s: %d" % item for item in self.rejected.items()), self.passed)
@@ -0,0 +1,138 @@
+# Basic libraries
+import os
+import json
+import time
+import zlib
+import numpy as np
+from symbol_arrays import PriceHistories
+from data_sources import DataError
+
+def get_shard_index(symbol, shard_count):
+	"""
+	Shard of a symbol. crc32 gives the same shard on every host and every run, unlike the salted built-in hash.
+	"""
+	return zlib.crc32(symbol.encode("utf-8")) % shard_count
+
+def get_shard_symbols(symbols, shard_index, shard_count):
+	return [symbol for symbol in symbols if get_shard_index(symbol, shard_count) == shard_index]
+
+def get_shard_dictionary_path(dictionary_path, shard_index, shard_count):
+	"""
+	Data dictionary of one shard worker, e.g. data_dict.shard0of3.npy. Workers on the same host would otherwise overwrite each other's
+	dictionary and share its checkpoint log. The extension is kept, so a .bars path stays a bar store.
+	"""
+	root, extension = os.path.splitext(str(dictionary_path))
+	return "%s.shard%dof%d%s" % (root, shard_index, shard_count, extension)
+
+class ShardDirectory:
+	"""
+	Shared directory where every worker writes the feature matrix, prices and dropped symbols of its shard. A coordinator reads all
+	shards back and merges them into the rows a single process scanning the whole stocks list would have produced.
+	Every shard records the run id of its scan, and only shards with the run id of the coordinator are merged, so shards left over from an
+	earlier run never are. The time the scan started is recorded too, for the error message of a left over shard.
+	"""
+	def __init__(self, directory, shard_count, run_id):
+		self.DIRECTORY = directory
+		self.SHARD_COUNT = shard_count
+		self.RUN_ID = run_id
+
+	def get_shard_path(self, shard_index):
+		return os.path.join(self.DIRECTORY, "shard_%04d_of_%04d.npy" % (shard_index, self.SHARD_COUNT))
+
+	def get_run_path(self, shard_index):
+		"""
+		Small file with the run of a shard, so the coordinator can wait for the shards of its run without loading whole shards
+		"""
+		return os.path.join(self.DIRECTORY, "shard_%04d_of_%04d.json" % (shard_index, self.SHARD_COUNT))
+
+	def save_shard(self, shard_index, settings, features, historical_price_info, future_price_info, symbol_names, symbols_requested, dropped_symbols, scan_start_time):
+		"""
+		Save the scanned symbols of one shard. settings are the arguments that have to match between the workers and the coordinator.
+		Files are written next to the target and renamed, so the coordinator never reads a half written shard. The run file is written last.
+		"""
+		os.makedirs(self.DIRECTORY, exist_ok = True)
+		run = {"run_id": self.RUN_ID, "scan_start_time": scan_start_time}
+		shard = {"shard_index": shard_index, "shard_count": self.SHARD_COUNT, "settings": settings, **run,
+				"symbol_names": list(symbol_names), "features": np.asarray(features),
+				"prices": historical_price_info.prices, "offsets": historical_price_info.offsets,
+				"future_prices": list(future_price_info), "symbols_requested": symbols_requested, "dropped_symbols": dropped_symbols}
+		shard_path = self.get_shard_path(shard_index)
+		with open(shard_path + ".tmp", "wb") as shard_file:
+			np.save(shard_file, shard)
+		os.replace(shard_path + ".tmp", shard_path)
+
+		run_path = self.get_run_path(shard_index)
+		with open(run_path + ".tmp", "w") as run_file:
+			json.dump(run, run_file)
+		os.replace(run_path + ".tmp", run_path)
+		return shard_path
+
+	def is_current_run(self, run):
+		return run.get("run_id") == self.RUN_ID
+
+	def get_missing_shards(self):
+		"""
+		Shards that are not written yet or were left over from an earlier run
+		"""
+		missing_shards = []
+		for shard_index in range(0, self.SHARD_COUNT):
+			run_path = self.get_run_path(shard_index)
+			if not os.path.exists(run_path):
+				missing_shards.append(shard_index)
+				continue
+			with open(run_path) as run_file:
+				if not self.is_current_run(json.load(run_file)):
+					missing_shards.append(shard_index)
+		return missing_shards
+
+	def wait_for_shards(self, wait_seconds, poll_interval_seconds = 1.0):
+		"""
+		Wait until every worker wrote its shard. Returns the indices of the shards that are still missing.
+		"""
+		deadline = time.monotonic() + wait_seconds
+		missing_shards = self.get_missing_shards()
+		while len(missing_shards) > 0 and time.monotonic() < deadline:
+			time.sleep(poll_interval_seconds)
+			missing_shards = self.get_missing_shards()
+		return missing_shards
+
+	def load_shards(self, settings):
+		"""
+		Read every shard. Shards that were scanned with different settings or in another run can not be merged.
+		"""
+		shards = []
+		for shard_index in range(0, self.SHARD_COUNT):
+			shard = np.load(self.get_shard_path(shard_index), allow_pickle = True).item()
+			if shard["settings"] != settings:
+				raise DataError("Shard %d was scanned with %s, but the merge uses %s" % (shard_index, shard["settings"], settings))
+			if not self.is_current_run(shard):
+				raise DataError("Shard %d is left over from an earlier run, it was scanned with run id '%s' at %s" % (shard_index, shard.get("run_id"),
+									time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(shard.get("scan_start_time", 0)))))
+			shards.append(shard)
+		return shards
+
+def merge_shards(shards, stocks_list):
+	"""
+	Concatenate the shards in the order of the stocks list, which is the order a single process scans the symbols in. Symbols that are not in the
+	list go last, by name. Returns features, historical prices, future prices and symbol names like DataEngine.collect_data_for_all_tickers.
+	"""
+	rows = []
+	for shard in shards:
+		offsets = shard["offsets"]
+		for i, symbol in enumerate(shard["symbol_names"]):
+			rows.append((symbol, shard, i, offsets[i], offsets[i + 1]))
+
+	list_positions = {symbol: position for position, symbol in enumerate(stocks_list)}
+	rows.sort(key = lambda row: (list_positions.get(row[0], len(list_positions)), row[0]))
+
+	feature_counts = set(shard["features"].shape[1] for shard in shards if len(shard["symbol_names"]) > 0)
+	if len(feature_counts) > 1:
+		raise DataError("Shards have different numbers of features -> %s" % sorted(feature_counts))
+
+	features = np.zeros((len(rows), feature_counts.pop() if len(feature_counts) > 0 else 0), dtype = np.float32)
+	for row, (_, shard, i, _, _) in enumerate(rows):
+		features[row] = shard["features"][i]
+	historical_price_info = PriceHistories([shard["prices"].iloc[start:end] for _, shard, _, start, end in rows])
+	future_price_info = [shard["future_prices"][i] for _, shard, i, _, _ in rows]
+	symbol_names = [symbol for symbol, _, _, _, _ in rows]
+	return features, historical_price_info, future_price_info, symbol_names
@@ -0,0 +1,166 @@
+# Basic libraries
+import os
+import time
+import socket
+import pandas as pd
+from detectors import IsolationForestDetector
+import warnings
+warnings.filterwarnings("ignore")
+
+def parse_bar(line):
+	"""
+	Parse a csv line with -> symbol, datetime, open, high, low, close, volume. The datetime can be a timestamp string or epoch milliseconds like binance gives them.
+	"""
+	values = line.strip().split(",")
+	if len(values) != 7:
+		raise ValueError("Expected 7 values but got %d" % len(values))
+	try:
+		bar_time = float(values[1])
+	except ValueError:
+		bar_time = pd.Timestamp(values[1].strip())
+	return values[0].strip(), [bar_time] + [float(value) for value in values[2:]]
+
+class FileTailBarSource:
+	"""
+	Reads bars from a csv file that another process keeps appending to, like tail -f. Only lines written after the scanner started are used.
+	"""
+	def __init__(self, path, poll_interval_seconds = 0.05):
+		self.path = path
+		self.POLL_INTERVAL_SECONDS = poll_interval_seconds
+
+	def read_bars(self):
+		with open(self.path, "r") as bar_file:
+			bar_file.seek(0, os.SEEK_END)
+			partial_line = ""
+			while True:
+				line = bar_file.readline()
+				if line == "":
+					time.sleep(self.POLL_INTERVAL_SECONDS)
+					continue
+
+				# The writer may be in the middle of a line
+				partial_line += line
+				if not partial_line.endswith("\n"):
+					continue
+				line, partial_line = partial_line, ""
+
+				if line.strip() == "":
+					continue
+				try:
+					yield parse_bar(line)
+				except ValueError as e:
+					print("Skipping bad bar line", line.strip(), e)
+
+class SocketBarSource:
+	"""
+	Reads bars from a TCP socket, one csv line per bar. Can be used as a stub for a live data feed.
+	"""
+	def __init__(self, address):
+		host, port = address.rsplit(":", 1)
+		self.host = host
+		self.port = int(port)
+
+	def read_bars(self):
+		with socket.create_connection((self.host, self.port)) as connection:
+			for line in connection.makefile("r"):
+				if line.strip() == "":
+					continue
+				try:
+					yield parse_bar(line)
+				except ValueError as e:
+					print("Skipping bad bar line", line.strip(), e)
+
+def create_bar_source(bar_source, address):
+	if bar_source == "socket":
+		return SocketBarSource(address)
+	return FileTailBarSource(address)
+
+class StreamingScanner:
+	"""
+	Keeps the fitted anomaly detector and the latest bars of every symbol in memory. Every new bar only updates the features of its symbol and is scored right away.
+	The detector is refit on all symbols every refit_interval_minutes. A detector that was already fit on the features can be given to skip the first fit,
+	and detector_factory creates the unfitted detectors used for refits.
+	"""
+	def __init__(self, data_engine, symbol_names, historical_price_info, features, refit_interval_minutes = 60, alert_threshold = 0, detector = None, detector_factory = None):
+		print("Streaming scanner has been initialized...")
+		self.dataEngine = data_engine
+		self.taEngine = data_engine.taEngine
+		self.REFIT_INTERVAL_SECONDS = refit_interval_minutes * 60
+		self.ALERT_THRESHOLD = alert_threshold
+
+		# Latest bars and features of every symbol that passed the filters of the initial scan
+		self.prices = {symbol: prices.reset_index(drop = True) for symbol, prices in zip(symbol_names, historical_price_info)}
+		self.features = dict(zip(symbol_names, features))
+
+		if detector_factory is not None:
+			self.create_detector = detector_factory
+
+		self.detector = None
+		self.last_fit_time = 0
+		if detector is not None:
+			self.use_detector(detector)
+		else:
+			self.fit_detector()
+
+	def create_detector(self):
+		return IsolationForestDetector()
+
+	def fit_detector(self):
+		detector = self.create_detector()
+		detector.fit(list(self.features.values()))
+		self.use_detector(detector)
+
+	def use_detector(self, detector):
+		self.detector = detector
+		self.last_fit_time = time.monotonic()
+
+	def align_time(self, bar_time, prices):
+		"""
+		Bars without a time zone are assumed to be in the time zone of the stored bars
+		"""
+		last_time = prices["Datetime"].iloc[-1]
+		if isinstance(bar_time, pd.Timestamp) and isinstance(last_time, pd.Timestamp) and bar_time.tzinfo is None and last_time.tzinfo is not None:
+			return bar_time.tz_localize(last_time.tzinfo)
+		return bar_time
+
+	def add_bar(self, symbol, bar):
+		"""
+		Add a new bar for a symbol and score the symbol again. Returns the anomaly score, or None if the symbol is not scanned or the bar did not change anything.
+		"""
+		if symbol not in self.prices:
+			return None
+
+		prices = self.prices[symbol]
+		new_prices = pd.DataFrame([[self.align_time(bar[0], prices)] + list(bar[1:])], columns = ['Datetime','Open', 'High', 'Low', 'Close', 'Volume'])
+		prices, is_updated = self.dataEngine.merge_new_bars(prices, new_prices)
+		if not is_updated:
+			return None
+		self.prices[symbol] = prices
+
+		features_dictionary = self.taEngine.get_technical_indicators(self.taEngine.get_feature_window(prices))
+		self.features[symbol] = self.taEngine.get_features(features_dictionary)
+
+		# Online detectors learn from the bar after it was scored
+		anomaly_score = self.detector.decision_function_for_sample(self.features[symbol])
+		self.detector.update(self.features[symbol])
+		return anomaly_score
+
+	def run(self, bars):
+		"""
+		Score every (symbol, bar) that comes from bars and print an alert for anomalous ones. Runs until bars is exhausted.
+		"""
+		print("Waiting for new bars...")
+		for symbol, bar in bars:
+			start_time = time.perf_counter()
+			try:
+				anomaly_score = self.add_bar(symbol, bar)
+			except Exception as e:
+				print("Exception", e)
+				continue
+
+			if anomaly_score is not None and anomaly_score < self.ALERT_THRESHOLD:
+				print("Bar Time: %s\nSymbol: %s\nAnomaly Score: %.3f\nScoring Time: %.1f ms\n----------------------" % (bar[0], symbol, anomaly_score, (time.perf_counter() - start_time) * 1000))
+
+			if self.REFIT_INTERVAL_SECONDS > 0 and time.monotonic() - self.last_fit_time >= self.REFIT_INTERVAL_SECONDS:
+				print("Refitting the anomaly detector on %d symbols..." % len(self.features))
+				self.fit_detector()
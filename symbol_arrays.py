@@ -0,0 +1,125 @@
+# Basic libraries
+import collections
+import collections.abc
+import numpy as np
+import pandas as pd
+
+class FeatureMatrix:
+	"""
+	Preallocated matrix with one row of features per symbol. The anomaly detector compares float32 values, so the rows are stored as float32
+	and the matrix is handed to scikit-learn as is. The number of features is the most common one among the rows, so a few short rows never
+	decide it. The matrix starts with the width of the first row, rows of other widths are kept aside until the widths are counted.
+	"""
+	def __init__(self, capacity, dtype = np.float32):
+		self.CAPACITY = capacity
+		self.dtype = dtype
+		self.values = None
+		self.number_of_rows = 0
+
+		# Rows that do not have the width of the matrix, by row, and the number of rows of every width in the order the widths were seen
+		self.other_rows = {}
+		self.width_counts = collections.Counter()
+
+	def append(self, feature_list):
+		if self.values is None:
+			self.values = np.full((self.CAPACITY, len(feature_list)), np.nan, dtype = self.dtype)
+		elif self.number_of_rows == len(self.values):
+			# More rows than expected, grow instead of failing
+			self.values = np.concatenate([self.values, np.full_like(self.values, np.nan)])
+
+		if len(feature_list) == self.values.shape[1]:
+			self.values[self.number_of_rows] = feature_list
+		else:
+			self.other_rows[self.number_of_rows] = np.asarray(feature_list, dtype = self.dtype)
+		self.width_counts[len(feature_list)] += 1
+		self.number_of_rows += 1
+
+	def use_most_common_width(self):
+		"""
+		Switch the matrix to the most common width, the first one seen on a tie. Rows with another width are left as NaN, so they are dropped
+		together with the rows that have NaN values.
+		"""
+		if self.values is None:
+			return
+		width = self.width_counts.most_common(1)[0][0]
+		if width == self.values.shape[1]:
+			return
+		rows_with_width = [row for row, values in self.other_rows.items() if len(values) == width]
+		previous_rows = np.setdiff1d(np.arange(self.number_of_rows), list(self.other_rows))
+		self.other_rows.update((row, self.values[row]) for row in previous_rows)
+		self.values = np.full((len(self.values), width), np.nan, dtype = self.dtype)
+		for row in rows_with_width:
+			self.values[row] = self.other_rows.pop(row)
+
+	def get_valid_rows(self):
+		"""
+		Boolean mask of the rows without NaN values
+		"""
+		if self.values is None:
+			return np.zeros(0, dtype = bool)
+		self.use_most_common_width()
+		return ~np.isnan(self.values[:self.number_of_rows]).any(axis = 1)
+
+	def get_rows(self, symbol_indices):
+		"""
+		Features of the given rows. If every row is used, the filled part of the matrix is returned without a copy.
+		"""
+		if self.values is None:
+			return np.zeros((0, 0), dtype = self.dtype)
+		self.use_most_common_width()
+		if len(symbol_indices) == self.number_of_rows:
+			return self.values[:self.number_of_rows]
+		return self.values[symbol_indices]
+
+class PriceHistories(collections.abc.Sequence):
+	"""
+	Historical prices of all scanned symbols packed into one data frame. Item i is a slice of the bars of symbol i, the same way BarStoreReader hands out prices.
+	"""
+	def __init__(self, all_prices):
+		self.offsets = np.cumsum([0] + [len(prices) for prices in all_prices])
+		if len(all_prices) > 0:
+			self.prices = pd.concat(all_prices, ignore_index = True, copy = False)
+		else:
+			self.prices = pd.DataFrame(columns = ['Datetime','Open', 'High', 'Low', 'Close', 'Volume'])
+
+	def __getitem__(self, i):
+		if isinstance(i, slice):
+			return [self[j] for j in range(*i.indices(len(self)))]
+		if i < 0:
+			i += len(self)
+		if not 0 <= i < len(self):
+			raise IndexError("price history index out of range")
+		# Only the index is new, the columns stay views on the packed data frame
+		prices = self.prices.iloc[self.offsets[i]:self.offsets[i + 1]]
+		prices.index = pd.RangeIndex(len(prices))
+		return prices
+
+	def __len__(self):
+		return len(self.offsets) - 1
+
+	def get_close_volatilities(self, symbol_indices = None, bars_back = 0):
+		"""
+		Standard deviation of the close prices of every symbol, or of the given symbols without their last bars_back bars. All symbols are computed at once.
+		"""
+		if symbol_indices is None:
+			symbol_indices = np.arange(len(self))
+		if len(symbol_indices) == 0:
+			return np.zeros(0)
+
+		# Positions of the bars of every symbol in the packed prices, symbol after symbol
+		starts = self.offsets[symbol_indices]
+		counts = self.offsets[symbol_indices + 1] - starts - bars_back
+		group_starts = np.cumsum(counts) - counts
+		positions = np.repeat(starts - group_starts, counts) + np.arange(counts.sum())
+		close_prices = self.prices["Close"].values[positions]
+
+		mean_prices = np.add.reduceat(close_prices, group_starts) / counts
+		squared_deviations = (close_prices - np.repeat(mean_prices, counts)) ** 2
+		return np.sqrt(np.add.reduceat(squared_deviations, group_starts) / counts)
+
+	def get_future_close_prices(self, symbol_indices, bars_back, future_bars):
+		"""
+		Close prices of the given symbols from the last bar before the cut point bars_back bars from the end, and the future_bars bars after it -> (symbols x future_bars + 1)
+		"""
+		last_positions = self.offsets[symbol_indices + 1] - bars_back - 1
+		return self.prices["Close"].values[last_positions[:, None] + np.arange(future_bars + 1)]
@@ -0,0 +1,250 @@
+# Basic libraries
+import numpy as np
+from scipy.signal import lfilter
+from feature_generator import TAEngine, PRICE_COLUMNS
+import warnings
+warnings.filterwarnings("ignore")
+
+class VectorizedTAEngine(TAEngine):
+	"""
+	Computes the same technical indicators as TAEngine, but for a whole universe at once. Prices of all symbols are stacked
+	into (symbols x bars) matrices and every indicator is a handful of array operations over the matrix instead of one
+	ta library call per symbol. The formulas follow ta 0.5.25 with fillna = True.
+	"""
+	def __init__(self, history_to_use, symbols_per_chunk = 256, verbose = True, series_only = False, feature_keys = None):
+		super().__init__(history_to_use = history_to_use, feature_workers = 1, verbose = verbose, series_only = series_only, feature_keys = feature_keys)
+		self.SYMBOLS_PER_CHUNK = symbols_per_chunk
+
+	def rolling_windows(self, matrix, window, fill_value):
+		"""
+		Returns a (symbols x bars x window) read only view of trailing windows. The first bars are padded with fill_value so partial windows behave like min_periods = 0.
+		"""
+		padding = np.full((matrix.shape[0], window - 1), fill_value, dtype = np.float64)
+		padded = np.ascontiguousarray(np.hstack([padding, matrix]))
+		row_stride, column_stride = padded.strides
+		return np.lib.stride_tricks.as_strided(padded, shape = (matrix.shape[0], matrix.shape[1], window), strides = (row_stride, column_stride, column_stride), writeable = False)
+
+	def forward_fill(self, matrix, fill_value):
+		"""
+		Same as ta's fillna handling: infinite values become nan, nan values are forward filled and whatever is left is set to fill_value
+		"""
+		matrix = np.where(np.isinf(matrix), np.nan, matrix)
+		valid_index = np.where(np.isnan(matrix), 0, np.arange(matrix.shape[1]))
+		np.maximum.accumulate(valid_index, axis = 1, out = valid_index)
+		filled = matrix[np.arange(matrix.shape[0])[:, None], valid_index]
+		filled[np.isnan(filled)] = fill_value
+		return filled
+
+	def diff(self, matrix):
+		difference = np.full(matrix.shape, np.nan)
+		difference[:, 1:] = matrix[:, 1:] - matrix[:, :-1]
+		return difference
+
+	def ewm(self, matrix, alpha):
+		"""
+		Exponential moving average along the bars, same as pandas ewm(alpha = alpha, adjust = False)
+		"""
+		initial_state = (1 - alpha) * matrix[:, :1]
+		smoothed, _ = lfilter([alpha], [1, alpha - 1], matrix, axis = 1, zi = initial_state)
+		return smoothed
+
+	def rsi(self, close, n):
+		difference = self.diff(close)
+		up = np.where(difference > 0, difference, 0.0)
+		down = np.where(difference < 0, -difference, 0.0)
+		ema_up = self.ewm(up, 1.0 / n)
+		ema_down = self.ewm(down, 1.0 / n)
+		rsi = np.where(ema_down == 0, 100, 100 - (100 / (1 + ema_up / ema_down)))
+		return self.forward_fill(rsi, 50)
+
+	def stochastic(self, high, low, close, n):
+		lowest_low = np.nanmin(self.rolling_windows(low, n, np.inf), axis = 2)
+		highest_high = np.nanmax(self.rolling_windows(high, n, -np.inf), axis = 2)
+		stoch = 100 * (close - lowest_low) / (highest_high - lowest_low)
+		return self.forward_fill(stoch, 50)
+
+	def ease_of_movement(self, high, low, volume):
+		# ta 0.5.25 ignores the window length of ease_of_movement, so the same values are used for every history
+		eom = (self.diff(high) + self.diff(low)) * (high - low) / (2 * volume)
+		eom *= 100000000
+		return self.forward_fill(eom, 0)
+
+	def cci(self, high, low, close, n, c = 0.015):
+		typical_price = (high + low + close) / 3.0
+		windows = self.rolling_windows(typical_price, n, np.nan)
+		moving_average = np.nanmean(windows, axis = 2)
+		mean_deviation = np.nanmean(np.abs(windows - moving_average[:, :, None]), axis = 2)
+		cci = (typical_price - moving_average) / (c * mean_deviation)
+		return self.forward_fill(cci, 0)
+
+	def acc_dist(self, high, low, close, volume):
+		close_location_value = ((close - low) - (high - close)) / (high - low)
+		close_location_value = np.where(np.isnan(close_location_value), 0.0, close_location_value)
+		money_flow = close_location_value * volume
+
+		# pandas cumsum skips missing values but keeps them missing in the output
+		acc_dist = np.nancumsum(money_flow, axis = 1)
+		acc_dist[np.isnan(money_flow)] = np.nan
+		return self.forward_fill(acc_dist, 0)
+
+	def daily_log_return(self, close):
+		log_return = self.diff(np.log(close)) * 100
+		return self.forward_fill(log_return, 0)
+
+	def volume_returns(self, volume):
+		"""
+		Returns of the last HISTORY_TO_USE non zero volumes for every symbol. Rows that do not have enough non zero volumes get a shorter list, just like TAEngine.
+		"""
+		number_of_bars = volume.shape[1]
+		is_nonzero = volume != 0
+		nonzero_counts = is_nonzero.sum(axis = 1)
+
+		# Sorting the bar indices puts the non zero bars, in their original order, at the end of every row
+		nonzero_index = np.sort(np.where(is_nonzero, np.arange(number_of_bars), -1), axis = 1)
+		window = min(self.HISTORY_TO_USE + 1, number_of_bars)
+		last_volumes = np.take_along_axis(volume, nonzero_index[:, -window:].clip(0), axis = 1)
+		returns = last_volumes[:, 1:] / last_volumes[:, :-1]
+
+		all_volume_returns = []
+		for i in range(0, volume.shape[0]):
+			if nonzero_counts[i] >= window:
+				all_volume_returns.append(returns[i].tolist())
+			else:
+				volume_list = volume[i][is_nonzero[i]]
+				all_volume_returns.append((volume_list[1:] / volume_list[:-1]).tolist()[-self.HISTORY_TO_USE:])
+		return all_volume_returns
+
+	def add_indicator(self, dictionaries, key, indicator, include_values = True):
+		"""
+		Add the last HISTORY_TO_USE values of an indicator (symbols x bars) and their slope statistics to every symbol's dictionary
+		"""
+		if key not in self.INDICATOR_KEYS:
+			return
+
+		history = indicator[:, -self.HISTORY_TO_USE:]
+		if self.IS_SERIES_ONLY:
+			history = history.tolist()
+			for i in range(0, len(dictionaries)):
+				dictionaries[i][key] = history[i]
+			return
+
+		slopes, r_values, p_values = self.calculate_slopes(history)
+		history = history.tolist()
+		for i in range(0, len(dictionaries)):
+			dictionaries[i][key] = (history[i] if include_values else []) + [slopes[i], r_values[i], p_values[i]]
+
+	def get_technical_indicators_for_matrix(self, high, low, close, volume):
+		"""
+		Compute the technical indicators dictionary of TAEngine for every row of the (symbols x bars) price matrices
+		"""
+		dictionaries = [{} for _ in range(0, close.shape[0])]
+
+		# Indicators that get_features does not use are skipped before they are computed
+		used_keys = set(self.INDICATOR_KEYS)
+
+		# RSI
+		for history in [5, 10, 15]:
+			if "rsi-" + str(history) in used_keys:
+				self.add_indicator(dictionaries, "rsi-" + str(history), self.rsi(close, history))
+
+		# Stochastics
+		for history in [5, 10, 15]:
+			if "stochs-" + str(history) in used_keys:
+				self.add_indicator(dictionaries, "stochs-" + str(history), self.stochastic(high, low, close, history))
+
+		# Accumulation Distribution
+		if "acc_dist" in used_keys:
+			self.add_indicator(dictionaries, "acc_dist", self.acc_dist(high, low, close, volume), include_values = False)
+
+		# Ease of movement
+		if any(key.startswith("eom-") for key in used_keys):
+			eom = self.ease_of_movement(high, low, volume)
+			for history in [5, 10, 20]:
+				self.add_indicator(dictionaries, "eom-" + str(history), eom, include_values = False)
+
+		# CCI
+		for history in [5, 10, 20]:
+			if "cci-" + str(history) in used_keys:
+				self.add_indicator(dictionaries, "cci-" + str(history), self.cci(high, low, close, history))
+
+		# Daily log return
+		if "daily_log_return" in used_keys:
+			daily_log_return = self.daily_log_return(close)[:, -self.HISTORY_TO_USE:]
+			for i in range(0, len(dictionaries)):
+				dictionaries[i]["daily_log_return"] = daily_log_return[i].tolist()
+
+		# Volume difference. Symbols with only a few non zero volumes have shorter lists, so those are regressed separately.
+		if "volume_returns" not in used_keys:
+			return dictionaries
+		all_volume_returns = self.volume_returns(volume)
+		if self.IS_SERIES_ONLY:
+			for i, volume_returns in enumerate(all_volume_returns):
+				dictionaries[i]["volume_returns"] = volume_returns
+			return dictionaries
+
+		slope_statistics = self.calculate_slopes_for_series(dict(enumerate(all_volume_returns)))
+		for i, volume_returns in enumerate(all_volume_returns):
+			dictionaries[i]["volume_returns"] = volume_returns + slope_statistics[i]
+
+		return dictionaries
+
+	def get_technical_indicators(self, price_data):
+		indicators, error = self.get_technical_indicators_for_all([price_data])[0]
+		if error is not None:
+			raise error
+		return indicators
+
+	def get_technical_indicators_for_all(self, price_data_list):
+		"""
+		Compute technical indicators for many symbols. Returns a list of (indicators, error) in the same order as price_data_list.
+		Symbols are grouped by their number of bars so every group forms a rectangular matrix.
+		"""
+		results = [None] * len(price_data_list)
+		symbols_by_length = {}
+		for i, price_data in enumerate(price_data_list):
+			symbols_by_length.setdefault(len(price_data), []).append(i)
+
+		for length in symbols_by_length:
+			indices = symbols_by_length[length]
+			for start in range(0, len(indices), self.SYMBOLS_PER_CHUNK):
+				chunk = indices[start:start + self.SYMBOLS_PER_CHUNK]
+				try:
+					prices = np.stack([np.asarray(price_data_list[i][PRICE_COLUMNS].values, dtype = np.float64) for i in chunk])
+					dictionaries = self.get_technical_indicators_for_matrix(prices[:, :, 1], prices[:, :, 2], prices[:, :, 3], prices[:, :, 4])
+					for i, dictionary in zip(chunk, dictionaries):
+						results[i] = (dictionary, None)
+				except Exception:
+					# Fall back to one symbol at a time so a single bad symbol only drops itself
+					for i in chunk:
+						results[i] = self.get_technical_indicators_for_symbol(price_data_list[i])
+
+		return results
+
+	def get_technical_indicators_for_symbol(self, price_data):
+		try:
+			prices = np.asarray(price_data[PRICE_COLUMNS].values, dtype = np.float64)[None, :, :]
+			return self.get_technical_indicators_for_matrix(prices[:, :, 1], prices[:, :, 2], prices[:, :, 3], prices[:, :, 4])[0], None
+		except Exception as e:
+			return None, e
+
+	def compare_with_ta_engine(self, price_data_list, tolerance = 1e-6):
+		"""
+		Check the output of this engine against the per symbol TAEngine for the given prices. Returns a list of (symbol index, key, largest difference) for every mismatch.
+		"""
+		reference_engine = TAEngine(history_to_use = self.HISTORY_TO_USE, verbose = False, feature_keys = self.FEATURE_KEYS)
+		mismatches = []
+		for i, (indicators, error) in enumerate(self.get_technical_indicators_for_all(price_data_list)):
+			reference_indicators = reference_engine.get_technical_indicators(price_data_list[i])
+			for key in reference_indicators:
+				expected = np.array(reference_indicators[key], dtype = np.float64)
+				actual = np.array(indicators[key], dtype = np.float64) if error is None else np.array([])
+				if expected.shape != actual.shape:
+					mismatches.append((i, key, np.inf))
+					continue
+				difference = np.abs(expected - actual)
+				scale = np.maximum(1, np.abs(expected))
+				both_nan = np.isnan(expected) & np.isnan(actual)
+				relative_difference = np.where(both_nan, 0, difference / scale)
+				if np.nanmax(np.where(np.isnan(relative_difference), np.inf, relative_difference), initial = 0) > tolerance:
+					mismatches.append((i, key, float(np.nanmax(difference))))
+		return mismatches